@@ -0,0 +1,217 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+import numpy as np
+
+from sipl.image import (Image, PILImageIn, PILImageOut, vsplit, vstack,
+                        hstack, dstack)
+from sipl.image.image_serialization_tests import (time_serialization,
+                                                  time_pickling)
+from sipl.image.image_slicing_tests import INDICES, time_slicing
+from sipl.image.image_metadata_tests import time_elementwise
+from sipl.image.image_compression_tests import test_image, time_compression
+from sipl.spark.local_context_tests import time_local_context
+
+# References
+# http://docs.python.org/2/library/resource.html
+# http://docs.python.org/2/library/multiprocessing.html
+
+# Each case times the operations on an image of the given size and dtype,
+# and returns a list of (variant, seconds per operation, bytes per
+# operation).
+
+
+def make_image(megabytes, dtype):
+    """ A colour image of about the given size """
+    dtype = np.dtype(dtype)
+    side = max(1, int(np.sqrt(megabytes * 2 ** 20 / 3 / dtype.itemsize)))
+    return test_image((side, side, 3), dtype)
+
+
+def serialization_case(megabytes, dtype, number):
+    data = np.asarray(make_image(megabytes, dtype))
+    return [(name, seconds, data.nbytes) for name, (seconds, _) in
+            sorted(time_serialization(data, number).iteritems())]
+
+
+def pickling_case(megabytes, dtype, number):
+    seconds, _ = time_pickling(megabytes, dtype, number)
+    return [("round trip", seconds, megabytes * 2 ** 20)]
+
+
+def stack_case(megabytes, dtype, number):
+    image = make_image(megabytes, dtype)
+    results = []
+    for name, axis, stack in [("vsplit/vstack", 0, vstack),
+                              ("hsplit/hstack", 1, hstack),
+                              ("dsplit/dstack", 2, dstack)]:
+
+        # Split along the axis like vsplit does for rows
+        def split_stack():
+            splits = vsplit(image.shape[axis:], 3)
+            index = [slice(None)] * axis
+            return stack([image[tuple(index + [slice(start, start + size)])]
+                          for start, size in splits])
+        if not np.array_equal(split_stack(), image):
+            raise AssertionError("%s round trip failed" % name)
+        seconds = timeit.timeit(split_stack, number=number) / number
+        results.append((name, seconds, image.nbytes))
+    return results
+
+
+def slicing_case(megabytes, dtype, number):
+    image = make_image(megabytes, dtype)
+    results = []
+    for name, index in INDICES:
+        fast, general = time_slicing(image, index, number * 1000)
+        results.append((name, fast, image[index].nbytes))
+        results.append((name + " general", general, image[index].nbytes))
+    return results
+
+
+def finalize_case(megabytes, dtype, number):
+    imageSeconds, arraySeconds = time_elementwise(100, number * 1000)
+    return [("overhead", imageSeconds - arraySeconds, 64 * 64 * 3)]
+
+
+def pil_case(megabytes, dtype, number):
+    image = make_image(megabytes, np.uint8)
+    directory = tempfile.mkdtemp()
+    try:
+        results = []
+        for extension in ["png", "ppm"]:
+            filename = os.path.join(directory, "image." + extension)
+            seconds = timeit.timeit(
+                lambda: PILImageOut(filename=filename)(image),
+                number=number) / number
+            results.append(("out " + extension, seconds, image.nbytes))
+            if not np.array_equal(PILImageIn()(filename), image):
+                raise AssertionError("%s round trip failed" % extension)
+            seconds = timeit.timeit(lambda: PILImageIn()(filename),
+                                    number=number) / number
+            results.append(("in " + extension, seconds, image.nbytes))
+        return results
+    finally:
+        shutil.rmtree(directory)
+
+
+def codec_case(megabytes, dtype, number):
+    image = make_image(megabytes, dtype)
+    results = []
+    for codec in ["zlib", "bz2"]:
+        _, encode, decode = time_compression(image, codec, True, number)
+        size = image.nbytes / float(2 ** 20)
+        results.append((codec + " encode", size / encode, image.nbytes))
+        results.append((codec + " decode", size / decode, image.nbytes))
+    return results
+
+
+def rdd_case(megabytes, dtype, number):
+    seconds = time_local_context(megabytes, number=number)
+    return [("local context", seconds, megabytes * 2 ** 20)]
+
+
+# The cases, and whether they depend on the dtype
+CASES = [("serialization", serialization_case, True),
+         ("pickling", pickling_case, True),
+         ("stack", stack_case, True),
+         ("slicing", slicing_case, True),
+         ("finalize", finalize_case, False),
+         ("pil", pil_case, False),
+         ("codec", codec_case, True),
+         ("rdd", rdd_case, False)]
+
+
+def rss_megabytes():
+    """ The peak resident memory of this process so far. ru_maxrss is in
+    kilobytes on Linux. """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_case(case, megabytes, dtype, number, connection):
+    """ Run a case in a fresh process and send back its results, with the
+    memory it used on top of what the process started with """
+
+    startMemory = rss_megabytes()
+    try:
+        results = case(megabytes, dtype, number)
+        connection.send((results, rss_megabytes() - startMemory, None))
+    except Exception, e:
+        connection.send(([], 0, "%s: %s" % (type(e).__name__, e)))
+    connection.close()
+
+
+def run_benchmarks(names, sizes, dtypes, number):
+    """ Run the cases over the sizes and dtypes. Returns a list of result
+    dictionaries. """
+
+    records = []
+    for name, case, usesDtype in CASES:
+        if names and name not in names:
+            continue
+        for megabytes in sizes:
+            for dtype in dtypes if usesDtype else [None]:
+
+                # Fork for each run, so the peak memory is its own
+                receiver, sender = multiprocessing.Pipe(False)
+                process = multiprocessing.Process(
+                    target=run_case,
+                    args=(case, megabytes, dtype or "uint8", number, sender))
+                process.start()
+                results, memory, error = receiver.recv()
+                process.join()
+
+                if error is not None:
+                    print >> sys.stderr, "%s %s MB %s failed: %s" % (
+                        name, megabytes, dtype, error)
+                for variant, seconds, nbytes in results:
+                    records.append({"case": name,
+                                    "variant": variant,
+                                    "megabytes": megabytes,
+                                    "dtype": dtype,
+                                    "seconds": seconds,
+                                    "throughput": nbytes / seconds / 2 ** 20,
+                                    "peakMemory": memory})
+                    print >> sys.stderr, "%-13s %-22s %5s MB %-9s " \
+                        "%10.3f ms %10.1f MB/s %8.1f MB" % (
+                            name, variant, megabytes, dtype or "",
+                            seconds * 1e3, records[-1]["throughput"], memory)
+    return records
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark sipl")
+    parser.add_argument("--cases", nargs="*", default=[],
+                        choices=[name for name, _, _ in CASES])
+    parser.add_argument("--sizes", nargs="*", type=float, default=[1, 8, 64],
+                        help="image sizes in MB")
+    parser.add_argument("--dtypes", nargs="*",
+                        default=["uint8", "uint16", "float32", "complex64"])
+    parser.add_argument("--number", type=int, default=3,
+                        help="repeats of each timing")
+    parser.add_argument("--output", help="json file, instead of stdout")
+    args = parser.parse_args()
+
+    # Record the environment with the results, so runs can be compared
+    report = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": platform.python_version(),
+              "numpy": np.__version__,
+              "platform": platform.platform(),
+              "cpus": multiprocessing.cpu_count(),
+              "results": run_benchmarks(args.cases, args.sizes, args.dtypes,
+                                        args.number)}
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print json.dumps(report, indent=2)
@@ -3,6 +3,8 @@ from _version import __version__
 
 # Globals
 DEFAULT_NUM_SPLITS = None
+DEFAULT_CHUNK_BYTES = 64 * 2 ** 20
 
 # Imports
-from algorithm import Algorithm
+from algorithm import Algorithm, Pipeline, Scratch
+from profiling import Profiler
@@ -1,27 +1,257 @@
+import os
+import threading
+import numpy as np
+
+from profiling import Profiler
+
+
+class PartitionProfiler(threading.local):
+
+    """ The profiler recording the partition a thread is running, if any.
+    It takes the place of Algorithm.profiler on that thread only, so
+    partitions running on threads at the same time don't take each other's
+    calls. """
+
+    profiler = None
+
+
+_partitionProfiler = PartitionProfiler()
+
+
+def profiled(call):
+    """ Wrap the __call__ method of an algorithm, so it is recorded by the
+    profiler if there is one. Otherwise it costs two attribute lookups. """
+
+    def __call__(self, input, *args, **kwargs):
+        profiler = _partitionProfiler.profiler or Algorithm.profiler
+        if profiler is None:
+            return call(self, input, *args, **kwargs)
+        return profiler.call(self, call, input, args, kwargs)
+
+    __call__.__doc__ = call.__doc__
+    return __call__
+
+
+class ProfiledType(type):
+
+    """ The metaclass of algorithms, which wraps the __call__ method of
+    every Algorithm class for profiling """
+
+    def __init__(cls, name, bases, dct):
+        type.__init__(cls, name, bases, dct)
+        if "__call__" in dct:
+            cls.__call__ = profiled(dct["__call__"])
+
+
 class Algorithm(object):
 
     """ The base class for all algorithms """
 
+    __metaclass__ = ProfiledType
+
     # The algorithm parameters, which are set during object initialization
     # and usually used during algorithm invocation. Each param is automatically
     # added to the object's __dict__ and accessed through the "." operator.
     _params = {}
 
+    # Whether the algorithm transforms a single chunk without needing any
+    # other chunk, so a Pipeline can fuse it with its neighbours
+    chunkLocal = False
+
+    # Whether the algorithm may write its result into its input. A Pipeline
+    # makes sure the input is a private copy first.
+    inPlace = False
+
+    # Whether __call__ takes a "scratch" keyword with a Scratch of buffers
+    # that are reused for every chunk of a partition
+    usesScratch = False
+
+    # The Profiler recording the calls of every algorithm, if profiling is
+    # enabled (see profiling.Profiler)
+    profiler = None
+
     def __init__(self, **kwargs):
         """ Create an instance of an Algorithm, which can be reused. Once
         created, the object is invoked through the __call__ method, or "()".
         Run __call__ with an object of whatever needs to be transformed. """
 
-        # Update the params with the keyword arguments
-        self._params.update(kwargs)
+        # Update a copy of the default params with the keyword arguments, so
+        # instances don't share their params through the class
+        params = dict(self._params)
+        params.update(kwargs)
 
         # Store the params as the class object's dictionary. Allows a user
         # to type in "obj.whatever" to set/retrieve values in the params
         # dictionary
-        self.__dict__ = self._params
+        self.__dict__ = params
 
     def __call__(self, input, **kwargs):
         """ Execute the algorithm on the input """
 
         # This method needs to be overwritten in the derived class
         raise NotImplementedError("Must overwrite the __call__ method")
+
+    def __or__(self, other):
+        """ Chain two algorithms into a Pipeline, as in "a | b" """
+        return Pipeline(self, other)
+
+
+class Scratch(object):
+
+    """ Scratch buffers which are reused for every chunk of a partition.
+    A buffer is only valid until the next chunk, so it must never be
+    returned as the result of an algorithm. """
+
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, name, shape, dtype):
+        """ Get the buffer with the given name as an uninitialized array of
+        shape and dtype. The memory is reused whenever it is large enough. """
+
+        dtype = np.dtype(dtype)
+        numBytes = int(np.prod(shape)) * dtype.itemsize
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.nbytes < numBytes:
+            buffer = self._buffers[name] = np.empty(numBytes, np.uint8)
+        return buffer[:numBytes].view(dtype).reshape(shape)
+
+
+def run_chunk(algorithms, chunk, scratch):
+    """ Run chunk-local algorithms on a single chunk in turn """
+
+    # Whether the chunk is a private array that may be written in place
+    owned = False
+
+    for algorithm in algorithms:
+
+        # Never write into a chunk the caller may still hold
+        if algorithm.inPlace and not owned:
+            chunk = chunk.copy()
+
+        # Run the algorithm
+        if algorithm.usesScratch:
+            result = algorithm(chunk, scratch=scratch)
+        else:
+            result = algorithm(chunk)
+
+        # Results of the same shape, such as those of elementwise numpy
+        # operations, keep the dimData of the chunk
+        if (getattr(result, "_dims", False) is None and
+                getattr(chunk, "_dims", None) is not None and
+                result.shape == chunk.shape):
+            result._dimData = chunk._dims
+
+        # A result which doesn't share memory with its input is private
+        owned = algorithm.inPlace or not np.may_share_memory(result, chunk)
+        chunk = result
+
+    return chunk
+
+
+def run_partition_chunks(algorithms, chunks):
+    """ Run chunk-local algorithms on each chunk of a partition in turn """
+    scratch = Scratch()
+    for chunk in chunks:
+        yield run_chunk(algorithms, chunk, scratch)
+
+
+def profile_partition(chunks, accumulator, driverPid):
+    """ Profile the algorithms run while iterating over a partition on an
+    executor, and add the records to the accumulator at the end. In the
+    driver's own process (such as on threads) the driver's profiler is used
+    as it is while it is enabled.
+
+    The partition's profiler is only active on the calling thread, and only
+    while the next chunk is being computed, so it never records the calls
+    of other partitions or of whatever consumes the chunks. """
+
+    if Algorithm.profiler is not None and os.getpid() == driverPid:
+        for chunk in chunks:
+            yield chunk
+        return
+
+    profiler = Profiler()
+    chunks = iter(chunks)
+    while True:
+        previous = _partitionProfiler.profiler
+        _partitionProfiler.profiler = profiler
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            break
+        finally:
+            _partitionProfiler.profiler = previous
+        yield chunk
+    accumulator.add(profiler.records)
+
+
+class Pipeline(Algorithm):
+
+    """ A chain of algorithms, called in order. On an rdd, each run of
+    consecutive chunk-local algorithms is fused into a single mapPartitions,
+    so a chunk goes through all of them in one pass with shared scratch
+    buffers. Other algorithms are called with the rdd itself. On anything
+    else, such as a single image, every algorithm is called in turn. """
+
+    def __init__(self, *algorithms, **kwargs):
+
+        Algorithm.__init__(self, **kwargs)
+
+        # Flatten nested pipelines, so "a | b | c" is a single chain
+        self.algorithms = []
+        for algorithm in algorithms:
+            if isinstance(algorithm, Pipeline):
+                self.algorithms.extend(algorithm.algorithms)
+            else:
+                self.algorithms.append(algorithm)
+
+    def stages(self):
+        """ Group the algorithms into stages. Consecutive chunk-local
+        algorithms share a stage, and any other algorithm is a stage of its
+        own. Returns a list of (chunkLocal, algorithms) tuples. """
+
+        stages = []
+        for algorithm in self.algorithms:
+            if algorithm.chunkLocal and stages and stages[-1][0]:
+                stages[-1][1].append(algorithm)
+            else:
+                stages.append((algorithm.chunkLocal, [algorithm]))
+        return stages
+
+    def __call__(self, input):
+
+        isRDD = hasattr(input, "mapPartitions")
+
+        # Executors send their records to the driver's profiler through its
+        # accumulator
+        profiler = Algorithm.profiler
+        accumulator = None
+        if profiler is not None:
+            accumulator = profiler.accumulator
+            driverPid = profiler.pid
+
+        for chunkLocal, algorithms in self.stages():
+
+            # Fuse the chunk-local algorithms into one pass per partition
+            if chunkLocal and isRDD and accumulator is not None:
+                def run_partition(chunks, algorithms=algorithms):
+                    for chunk in profile_partition(
+                            run_partition_chunks(algorithms, chunks),
+                            accumulator, driverPid):
+                        yield chunk
+                input = input.mapPartitions(run_partition)
+
+            elif chunkLocal and isRDD:
+                def run_partition(chunks, algorithms=algorithms):
+                    return run_partition_chunks(algorithms, chunks)
+                input = input.mapPartitions(run_partition)
+
+            elif chunkLocal:
+                input = run_chunk(algorithms, input, Scratch())
+
+            else:
+                input = algorithms[0](input)
+                isRDD = hasattr(input, "mapPartitions")
+
+        return input
@@ -1,2 +1,5 @@
 from hdfs_algorithms import HDFSToRDD, RDDToHDFS
 from hdfs_utils import hdfs_rm, hdfs_rmdir, hdfs_exists, hdfs_ls
+from filesystem import (FileSystem, LocalFileSystem, HDFSFileSystem,
+                        get_filesystem)
+from chunk_store import read_index, select_chunks
@@ -0,0 +1,151 @@
+import json
+import os
+import numpy as np
+
+from sipl.image import Image
+from sipl.image.image import read_binary_header, decode_unicode, local_path
+from sipl.image.compression import decode
+
+# References
+# http://docs.scipy.org/doc/numpy/reference/generated/numpy.memmap.html
+# https://github.com/enthought/distributed-array-protocol
+
+# A chunk store is a directory of raw block files, one per partition, and an
+# index. Each block holds its chunks back to back in the binary wire format.
+# The index maps every chunk's proc_grid_rank and dimData extents to the
+# block and byte offsets it was written at, so readers can map a single chunk
+# without parsing anything else.
+INDEX_FILENAME = "index.json"
+INDEX_VERSION = 1
+
+# The image-level metadata the chunks of a store may refer to
+METADATA_FILENAME = "metadata.json"
+
+
+def is_chunk_store(path):
+    """ Check if a path is a chunk store on the local filesystem """
+    return os.path.isfile(os.path.join(local_path(path), INDEX_FILENAME))
+
+
+def write_chunks(path, partitionIndex, images, codec=None, shuffle=True):
+    """ Write a partition of images to a block file in the chunk store,
+    compressed with codec if it is set. Returns the index entries of the
+    written chunks. """
+
+    # Name the block like the part files of saveAsTextFile
+    block = "part-%05d" % partitionIndex
+    entries = []
+
+    with open(os.path.join(local_path(path), block), "wb") as f:
+        for image in images:
+
+            # Write the header and then the pixels straight from the array.
+            # Compressed chunks are written whole, as the header records the
+            # payload length.
+            offset = f.tell()
+            if codec in (None, "none"):
+                f.write(image._binary_header())
+                dataOffset = f.tell()
+                f.write(np.ascontiguousarray(image).data)
+            else:
+                data = image.dumpb(codec, shuffle)
+                dataOffset = offset + read_binary_header(data)[1]
+                f.write(data)
+
+            # Record where the chunk ended up
+            dimData = image._dimData
+            entries.append({"block": block,
+                            "offset": offset,
+                            "dataOffset": dataOffset,
+                            "length": f.tell() - offset,
+                            "rank": [d["proc_grid_rank"] for d in dimData],
+                            "extents": [[d["start"], d["stop"]]
+                                        for d in dimData]})
+
+    return entries
+
+
+def write_index(path, entries):
+    """ Write the index of a chunk store, ordered by proc_grid_rank """
+
+    entries = sorted(entries, key=lambda entry: entry["rank"])
+    with open(os.path.join(local_path(path), INDEX_FILENAME), "wt") as f:
+        json.dump({"version": INDEX_VERSION, "chunks": entries}, f)
+
+
+def read_index(path):
+    """ Read the index entries of a chunk store """
+
+    with open(os.path.join(local_path(path), INDEX_FILENAME), "rt") as f:
+        index = json.load(f, object_hook=decode_unicode)
+    if index["version"] > INDEX_VERSION:
+        raise ValueError("Unsupported chunk store version %d" %
+                         index["version"])
+    return index["chunks"]
+
+
+def select_chunks(entries, ranks=None, window=None):
+    """ Select index entries by proc_grid_rank or by a window of global
+    (start, stop) extents. A rank can be an int, which matches the first
+    axis, or a tuple matching the leading axes. A chunk is selected if it
+    overlaps the window on every axis the window gives. """
+
+    selected = []
+    for entry in entries:
+
+        # Check the ranks
+        if ranks is not None:
+            matches = False
+            for rank in ranks:
+                if isinstance(rank, int):
+                    rank = (rank,)
+                if tuple(entry["rank"][:len(rank)]) == tuple(rank):
+                    matches = True
+            if not matches:
+                continue
+
+        # Check the window
+        if window is not None:
+            overlaps = [start < extent[1] and extent[0] < stop
+                        for (start, stop), extent in
+                        zip(window, entry["extents"])]
+            if not all(overlaps):
+                continue
+
+        selected.append(entry)
+
+    return selected
+
+
+def read_chunk(path, entry, mmap=True):
+    """ Read a single chunk from the chunk store. Only its header is parsed.
+    The pixels are memory mapped, or read with a single ranged read if mmap
+    is False or they are compressed. """
+
+    filename = os.path.join(local_path(path), entry["block"])
+    with open(filename, "rb") as f:
+
+        # Read the header of the chunk
+        f.seek(entry["offset"])
+        header, _ = read_binary_header(
+            f.read(entry["dataOffset"] - entry["offset"]))
+        dtype = np.dtype(header["dtype"])
+        shape = tuple(header["shape"])
+        count = int(np.prod(shape))
+
+        # Read and decompress compressed pixels. Otherwise map or read them.
+        # Empty chunks cannot be mapped.
+        if "codec" in header:
+            codec = header["codec"]
+            data = decode(f.read(codec["length"]), dtype, shape,
+                          codec["name"], codec["shuffle"])
+        elif mmap and count:
+            data = np.memmap(filename, dtype, "r", entry["dataOffset"], shape)
+        else:
+            f.seek(entry["dataOffset"])
+            data = np.fromfile(f, dtype, count).reshape(shape)
+
+    image = data.view(Image)
+    image.metadata.update(header["metadata"])
+    image._dimData = header["dimData"]
+    return image
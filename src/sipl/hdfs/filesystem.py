@@ -0,0 +1,255 @@
+import glob
+import os
+import shutil
+import subprocess
+import time
+from fnmatch import fnmatchcase
+from urlparse import urlparse
+
+# References
+# http://hadoop.apache.org/docs/stable/hadoop-project-dist/hadoop-common/FileSystemShell.html
+# http://snakebite.readthedocs.org/en/latest/client.html
+
+# snakebite talks to the namenode over its RPC protocol from Python, so one
+# client serves every call. Without it, each batch of paths costs one
+# "hdfs dfs" process (and JVM).
+try:
+    from snakebite.client import Client, AutoConfigClient
+    from snakebite.errors import FileNotFoundException
+except ImportError:
+    Client = AutoConfigClient = FileNotFoundException = None
+
+
+def _paths(paths):
+    """ Normalize a path or a list of paths to a list. Returns the list and
+    whether a single path was given. """
+
+    if isinstance(paths, basestring):
+        return [paths], True
+    return list(paths), False
+
+
+def _matches(path, pattern):
+    """ Whether a path matches a glob, a component at a time, as * and ?
+    don't match a "/". Braces are not supported. """
+
+    parts = path.rstrip("/").split("/")
+    patternParts = pattern.rstrip("/").split("/")
+    return len(parts) == len(patternParts) and all(
+        fnmatchcase(part, patternPart)
+        for part, patternPart in zip(parts, patternParts))
+
+
+class FileSystem(object):
+
+    """ Batched filesystem operations. Each method takes a path or a list of
+    paths, which may be globs. Listings are dictionaries with the path, type
+    ("file" or "directory"), size in bytes and modification time in
+    seconds since the epoch. """
+
+    def ls(self, paths, recursive=False):
+        """ List the files and directories at the paths, or in them if they
+        are directories """
+        raise NotImplementedError("Must overwrite ls method")
+
+    def exists(self, paths):
+        """ Check if paths exist. Returns a bool, or a list of bools for a
+        list of paths. """
+        raise NotImplementedError("Must overwrite exists method")
+
+    def rm(self, paths, recursive=False):
+        """ Remove files, or directories and their contents if recursive is
+        set. Missing paths are ignored. """
+        raise NotImplementedError("Must overwrite rm method")
+
+    def rmdir(self, paths):
+        """ Remove empty directories """
+        raise NotImplementedError("Must overwrite rmdir method")
+
+    def mkdir(self, paths):
+        """ Make directories and any missing parents """
+        raise NotImplementedError("Must overwrite mkdir method")
+
+
+class LocalFileSystem(FileSystem):
+
+    """ The local filesystem. Paths may have a file:// scheme. """
+
+    @staticmethod
+    def _local(path):
+        return urlparse(path).path if path.startswith("file://") else path
+
+    @staticmethod
+    def _entry(path):
+        stat = os.stat(path)
+        return {"path": path,
+                "type": "directory" if os.path.isdir(path) else "file",
+                "size": stat.st_size,
+                "modified": stat.st_mtime}
+
+    def _glob(self, paths):
+        paths, _ = _paths(paths)
+        return [match for path in paths
+                for match in sorted(glob.glob(self._local(path)))]
+
+    def ls(self, paths, recursive=False):
+        entries = []
+        for path in self._glob(paths):
+            if not os.path.isdir(path):
+                entries.append(self._entry(path))
+            elif recursive:
+                for root, dirs, files in os.walk(path):
+                    entries.extend(self._entry(os.path.join(root, name))
+                                   for name in sorted(dirs + files))
+            else:
+                entries.extend(self._entry(os.path.join(path, name))
+                               for name in sorted(os.listdir(path)))
+        return entries
+
+    def exists(self, paths):
+        paths, single = _paths(paths)
+        exists = [bool(glob.glob(self._local(path))) for path in paths]
+        return exists[0] if single else exists
+
+    def rm(self, paths, recursive=False):
+        for path in self._glob(paths):
+            if os.path.isdir(path) and recursive:
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+    def rmdir(self, paths):
+        for path in self._glob(paths):
+            os.rmdir(path)
+
+    def mkdir(self, paths):
+        for path in _paths(paths)[0]:
+            path = self._local(path)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+
+class HDFSFileSystem(FileSystem):
+
+    """ The Hadoop File System. Uses a long lived snakebite client if it is
+    installed, and otherwise runs one "hdfs dfs" command per batch. The
+    namenode is taken from the Hadoop configuration unless host is set.
+    Without snakebite, exists only understands the *, ? and [] of globs. """
+
+    def __init__(self, host=None, port=8020):
+        self.host = host
+        self.port = port
+        self._client = None
+        if Client is not None:
+            self._client = (Client(host, port) if host else
+                            AutoConfigClient())
+
+    def _path(self, path):
+        """ The path on the namenode, for snakebite """
+        return urlparse(path).path if "://" in path else path
+
+    def _dfs(self, *args):
+        """ Run an hdfs dfs command. Returns its exit code and output. """
+
+        process = subprocess.Popen(["hdfs", "dfs"] + list(args),
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        output, _ = process.communicate()
+        return process.returncode, output
+
+    def ls(self, paths, recursive=False):
+        paths, _ = _paths(paths)
+        if self._client is not None:
+            return [{"path": entry["path"],
+                     "type": ("directory" if entry["file_type"] == "d"
+                              else "file"),
+                     "size": entry["length"],
+                     "modified": entry["modification_time"] / 1000.0}
+                    for entry in self._client.ls(map(self._path, paths),
+                                                 recurse=recursive)]
+
+        # Parse the listing of the shell, which has lines like
+        # drwxr-xr-x   - user group          0 2016-01-01 00:00 /path
+        _, output = self._dfs("-ls", *(["-R"] if recursive else []) + paths)
+        entries = []
+        for line in output.splitlines():
+            fields = line.split(None, 7)
+            if len(fields) != 8:
+                continue
+            perms, _, _, _, size, date, clock, path = fields
+            entries.append({"path": path,
+                            "type": ("directory" if perms.startswith("d")
+                                     else "file"),
+                            "size": int(size),
+                            "modified": time.mktime(time.strptime(
+                                date + " " + clock, "%Y-%m-%d %H:%M"))})
+        return entries
+
+    def exists(self, paths):
+        paths, single = _paths(paths)
+        if self._client is not None:
+            exists = [self._client.test(self._path(path), exists=True)
+                      for path in paths]
+
+        # List the paths themselves with a single command. The listing
+        # leaves out any that are missing, and has the matches of globs.
+        else:
+            _, output = self._dfs("-ls", "-d", *paths)
+            listed = [self._path(line.split(None, 7)[-1])
+                      for line in output.splitlines()
+                      if len(line.split(None, 7)) == 8]
+            exists = [any(_matches(entry, self._path(path))
+                          for entry in listed) for path in paths]
+
+        return exists[0] if single else exists
+
+    def rm(self, paths, recursive=False):
+        paths, _ = _paths(paths)
+        if self._client is not None:
+
+            # snakebite stops at the first missing path, so delete each
+            # path on its own
+            for path in paths:
+                try:
+                    list(self._client.delete([self._path(path)],
+                                             recurse=recursive))
+                except FileNotFoundException:
+                    pass
+        else:
+            self._dfs("-rm", "-f", *(["-r"] if recursive else []) + paths)
+
+    def rmdir(self, paths):
+        paths, _ = _paths(paths)
+        if self._client is not None:
+            list(self._client.rmdir(map(self._path, paths)))
+        else:
+            self._dfs("-rmdir", *paths)
+
+    def mkdir(self, paths):
+        paths, _ = _paths(paths)
+        if self._client is not None:
+            list(self._client.mkdir(map(self._path, paths),
+                                    create_parent=True))
+        else:
+            self._dfs("-mkdir", "-p", *paths)
+
+
+# The filesystems made so far, by scheme and namenode, so their clients are
+# reused
+_filesystems = {}
+
+
+def get_filesystem(path):
+    """ The filesystem of a path. file:// paths are local, and anything else
+    is on the Hadoop File System, like the paths given to Spark. """
+
+    url = urlparse(path)
+    key = (url.scheme, url.netloc)
+    if key not in _filesystems:
+        if url.scheme == "file":
+            _filesystems[key] = LocalFileSystem()
+        elif url.netloc:
+            _filesystems[key] = HDFSFileSystem(url.hostname, url.port or 8020)
+        else:
+            _filesystems[key] = HDFSFileSystem()
+    return _filesystems[key]
@@ -1,19 +1,44 @@
+import base64
+import os
+
 from sipl import DEFAULT_NUM_SPLITS, Algorithm
 from sipl.image import Image
+from sipl.image.image import write_shared_metadata, refer_metadata
+from sipl.image.compression import get_codec
+from chunk_store import (local_path, is_chunk_store, write_chunks,
+                         write_index, read_index, select_chunks, read_chunk,
+                         METADATA_FILENAME)
 
 
 class HDFSToRDD(Algorithm):
 
-    """ An image reader for the Hadoop File System. Reads into an RDD."""
+    """ An image reader for the Hadoop File System. Reads into an RDD. Chunk
+    stores written by RDDToHDFS(format="chunks") are memory mapped, and can
+    be limited to the chunks with the given ranks or overlapping a window
+    of global (start, stop) extents. """
 
     _params = {"numSplits": DEFAULT_NUM_SPLITS,
-               "context": None}
+               "context": None,
+               "ranks": None,
+               "window": None}
 
     def __call__(self, filename):
 
-        # Load an rdd from hdfs. Will load as text.
         if not self.context:
             raise RuntimeError("Must set ImageToRDD.context")
+
+        # Distribute the index entries of a chunk store and map each chunk
+        # on the executor that reads it
+        if is_chunk_store(filename):
+            entries = select_chunks(read_index(filename), self.ranks,
+                                    self.window)
+            rdd = self.context.parallelize(entries, self.numSplits)
+
+            def read(entry):
+                return read_chunk(filename, entry)
+            return rdd.map(read)
+
+        # Load an rdd from hdfs. Will load as text.
         rdd = self.context.textFile(filename, self.numSplits)
 
         # Deserialize the text rdd into an rdd of images and return
@@ -24,9 +49,53 @@ class HDFSToRDD(Algorithm):
 
 class RDDToHDFS(Algorithm):
 
-    _params = {"filename": None}
+    """ Save an RDD of images. The text format works with any Hadoop path.
+    The chunks format writes raw blocks and a byte-offset index to a path on
+    a filesystem shared by the executors. Setting codec compresses each
+    chunk (see sipl.image.compression), after a byte shuffle of multi-byte
+    dtypes if shuffle is set. The codec is recorded in each chunk's header,
+    so HDFSToRDD decompresses the chunks on the executors. If shareMetadata
+    is set, the chunks format writes the metadata of the first chunk to the
+    store once, and each chunk only keeps a reference to it and the keys
+    whose values differ. """
+
+    _params = {"filename": None,
+               "format": "text",
+               "codec": None,
+               "shuffle": True,
+               "shareMetadata": False}
 
     def __call__(self, rdd):
 
-        # Save the rdd to hdfs
-        rdd.saveAsTextFile(self.filename)
+        # Check the codec on the driver rather than in every task
+        codec = self.codec
+        shuffle = self.shuffle
+        get_codec(codec or "none")
+
+        # Save the rdd to hdfs. Compressed images are base64 encoded binary.
+        if self.format == "text":
+            if codec not in (None, "none"):
+                def dump(x):
+                    return base64.b64encode(x.dumpb(codec, shuffle))
+                rdd = rdd.map(dump)
+            rdd.saveAsTextFile(self.filename)
+
+        # Write each partition to its own block and then index the chunks
+        elif self.format == "chunks":
+            path = local_path(self.filename)
+            os.makedirs(path)
+
+            # Write the metadata the chunks refer to
+            if self.shareMetadata:
+                ref = write_shared_metadata(
+                    os.path.join(path, METADATA_FILENAME),
+                    rdd.first().metadata)
+                rdd = rdd.map(lambda x: refer_metadata(x, ref))
+
+            def write(partitionIndex, images):
+                return write_chunks(path, partitionIndex, images, codec,
+                                    shuffle)
+            write_index(path, rdd.mapPartitionsWithIndex(write).collect())
+
+        else:
+            raise ValueError("Unknown RDDToHDFS.format %s" % self.format)
@@ -1,19 +1,23 @@
-from subprocess import call
-import os
+from filesystem import get_filesystem
+
+# These work on any path sipl can save to. Each call is a single batched
+# operation on a filesystem client that is kept for later calls.
 
 
 def hdfs_rm(path):
-    call(["hdfs", "dfs", "-rm", "-f", os.path.join(path, "*")])
-    call(["hdfs", "dfs", "-rmdir", path])
+    """ Remove a saved rdd, or any directory, and its contents """
+    get_filesystem(path).rm(path, recursive=True)
 
 
 def hdfs_rmdir(path):
-    call(["hdfs", "dfs", "-rmdir", path])
+    get_filesystem(path).rmdir(path)
 
 
 def hdfs_exists(path):
-    return not call(["hdfs", "dfs", "-ls", path])
+    return get_filesystem(path).exists(path)
 
 
-def hdfs_ls(path="hdfs://localhost:9000/*"):
-    return call(["hdfs", "dfs", "-ls", path])
+def hdfs_ls(path="hdfs://localhost:9000/*", recursive=False):
+    """ List a path. Returns a list of dictionaries with the path, type,
+    size and modification time of each entry. """
+    return get_filesystem(path).ls(path, recursive)
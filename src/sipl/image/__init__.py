@@ -1,3 +1,6 @@
 from image import Image, ImageIn, ImageOut
-from image_utils import vsplit, vstack, hstack, dstack
+from image_utils import (vsplit, tilesplit, ndsplit, crop_halo, place,
+                         assemble, concatenate, stack_grid, vstack, hstack,
+                         dstack)
+from streamImage import StreamImageOut
 from pilImage import ImageToPIL, PILImageIn, PILImageOut
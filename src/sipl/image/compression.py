@@ -0,0 +1,76 @@
+import bz2
+import zlib
+import numpy as np
+
+# References
+# http://docs.python.org/2/library/zlib.html
+# http://docs.python.org/2/library/bz2.html
+# https://pypi.python.org/pypi/backports.lzma
+# http://www.blosc.org/pages/blosc-in-depth/ (the byte shuffle filter)
+
+# lzma is only in the standard library from Python 3.3, so use the backport
+# if it is installed
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# The compressors, by the name recorded in a chunk's header. Each is a
+# (compress, decompress) pair of functions on strings.
+CODECS = {"none": (str, str),
+          "zlib": (lambda s: zlib.compress(s, 6), zlib.decompress),
+          "bz2": (lambda s: bz2.compress(s, 9), bz2.decompress)}
+if lzma is not None:
+    CODECS["lzma"] = (lambda s: lzma.compress(s, preset=6), lzma.decompress)
+
+
+def get_codec(name):
+    """ The (compress, decompress) pair of a codec """
+
+    if name not in CODECS:
+        if name == "lzma":
+            raise ValueError("The lzma codec needs the backports.lzma package")
+        raise ValueError("Unknown codec %s" % name)
+    return CODECS[name]
+
+
+def shuffle(data, itemsize):
+    """ Group the bytes of a buffer of items by their significance, so the
+    slowly changing high bytes of multi-byte pixels compress together """
+
+    data = np.frombuffer(data, np.uint8)
+    return data.reshape((-1, itemsize)).T.tostring()
+
+
+def unshuffle(data, itemsize):
+    """ Reverse shuffle """
+
+    data = np.frombuffer(data, np.uint8)
+    return data.reshape((itemsize, -1)).T.tostring()
+
+
+def encode(array, codec, shuffled=True):
+    """ Compress the pixels of an array. Multi-byte dtypes are shuffled first
+    if shuffled is set. Returns the payload and whether it was shuffled. """
+
+    compress, _ = get_codec(codec)
+    data = np.ascontiguousarray(array).data
+    shuffled = shuffled and array.dtype.itemsize > 1
+    if shuffled:
+        data = shuffle(data, array.dtype.itemsize)
+    return compress(data), shuffled
+
+
+def decode(payload, dtype, shape, codec, shuffled):
+    """ Decompress the pixels of an array encoded by encode. The array is a
+    read-only view of the decompressed string. """
+
+    _, decompress = get_codec(codec)
+    dtype = np.dtype(dtype)
+    data = decompress(payload)
+    if shuffled:
+        data = unshuffle(data, dtype.itemsize)
+    return np.frombuffer(data, dtype).reshape(shape)
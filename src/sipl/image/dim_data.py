@@ -0,0 +1,161 @@
+import collections
+
+# References
+# http://distributed-array-protocol.readthedocs.org/en/rel-0.9.0/#
+# http://docs.python.org/2/library/collections.html#collections-abstract-base-classes
+
+# The keys of the dim_data dictionaries of the distributed array protocol, in
+# the order they are stored in an axis tuple
+DIM_KEYS = ("dist_type", "size", "proc_grid_size", "proc_grid_rank",
+            "start", "stop", "padding")
+_DIM_INDEX = dict((key, i) for i, key in enumerate(DIM_KEYS))
+_DIM_DEFAULTS = ("b", 1, 1, 0, 0, 1, (0, 0))
+
+
+def axis_tuple(axis):
+    """ Convert a dim_data dictionary, or an axis tuple, to an axis tuple """
+
+    if isinstance(axis, tuple):
+        return axis
+
+    # Json turns the padding into a list, so make it a tuple again
+    axis = [axis.get(key, default)
+            for key, default in zip(DIM_KEYS, _DIM_DEFAULTS)]
+    axis[_DIM_INDEX["padding"]] = tuple(axis[_DIM_INDEX["padding"]])
+    return tuple(axis)
+
+
+class DimData(object):
+
+    """ The dim_data of an image for the distributed array protocol. Each
+    axis is stored as an immutable tuple, so copies share the tuples and are
+    only replaced when an axis is written (copy on write). Indexing an axis
+    gives a view that reads and writes like a dim_data dictionary. """
+
+    __slots__ = ("_axes",)
+
+    def __init__(self, axes=()):
+        self._axes = tuple(axis_tuple(axis) for axis in axes)
+
+    @staticmethod
+    def from_shape(shape):
+        """ The default dim_data of a single block covering the shape """
+
+        dimData = DimData()
+        dimData._axes = tuple(("b", int(n), 1, 0, 0, int(n), (0, 0))
+                              for n in shape)
+        return dimData
+
+    def copy(self):
+        """ A copy which shares the axis tuples until they are written """
+
+        dimData = DimData()
+        dimData._axes = self._axes
+        return dimData
+
+    def window(self, extents):
+        """ The dim_data of a window of local (start, stop) extents along the
+        leading axes. The window owns the part of each axis it shares with
+        the region this dim_data owns, and the rest of it is padding. """
+
+        axes = list(self._axes)
+        for i, (windowStart, windowStop) in enumerate(extents):
+            distType, size, gridSize, rank, start, stop, padding = axes[i]
+
+            # Convert the window to global indices
+            windowStart += start - padding[0]
+            windowStop += start - padding[0]
+
+            # Intersect it with the owned region
+            start = min(max(start, windowStart), windowStop)
+            stop = max(min(stop, windowStop), start)
+            axes[i] = (distType, size, gridSize, rank, start, stop,
+                       (start - windowStart, windowStop - stop))
+
+        dimData = DimData()
+        dimData._axes = tuple(axes)
+        return dimData
+
+    def tolist(self):
+        """ The dim_data as a list of dictionaries """
+        return [dict(zip(DIM_KEYS, axis)) for axis in self._axes]
+
+    def insert(self, index, axis):
+        axes = list(self._axes)
+        axes.insert(index, axis_tuple(axis))
+        self._axes = tuple(axes)
+
+    def __len__(self):
+        return len(self._axes)
+
+    def __iter__(self):
+        return (_AxisView(self, i) for i in range(len(self._axes)))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            dimData = DimData()
+            dimData._axes = self._axes[index]
+            return dimData
+        return _AxisView(self, range(len(self._axes))[index])
+
+    def __setitem__(self, index, axis):
+        axes = list(self._axes)
+        axes[index] = axis_tuple(axis)
+        self._axes = tuple(axes)
+
+    def __eq__(self, other):
+        if not isinstance(other, DimData):
+            other = DimData(other)
+        return self._axes == other._axes
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __reduce__(self):
+        return (DimData, (self._axes,))
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+
+class _AxisView(collections.MutableMapping):
+
+    """ A view of one axis of a DimData, which reads and writes like a
+    dim_data dictionary """
+
+    __slots__ = ("_dimData", "_index")
+
+    def __init__(self, dimData, index):
+        self._dimData = dimData
+        self._index = index
+
+    def __getitem__(self, key):
+        return self._dimData._axes[self._index][_DIM_INDEX[key]]
+
+    def __setitem__(self, key, value):
+        axes = self._dimData._axes
+        axis = list(axes[self._index])
+        axis[_DIM_INDEX[key]] = tuple(value) if key == "padding" else value
+        self._dimData._axes = (axes[:self._index] + (tuple(axis),) +
+                               axes[self._index + 1:])
+
+    def __delitem__(self, key):
+        raise TypeError("dim_data keys can't be deleted")
+
+    def __iter__(self):
+        return iter(DIM_KEYS)
+
+    def __len__(self):
+        return len(DIM_KEYS)
+
+    def __deepcopy__(self, memo):
+        return dict(self)
+
+    def __repr__(self):
+        return repr(dict(self))
@@ -1,18 +1,120 @@
 import numpy as np
 import json
 import base64
-import copy
+import collections
+import hashlib
+import struct
+from itertools import chain
 from cStringIO import StringIO
 from pprint import pprint
 from os.path import abspath
 
 from sipl import Algorithm
+from dim_data import DimData
+from compression import encode, decode
 
 # References
 # http://docs.scipy.org/doc/numpy/user/basics.subclassing.html
 # https://github.com/enthought/distributed-array-protocol
 # http://distributed-array-protocol.readthedocs.org/en/rel-0.9.0/#
 # http://docs.scipy.org/doc/numpy/reference/generated/numpy.asarray.html
+# http://docs.python.org/2/library/struct.html
+
+# The binary wire format. A fixed preamble (magic, format version and header
+# length) is followed by a json header describing the array and then the raw
+# pixel buffer. The header is padded so the pixels start on an ALIGNMENT byte
+# boundary, which lets readers view them in place with np.frombuffer. From
+# version 2 the pixels may be compressed, as recorded by the header's codec.
+MAGIC = "SIPL"
+FORMAT_VERSION = 2
+ALIGNMENT = 64
+_PREAMBLE = struct.Struct("<4sBI")
+
+# Text files hold one image per line, so binary images are base64 encoded.
+# The encoded magic is known from its first three bytes.
+BASE64_MAGIC = base64.b64encode(MAGIC[:3])
+
+# Out-of-band pickling of the pixels needs pickle protocol 5, which is only
+# available from the standard library in Python 3.8+ or the pickle5 backport.
+try:
+    from pickle import PickleBuffer
+except ImportError:
+    try:
+        from pickle5 import PickleBuffer
+    except ImportError:
+        PickleBuffer = None
+
+
+# Image-level metadata can be stored once, in a sidecar json file, and
+# referred to by the chunks of the image. A chunk's metadata then holds the
+# reference under METADATA_REF next to its chunk-local keys, and the rest is
+# read from the sidecar when it is first needed in each process. The
+# reference is the path and a hash of the contents, "path#hash", so a
+# process never takes a sidecar rewritten at the same path for the one it
+# cached.
+METADATA_REF = "__metadataRef__"
+_sharedMetadata = {}
+
+
+def metadata_version(data):
+    """ The version of the json contents of a sidecar file """
+    return hashlib.sha1(data).hexdigest()[:16]
+
+
+def write_shared_metadata(path, metadata):
+    """ Write metadata to the sidecar file at path, so images can refer to
+    it. Returns the reference to give refer_metadata. """
+
+    metadata = dict(metadata)
+    data = json.dumps(metadata)
+    with open(local_path(path), "w") as f:
+        f.write(data)
+    ref = "%s#%s" % (path, metadata_version(data))
+    _sharedMetadata[ref] = metadata
+    return ref
+
+
+def shared_metadata(ref):
+    """ The metadata a reference made by write_shared_metadata refers to.
+    Raises an IOError if the sidecar file was rewritten since. """
+
+    metadata = _sharedMetadata.get(ref)
+    if metadata is None:
+        path, _, version = ref.rpartition("#")
+        with open(local_path(path)) as f:
+            data = f.read()
+        if metadata_version(data) != version:
+            raise IOError("The metadata in %s changed after it was referred "
+                          "to" % path)
+        metadata = json.loads(data, object_hook=decode_unicode)
+        _sharedMetadata[ref] = metadata
+    return metadata
+
+
+def refer_metadata(image, ref):
+    """ A view of an image whose metadata refers to the shared metadata of
+    the reference ref, and only keeps the keys whose values differ from
+    it. Images without some of the shared keys keep their own metadata, as
+    the keys would reappear. """
+
+    shared = shared_metadata(ref)
+    metadata = image.metadata
+    if any(key not in metadata for key in shared):
+        return image
+
+    local = dict((key, value) for key, value in metadata.iteritems()
+                 if key not in shared or shared[key] != value)
+    local[METADATA_REF] = ref
+    view = Image(image)
+    view.metadata = local
+    return view
+
+
+def local_path(path):
+    """ Strip the file:// scheme from a path on the local filesystem """
+    if path.startswith("file://"):
+        return path[len("file://"):]
+    return path
 
 
 class ImageJSONEncoder(json.JSONEncoder):
@@ -22,6 +124,8 @@ class ImageJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, Image):
             return Image._dump(obj)
+        if isinstance(obj, DimData):
+            return obj.tolist()
         if isinstance(obj, str):
             return obj
         if isinstance(obj, unicode):
@@ -31,15 +135,68 @@ class ImageJSONEncoder(json.JSONEncoder):
 
 def construct_image(dct):
     """ Used to reconstruct the image from a pickled object. Must be a function
-    at the base level and not a static method of a class. """
+    at the base level and not a static method of a class. Accepts either the
+    legacy json dictionary or a buffer in the binary wire format. """
+
+    # Binary buffers are viewed in place rather than decoded
+    if not isinstance(dct, dict):
+        return construct_binary_image(dct)
+
     data = base64.b64decode(dct["data"])
     image = np.frombuffer(data, dct["dtype"]).reshape(dct["shape"])
     image = image.view(Image)
-    image.metadata.update(json.loads(dct["metadata"]))
+    image.metadata = json.loads(dct["metadata"])
     image._dimData = dct["dimData"]
     return image
 
 
+def construct_binary_image(buf):
+    """ Reconstruct an image from a buffer in the binary wire format. The
+    pixels are not copied, so the image is read-only when the buffer is.
+    Compressed pixels are decompressed into a new read-only buffer. """
+
+    header, offset = read_binary_header(buf)
+    if "codec" in header:
+        codec = header["codec"]
+        buf = decode(buffer(buf, offset, codec["length"]), header["dtype"],
+                     header["shape"], codec["name"], codec["shuffle"])
+        offset = 0
+    return rebuild_image(buf, header["dtype"], header["shape"],
+                         header["metadata"], header["dimData"], offset)
+
+
+def read_binary_header(buf):
+    """ Read the header of the binary wire format from the start of a buffer.
+    Returns the header dictionary and the byte offset of the pixels. """
+
+    # Check the preamble
+    magic, version, headerLength = _PREAMBLE.unpack_from(buf)
+    if magic != MAGIC:
+        raise ValueError("Buffer is not a binary sipl image")
+    if version > FORMAT_VERSION:
+        raise ValueError("Unsupported binary sipl image version %d" % version)
+
+    # Read the header without assuming the buffer type supports slicing
+    header = np.frombuffer(buf, np.uint8, headerLength, _PREAMBLE.size)
+    header = json.loads(header.tostring(), object_hook=decode_unicode)
+    return header, _PREAMBLE.size + headerLength
+
+
+def rebuild_image(data, dtype, shape, metadata, dimData, offset=0):
+    """ Used to reconstruct the image from an out-of-band pickle. The pixels
+    arrive as a buffer and are viewed in place. """
+    image = np.frombuffer(data, dtype, int(np.prod(shape)), offset)
+    image = image.reshape(shape).view(Image)
+    image.metadata = metadata
+    image._dimData = dimData
+    return image
+
+
+def is_binary_image(s):
+    """ Check if a string holds an image in the binary wire format """
+    return s[:len(MAGIC)] == MAGIC
+
+
 def image_json_hook(data):
     """ Used by json to deserialize into an Image object """
 
@@ -48,6 +205,12 @@ def image_json_hook(data):
         return construct_image(data)
 
     # Otherwise, decode unicode strings and return
+    return decode_unicode(data)
+
+
+def decode_unicode(data):
+    """ Used by json to decode unicode keys and values into strings """
+
     rv = {}
     for key, value in data.iteritems():
         if isinstance(key, unicode):
@@ -74,36 +237,132 @@ def dim_data_dict(dist_type='b', size=1, proc_grid_size=1, proc_grid_rank=0,
 
 def default_dim_data(obj):
     """ Create a default structure for data used by __distarray__ """
-    return [dim_data_dict(size=int(dim), stop=int(dim)) for dim in obj.shape]
+    return DimData.from_shape(obj.shape)
+
+
+class Metadata(collections.MutableMapping):
+
+    """ The metadata of an image. Images created from other images share the
+    same dictionary, which is only copied when one of them writes to it
+    (copy on write). This is a view of the image's dictionary which makes
+    the copy before any change. Keys which aren't in the dictionary are read
+    from the shared metadata it refers to, if any. """
+
+    __slots__ = ("_image",)
+
+    def __init__(self, image):
+        self._image = image
+
+    def _shared(self):
+        """ The shared metadata the image refers to, or None """
+
+        meta = self._image._meta
+        if meta is None or METADATA_REF not in meta:
+            return None
+        return shared_metadata(meta[METADATA_REF])
+
+    def _own(self):
+        """ Get a dictionary which only the image owns, for writing """
+
+        image = self._image
+        if image._meta is None:
+            image._meta = {}
+        elif image._metaShared:
+            image._meta = dict(image._meta)
+        image._metaShared = False
+        return image._meta
+
+    def __getitem__(self, key):
+        meta = self._image._meta
+        if meta is not None:
+            if key in meta and key != METADATA_REF:
+                return meta[key]
+            if METADATA_REF in meta:
+                return shared_metadata(meta[METADATA_REF])[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self._own()[key] = value
+
+    def __delitem__(self, key):
+
+        # Take a copy of the shared metadata to delete one of its keys
+        meta = self._own()
+        if METADATA_REF in meta:
+            shared = shared_metadata(meta.pop(METADATA_REF))
+            for sharedKey, value in shared.iteritems():
+                meta.setdefault(sharedKey, value)
+        del meta[key]
+
+    def __iter__(self):
+        meta = self._image._meta or {}
+        shared = self._shared()
+        if shared is None:
+            return iter(meta)
+        return chain((key for key in meta if key != METADATA_REF),
+                     (key for key in shared if key not in meta))
+
+    def __len__(self):
+        if self._shared() is None:
+            return len(self._image._meta or ())
+        return sum(1 for _ in self)
+
+    def __contains__(self, key):
+        meta = self._image._meta or {}
+        if key in meta and key != METADATA_REF:
+            return True
+        shared = self._shared()
+        return shared is not None and key in shared
+
+    def update(self, *args, **kwargs):
+        self._own().update(*args, **kwargs)
+
+    def copy(self):
+        return dict(self)
+
+    def __repr__(self):
+        return repr(self.copy())
 
 
 class Image(np.ndarray):
 
     """ The base class for all the file readers. """
 
+    # The metadata dictionary, whether other images share it, and the
+    # dimData. Images only store them once they are set, so elementwise
+    # operations on images without metadata allocate nothing extra.
+    _meta = None
+    _metaShared = False
+    _dims = None
+
     def __new__(cls, inputArray=np.zeros((0, 0, 0), dtype=np.uint8)):
 
         # Use asarray to make the memory contiguous and have copy by default
         obj = np.asarray(inputArray).view(cls)
-        obj.metadata = {}
 
-        # If the input array has metadata, update the object. Don't use getattr
-        # as it will just copy a reference to the original.
-        if hasattr(inputArray, "metadata"):
-            obj.metadata.update(inputArray.metadata)
+        # If the input array is an image, share its metadata until one of
+        # them writes to it. Otherwise copy any metadata it has.
+        if getattr(inputArray, "_meta", None) is not None:
+            obj._share_metadata(inputArray)
+        elif hasattr(inputArray, "metadata"):
+            obj.metadata = inputArray.metadata
 
-        # Ditto with the dimData
-        obj._dimData = default_dim_data(obj)
-        if hasattr(inputArray, "_dimData"):
-            obj._dimData = copy.deepcopy(inputArray._dimData)
+        # Ditto with the dimData, which is copied on write. If it is unset,
+        # the default for the shape is created when it is read.
+        if getattr(inputArray, "_dims", None) is not None:
+            obj._dimData = inputArray._dims
 
         # Return the created object
         return obj
 
     @staticmethod
     def loads(s):
-        """ Load an image from a json string. """
+        """ Load an image from a binary, base64 binary or json string. """
 
+        if s[:len(BASE64_MAGIC)] == BASE64_MAGIC:
+            s = base64.b64decode(s)
+        if is_binary_image(s):
+            return construct_binary_image(s)
         return json.loads(s, object_hook=image_json_hook)
 
     def __array_finalize__(self, obj):
@@ -112,16 +371,55 @@ class Image(np.ndarray):
         if obj is None:
             return
 
-        # Create an empty metadata
-        self.metadata = {}
+        # If it exists, share the metadata of the original object. The
+        # dimData is left unset, and defaults to a single block of the
+        # object's shape when it is read.
+        if getattr(obj, "_meta", None) is not None:
+            self._share_metadata(obj)
+
+    def _share_metadata(self, image):
+        """ Share the metadata of another image until either writes to it """
+
+        self._meta = image._meta
+        self._metaShared = True
+        image._metaShared = True
+
+    def _get_metadata(self):
+        return Metadata(self)
+
+    def _set_metadata(self, metadata):
+        self._meta = dict(metadata)
+        self._metaShared = False
+
+    # The metadata, which is copied on write
+    metadata = property(_get_metadata, _set_metadata)
+
+    def _get_dim_data(self):
 
-        # If it exists, grab the metadata from the original object. Again,
-        # don't use getattr as it will copy a reference.
-        if hasattr(obj, "metadata"):
-            self.metadata.update(obj.metadata)
+        # Create a default _dimData for the object the first time it is read
+        if self._dims is None:
+            self._dims = default_dim_data(self)
+        return self._dims
 
-        # Create a _dimData for the object
-        self._dimData = default_dim_data(obj)
+    def _set_dim_data(self, dimData):
+
+        # Copy the dimData, so writing an axis doesn't change the original.
+        # The axes themselves are only copied when they are written.
+        if isinstance(dimData, DimData):
+            self._dims = dimData.copy()
+        else:
+            self._dims = DimData(dimData)
+
+    # The dim_data for __distarray__, as a compact DimData
+    _dimData = property(_get_dim_data, _set_dim_data)
+
+    def copy(self, order="C"):
+        """ Copy the pixels, keeping the metadata and dimData """
+
+        image = np.ndarray.copy(self, order)
+        if self._dims is not None:
+            image._dimData = self._dims
+        return image
 
     def __distarray__(self):
         """ For use in the distributed array protocol. The defaults are a
@@ -130,27 +428,78 @@ class Image(np.ndarray):
 
         return {"__version__": "0.9.0",
                 "buffer": buffer(self),
-                "dim_data": self._dimData}
+                "dim_data": self._dimData.tolist()}
 
     def _dump(self):
         """ Store the state of the array. Used in pickling and
         json serialization """
 
         # b64encoding is much faster and smaller than tostring()
-        data64 = base64.b64encode(self.data)
+        data64 = base64.b64encode(np.ascontiguousarray(self).data)
 
         # Store the necessary information to recreate the object
         return {"data": data64,
                 "dtype": str(self.dtype),
                 "shape": self.shape,
-                "metadata": json.dumps(self.metadata),
+                "metadata": json.dumps(self._meta or {}),
                 "dimData": self._dimData}
 
+    def _binary_header(self, codec=None):
+        """ Create the preamble and header of the binary wire format. The raw
+        pixel buffer, or the payload described by codec, must be written
+        directly after it. """
+
+        # Describe the array. Use dtype.str to keep the byte order.
+        header = {"dtype": self.dtype.str,
+                  "shape": self.shape,
+                  "metadata": self._meta or {},
+                  "dimData": self._dimData.tolist()}
+
+        # Uncompressed images are still version 1, for older readers
+        version = 1
+        if codec is not None:
+            header["codec"] = codec
+            version = FORMAT_VERSION
+        header = json.dumps(header)
+
+        # Pad with whitespace so the pixels are aligned
+        length = _PREAMBLE.size + len(header)
+        header += " " * (-length % ALIGNMENT)
+        return _PREAMBLE.pack(MAGIC, version, len(header)) + header
+
+    def dumpb(self, codec=None, shuffle=True):
+        """ Dump the image to a string in the binary wire format. The pixels
+        are compressed with codec (see compression.CODECS) unless it is None
+        or "none", after a byte shuffle if shuffle is set. """
+
+        if codec in (None, "none"):
+            return (self._binary_header() +
+                    np.ascontiguousarray(self).tostring())
+
+        payload, shuffled = encode(self, codec, shuffle)
+        return self._binary_header({"name": codec,
+                                    "shuffle": shuffled,
+                                    "length": len(payload)}) + payload
+
     def __reduce__(self):
         """ Used during pickling. """
 
         # The second item must be a tuple, so I made a tuple with one item
-        return (construct_image, (self._dump(),))
+        return (construct_image, (self.dumpb(),))
+
+    def __reduce_ex__(self, protocol):
+        """ Used during pickling. With protocol 5 the pixels are handed to
+        pickle as an out-of-band buffer and only the metadata and dimData are
+        pickled in band. Older protocols use the binary wire format. """
+
+        if protocol < 5 or PickleBuffer is None:
+            return self.__reduce__()
+
+        # Only non-contiguous images need a copy to expose a single buffer
+        data = np.ascontiguousarray(self)
+        return (rebuild_image, (PickleBuffer(data), self.dtype.str,
+                                self.shape, self._meta or {},
+                                self._dimData))
 
     def __str__(self):
 
@@ -164,7 +513,7 @@ class Image(np.ndarray):
         reprString = StringIO()
 
         # Pretty print to the buffer
-        pprint({"metadata": self.metadata,
+        pprint({"metadata": self._meta or {},
                 "_dimData": self._dimData,
                 "data": np.copy(self),
                 "id": "0x%x" % id(self)}, reprString)
@@ -177,64 +526,100 @@ class Image(np.ndarray):
 
     def __getitem__(self, index):
 
-        # The return value
-        retVal = Image(np.ndarray.__getitem__(self, index))
-
-        # Ensure we are passing an iterable object to the next code block
-        if type(index) != tuple:
-            index = [index]
+        # Take the fast path for ints and slices with a step of one, which
+        # covers almost all indexing of chunks
+        items = index if type(index) == tuple else (index,)
+        if len(items) <= self.ndim:
+            extents = []
+            for item, size in zip(items, self.shape):
+                if type(item) == slice and item.step in (None, 1):
+                    start, stop, _ = item.indices(size)
+                    extents.append((start, max(start, stop)))
+                elif (isinstance(item, (int, long, np.integer)) and
+                      not isinstance(item, bool)):
+                    # Ints keep their dimension, like the general path
+                    start = item + size if item < 0 else item
+                    if not 0 <= start < size:
+                        raise IndexError("index %d is out of bounds for "
+                                         "size %d" % (item, size))
+                    extents.append((start, start + 1))
+                else:
+                    break
+            else:
+                return self._window(extents)
 
-        # Create an empty dim data dict for each dimension in index
-        dimData = copy.deepcopy(retVal._dimData)
+        return self._getitem_general(index)
 
-        # In case we insert an empty dimension and need to offset our reads
-        addedDims = 0
+    def _window(self, extents):
+        """ A view of a window of local (start, stop) extents along the
+        leading axes, with its dimData """
 
-        # Enumerate through the dimensions and fix the distData
-        for i in range(len(index)):
+        index = tuple(slice(start, stop) for start, stop in extents)
+        window = np.ndarray.__getitem__(self, index)
+        window._dimData = self._dimData.window(extents)
+        return window
 
-            # If the current slice is None, keep the dimension empty. This can
-            # occur if we just add an arbitrary dimension, such as
-            # np.array([[[[[1]]]]])
-            if index[i] is None:
-                dimData.insert(i, dim_data_dict())
-                addedDims += 1
+    def _getitem_general(self, index):
+        """ Index the image with anything numpy supports. Nones, Ellipsis,
+        ints and slices keep the dimData of the axes they index like
+        _window, and ints keep their dimension. A slice with a step takes
+        the extents of the pixels it spans. Anything else, such as an index
+        array, gives the result the default dimData. """
 
-            # Otherwise we are good, parse the dimdata from the parent array
+        # The return value
+        retVal = Image(np.ndarray.__getitem__(self, index))
+        items = list(index) if type(index) == tuple else [index]
+
+        # Only basic indexing keeps the dimData
+        for item in items:
+            if not (item is None or item is Ellipsis or
+                    type(item) == slice or
+                    (isinstance(item, (int, long, np.integer)) and
+                     not isinstance(item, bool))):
+                return retVal
+
+        # Expand the Ellipsis, or the missing trailing axes, to whole axes
+        numAxes = sum(1 for item in items
+                      if item is not None and item is not Ellipsis)
+        ellipsis = [i for i, item in enumerate(items) if item is Ellipsis]
+        fill = [slice(None)] * (self.ndim - numAxes)
+        if ellipsis:
+            items[ellipsis[0]:ellipsis[0] + 1] = fill
+        else:
+            items.extend(fill)
+
+        # The local extents of each axis, the shape with ints kept as
+        # single rows, and where the new axes go
+        extents = []
+        shape = []
+        newAxes = []
+        axes = iter(self.shape)
+        for item in items:
+            if item is None:
+                newAxes.append(len(shape))
+                shape.append(1)
+                continue
+            size = next(axes)
+            if type(item) == slice:
+                start, stop, step = item.indices(size)
+                picked = range(start, stop, step)
+                if picked:
+                    extents.append((min(picked), max(picked) + 1))
+                else:
+                    start = min(max(start, 0), size)
+                    extents.append((start, start))
+                shape.append(len(picked))
             else:
+                start = item + size if item < 0 else item
+                extents.append((start, start + 1))
+                shape.append(1)
 
-                # Keep the code clean
-                parentIndex = i - addedDims
-                parentData = self._dimData[parentIndex]
-
-                # If we still have dimension info from the parent, use it
-                if parentIndex < len(self._dimData):
-                    dimData[i] = copy.deepcopy(parentData)
-
-                # Fix the slice indices for the current dimension
-                if type(index[i]) == int:
-                    # A single int index was passed. Start + 1 = Stop
-                    start = parentData["start"] + index[i]
-                    dimData[i]["start"] = start
-                    dimData[i]["stop"] = start + 1
-                    # Also add a dimension in the return array
-                    newShape = list(retVal.shape)
-                    newShape.insert(i, 1)
-                    retVal = retVal.reshape(newShape)
-
-                else:
-                    # Otherwise it was a slice. Calculate the start and stop.
-                    if index[i].start is None:
-                        dimData[i]["start"] = parentData["start"]
-                    else:
-                        dimData[i]["start"] = parentData[
-                            "start"] + index[i].start
-                    if index[i].stop is None:
-                        dimData[i]["stop"] = parentData["stop"]
-                    else:
-                        dimData[i]["stop"] = index[i].stop
+        # Add the new axes to the dimData of the window
+        dimData = self._dimData.window(extents)
+        for i in newAxes:
+            dimData.insert(i, dim_data_dict())
 
-        # Return
+        retVal = retVal.reshape(shape)
         retVal._dimData = dimData
         return retVal
 
@@ -272,7 +657,7 @@ class ImageIn(Algorithm, Image):
 
 class ImageOut(Algorithm):
 
-    params = {"filename": None}
+    _params = {"filename": None}
 
     def __call__(self, image, **kwargs):
         raise NotImplementedError("Must overwrite __call__ method")
@@ -0,0 +1,65 @@
+import numpy as np
+import time
+
+from image import Image
+from compression import CODECS
+
+# References
+# http://www.blosc.org/pages/blosc-in-depth/
+
+
+def test_image(shape, dtype, noise=0.01):
+    """ A representative image: smooth structure across the full range of
+    the dtype plus a little sensor noise """
+
+    rows, cols = np.mgrid[:shape[0], :shape[1]] / float(max(shape[:2]))
+    image = (np.sin(8 * rows) * np.cos(5 * cols) + 1) / 2
+    image = image[..., np.newaxis].repeat(shape[2], axis=2)
+    image += np.random.normal(0, noise, image.shape)
+    image = np.clip(image, 0, 1)
+
+    dtype = np.dtype(dtype)
+    if dtype.kind in "ui":
+        image = image * np.iinfo(dtype).max
+    elif dtype.kind == "c":
+        image = image + 1j * image[::-1]
+    return Image(image.astype(dtype))
+
+
+def time_compression(image, codec, shuffle, number=3):
+    """ Time a compressed dump/load round trip of an image. Returns the
+    compression ratio and the encode and decode throughput in MB/s. """
+
+    # Make sure the round trip is lossless before timing it
+    payload = image.dumpb(codec, shuffle)
+    if not np.array_equal(Image.loads(payload), image):
+        raise AssertionError("%s round trip was lossy" % codec)
+
+    def best(f):
+        seconds = []
+        for _ in range(number):
+            start = time.time()
+            f()
+            seconds.append(time.time() - start)
+        return min(seconds)
+
+    megabytes = image.nbytes / float(2 ** 20)
+    encodeSeconds = best(lambda: image.dumpb(codec, shuffle))
+    decodeSeconds = best(lambda: Image.loads(payload))
+    return (image.nbytes / float(len(payload)), megabytes / encodeSeconds,
+            megabytes / decodeSeconds)
+
+
+if __name__ == "__main__":
+
+    # The matrix of codecs against dtypes, with and without the shuffle
+    for dtype in ["uint8", "uint16", "float32", "complex64"]:
+        image = test_image((1024, 1024, 3), dtype)
+        for codec in sorted(CODECS):
+            for shuffle in [False, True]:
+                ratio, encode, decode = time_compression(image, codec,
+                                                         shuffle)
+                print "%-9s %-4s %-7s ratio %6.2f  encode %8.1f MB/s  " \
+                    "decode %8.1f MB/s" % (dtype, codec,
+                                           "shuffle" if shuffle else "",
+                                           ratio, encode, decode)
@@ -0,0 +1,38 @@
+import numpy as np
+import timeit
+
+from image import Image
+
+
+def time_elementwise(numKeys, number=2000):
+    """ Time an elementwise expression on an image with numKeys metadata
+    entries and on the same pixels as a plain array. Returns the seconds per
+    expression of each. """
+
+    # Build a chunk with a large metadata dictionary, like EXIF or geo tags
+    image = Image(np.zeros((64, 64, 3), dtype=np.uint8))
+    for i in range(numKeys):
+        image.metadata["key%d" % i] = i
+    array = np.asarray(image)
+
+    # The expression used by the map functions in scripts/main.py
+    def expression(x):
+        return (x * 0.5).astype(np.uint8)
+
+    # Make sure the metadata is carried through
+    if expression(image).metadata != image.metadata:
+        raise AssertionError("Metadata was not propagated")
+
+    imageSeconds = timeit.timeit(lambda: expression(image), number=number)
+    arraySeconds = timeit.timeit(lambda: expression(array), number=number)
+    return imageSeconds / number, arraySeconds / number
+
+
+if __name__ == "__main__":
+
+    # Time it. The overhead is the cost of the Image subclass per expression.
+    for numKeys in [0, 10, 100, 1000, 10000]:
+        imageSeconds, arraySeconds = time_elementwise(numKeys)
+        print "%6d keys  image %8.2f us  array %8.2f us  overhead %8.2f us" % (
+            numKeys, imageSeconds * 1e6, arraySeconds * 1e6,
+            (imageSeconds - arraySeconds) * 1e6)
@@ -1,7 +1,10 @@
 import numpy as np
 import json
+import timeit
+import cPickle as pickle
 
-from image import Image
+from image import Image, PickleBuffer
+from dim_data import DimData
 
 
 class STRImageJSONEncoder(json.JSONEncoder):
@@ -11,6 +14,8 @@ class STRImageJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, STRImage):
             return STRImage._dump(obj)
+        if isinstance(obj, DimData):
+            return obj.tolist()
         if isinstance(obj, str):
             return obj
         if isinstance(obj, unicode):
@@ -22,6 +27,8 @@ def construct_str_image(dct):
     """ Used to reconstruct the image from a pickled object. Must be a function
     at the base level and not a static method of a class. """
     data = dct["data"]
+    if isinstance(data, unicode):
+        data = data.encode("latin-1")
     image = np.fromstring(data, dct["dtype"]).reshape(dct["shape"])
     image = image.view(STRImage)
     image.metadata.update(json.loads(dct["metadata"]))
@@ -69,7 +76,7 @@ class STRImage(Image):
         return {"data": data,
                 "dtype": str(self.dtype),
                 "shape": self.shape,
-                "metadata": json.dumps(self.metadata),
+                "metadata": json.dumps(self._meta or {}),
                 "dimData": self._dimData}
 
     def __reduce__(self):
@@ -82,26 +89,90 @@ class STRImage(Image):
 
         # Spark uses the string representation when serializing, so I have to
         # dump the whole thing into a string. Try to not call this on it's own.
-        return str(json.dumps(self, cls=STRImageJSONEncoder))
+        # Raw bytes are not valid utf-8, so pass them through as latin-1
+        return str(json.dumps(self, cls=STRImageJSONEncoder,
+                              encoding="latin-1"))
 
     def dumps(self):
         return str(self)
 
 
+def time_serialization(data, number=10):
+    """ Time a dump/load round trip of each serialization method. Returns a
+    dictionary of method name to (seconds per round trip, payload bytes). """
+
+    # The methods to compare. STRImage is the baseline experiment.
+    methods = {"json/base64": (Image(data).dumps, Image.loads),
+               "json/str": (STRImage(data).dumps, STRImage.loads),
+               "binary": (Image(data).dumpb, Image.loads)}
+
+    results = {}
+    for name, (dump, load) in methods.iteritems():
+
+        # Make sure the round trip is lossless before timing it
+        payload = dump()
+        if not np.array_equal(load(payload), data):
+            raise AssertionError("%s round trip failed" % name)
+
+        seconds = timeit.timeit(lambda: load(dump()), number=number) / number
+        results[name] = (seconds, len(payload))
+
+    return results
+
+
+def pickle_round_trip(image):
+    """ Pickle and unpickle an image with the highest available protocol,
+    passing the pixels out of band when protocol 5 is available. Returns the
+    unpickled image and the size of the in-band payload. """
+
+    if PickleBuffer is None:
+        payload = pickle.dumps(image, pickle.HIGHEST_PROTOCOL)
+        return pickle.loads(payload), len(payload)
+
+    buffers = []
+    payload = pickle.dumps(image, 5, buffer_callback=buffers.append)
+    return pickle.loads(payload, buffers=buffers), len(payload)
+
+
+def time_pickling(megabytes, dtype, number=3):
+    """ Time a pickle round trip of a chunk with the given size and dtype.
+    Returns (seconds per round trip, in-band payload bytes). """
+
+    # Build a chunk with some metadata and a dimData to carry along
+    dtype = np.dtype(dtype)
+    data = np.arange(megabytes * 2 ** 20 / dtype.itemsize, dtype=dtype)
+    image = Image(data.reshape((-1, 1024 / dtype.itemsize, 1)))
+    image.metadata["filename"] = "chunk.raw"
+    image._dimData[0]["proc_grid_rank"] = 1
+
+    # Make sure the round trip is lossless before timing it
+    copy, size = pickle_round_trip(image)
+    if not (np.array_equal(copy, image) and
+            copy.metadata == image.metadata and
+            copy._dimData[0]["proc_grid_rank"] == 1):
+        raise AssertionError("Pickle round trip failed for %s" % dtype)
+
+    seconds = timeit.timeit(lambda: pickle_round_trip(image), number=number)
+    return seconds / number, size
+
+
 if __name__ == "__main__":
 
     arraySize = (1024, 1024)
-    arraySize = (4, 5)
     data = np.random.random_sample(arraySize).astype(np.complex64)
     data.imag = np.random.random_sample(data.shape)
 
-    # Make the regular image which uses the b64encode/b64decode functions
-    Image.loads(Image(data).dumps())
-
-    # Make the image which doesn't use base64 encoding
-    STRImage.loads(STRImage(data).dumps())
-
     # Time it
-    # timeit.timeit("Image.loads(Image(data).dumps())")
-    # a = b64Image.dumps()
-    # b = Image.loads(a)
+    results = time_serialization(data)
+    for name, (seconds, size) in sorted(results.iteritems()):
+        print "%-12s %8.2f ms %12d bytes %8.1f MB/s" % (
+            name, seconds * 1e3, size, data.nbytes / seconds / 2 ** 20)
+
+    # Pickle throughput for a range of chunk sizes and dtypes
+    print ""
+    for dtype in [np.uint8, np.uint16, np.float32, np.complex64]:
+        for megabytes in [1, 8, 64, 512]:
+            seconds, size = time_pickling(megabytes, dtype)
+            print "pickle %-10s %4d MB %8.2f ms %8.1f MB/s" % (
+                np.dtype(dtype), megabytes, seconds * 1e3,
+                megabytes / seconds)
@@ -0,0 +1,42 @@
+import numpy as np
+import timeit
+
+from image import Image
+
+# The indices to time, as they are commonly written in map functions
+INDICES = [("[10]", np.s_[10]),
+           ("[10:20]", np.s_[10:20]),
+           ("[10:20, 5:50]", np.s_[10:20, 5:50]),
+           ("[:, :, 0]", np.s_[:, :, 0]),
+           ("[100, 5:, 1]", np.s_[100, 5:, 1])]
+
+
+def time_slicing(image, index, number=10000):
+    """ Time indexing an image through __getitem__ and through the general
+    path, which handled every index before the fast path was added. Returns
+    the seconds per call of each. """
+
+    # Make sure both paths agree before timing them
+    fast = image[index]
+    general = image._getitem_general(index)
+    if not (np.array_equal(fast, general) and
+            fast.shape == general.shape and
+            fast._dimData[0]["start"] == general._dimData[0]["start"]):
+        raise AssertionError("Fast and general paths differ")
+
+    fastSeconds = timeit.timeit(lambda: image[index], number=number)
+    generalSeconds = timeit.timeit(lambda: image._getitem_general(index),
+                                   number=number)
+    return fastSeconds / number, generalSeconds / number
+
+
+if __name__ == "__main__":
+
+    image = Image(np.zeros((512, 512, 3), dtype=np.uint8))
+    image.metadata["filename"] = "image.png"
+
+    # Time it
+    for name, index in INDICES:
+        fast, general = time_slicing(image, index)
+        print "%-16s fast %8.2f us   general %8.2f us" % (
+            name, fast * 1e6, general * 1e6)
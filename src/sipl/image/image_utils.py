@@ -1,15 +1,185 @@
 import numpy as np
+import copy
+from itertools import groupby
 
 
-def vsplit(array, numSplits):
-    """ Split an array into numSplits number of row chunks """
+def vsplit(array, numSplits, alignment=1):
+    """ Split an array, or an array shape, into numSplits number of row
+    chunks. Every chunk but the last starts and ends on a multiple of
+    alignment rows. """
 
-    numRowsPerRead = array.shape[0] / numSplits
-    remainder = array.shape[0] % numSplits
-    numRows = [numRowsPerRead] * numSplits
-    numRows[:remainder] = [numRowsPerRead + 1] * remainder
-    startingRows = np.cumsum([0] + numRows[:-1])
-    return zip(startingRows, numRows)
+    # Split whole blocks of alignment rows, of which the last may be short
+    numRows = getattr(array, "shape", array)[0]
+    numBlocks = -(-numRows // alignment)
+    if alignment > 1 and numSplits > numBlocks:
+        raise ValueError("Can't split %d rows into %d chunks of multiples "
+                         "of %d rows" % (numRows, numSplits, alignment))
+    numBlocksPerRead = numBlocks / numSplits
+    remainder = numBlocks % numSplits
+    numBlocks = [numBlocksPerRead] * numSplits
+    numBlocks[:remainder] = [numBlocksPerRead + 1] * remainder
+    startingRows = np.cumsum([0] + numBlocks[:-1]) * alignment
+    sizes = [min(start + blocks * alignment, numRows) - start
+             for start, blocks in zip(startingRows, numBlocks)]
+    return zip(startingRows, sizes)
+
+
+def tilesplit(array, tileShape):
+    """ Split an array, or an array shape, into a grid of tiles of at most
+    tileShape, covering the leading len(tileShape) axes. Returns the shape of
+    the tile grid and, for each tile in row-major order, its grid position
+    and its (start, stop) extents along the tiled axes. """
+
+    # The (start, stop) extents of the tiles along each axis
+    axisExtents = []
+    for size, tileSize in zip(getattr(array, "shape", array), tileShape):
+        starts = range(0, size, tileSize) or [0]
+        axisExtents.append([(start, min(start + tileSize, size))
+                            for start in starts])
+
+    return grid(axisExtents)
+
+
+def ndsplit(array, numSplits, axes=(0,), alignment=1):
+    """ Split an array, or an array shape, into a grid of chunks along any
+    axes, such as the bands of a cube or the frames of a video. numSplits is
+    the number of chunks along each of the axes, or the total number of
+    chunks, which is spread over the axes (see split_counts). Each axis is
+    split like vsplit. Returns the same as tilesplit, covering the axes up to
+    the last of axes. """
+
+    shape = getattr(array, "shape", array)
+
+    if isinstance(numSplits, (int, long)):
+        numSplits = split_counts(numSplits, [-(-shape[axis] // alignment)
+                                             for axis in axes])
+    numSplits = dict(zip(axes, numSplits))
+
+    axisExtents = []
+    for axis in range(max(axes) + 1):
+        splits = vsplit(shape[axis:], numSplits.get(axis, 1),
+                        alignment if axis in numSplits else 1)
+        axisExtents.append([(start, start + size) for start, size in splits])
+
+    return grid(axisExtents)
+
+
+def split_counts(numSplits, numBlocks):
+    """ Spread a total number of chunks over axes with numBlocks blocks
+    each. Returns the number of chunks along each axis, at most its number
+    of blocks, whose product is as close to numSplits as it can be without
+    going over it. Of the counts that get as close, the ones splitting the
+    earlier axes most are picked. """
+
+    first = max(1, min(numSplits, numBlocks[0]))
+    if len(numBlocks) == 1:
+        return [first]
+
+    # Try fewer and fewer chunks along the first axis, until the other
+    # axes can't make up for it
+    best, bestProduct = None, 0
+    restBlocks = int(np.prod(numBlocks[1:]))
+    for count in range(first, 0, -1):
+        if count * restBlocks <= bestProduct:
+            break
+        counts = [count] + split_counts(numSplits // count, numBlocks[1:])
+        product = int(np.prod(counts))
+        if product > bestProduct:
+            best, bestProduct = counts, product
+        if product == numSplits:
+            break
+    return best
+
+
+def grid(axisExtents):
+    """ Pair every position in a grid of chunks with the extents of the
+    chunk, given the (start, stop) extents of the chunks along each axis """
+
+    gridShape = tuple(len(extents) for extents in axisExtents)
+    chunks = [(rank, tuple(extents[i] for extents, i in
+                           zip(axisExtents, rank)))
+              for rank in np.ndindex(*gridShape)]
+    return gridShape, chunks
+
+
+def crop_halo(chunk):
+    """ Crop the halo (ghost cells) described by the padding of a chunk's
+    dimData, returning a view of the region the chunk owns """
+
+    # Nothing to do if the chunk has no halo
+    if not any(any(d["padding"]) for d in chunk._dimData):
+        return chunk
+
+    # Index the owned region of each axis and clear its padding
+    dimData = copy.deepcopy(chunk._dimData)
+    index = []
+    for d in dimData:
+        before = d["padding"][0]
+        index.append(slice(before, before + d["stop"] - d["start"]))
+        d["padding"] = (0, 0)
+
+    # Bypass Image.__getitem__, as the dimData is already known
+    cropped = np.ndarray.__getitem__(chunk, tuple(index))
+    cropped._dimData = dimData
+    return cropped
+
+
+def place(image, chunk):
+    """ Write a chunk into an image by the start/stop offsets of its dimData,
+    without its halo """
+
+    chunk = crop_halo(chunk)
+    index = tuple(slice(d["start"], d["stop"]) for d in chunk._dimData)
+    np.asarray(image)[index] = chunk
+
+
+def assemble(chunks, filename=None):
+    """ Assemble an iterable of chunks into an image that is allocated once
+    from the sizes in their dimData. Each chunk is written into place as it
+    arrives, so only one chunk needs to be held at a time. If filename is
+    set, the image is a memory mapped file instead. """
+
+    image = None
+    for chunk in chunks:
+
+        # Allocate the image from the first chunk
+        if image is None:
+            shape = tuple(d["size"] for d in chunk._dimData)
+            if filename:
+                data = np.memmap(filename, chunk.dtype, "w+", shape=shape)
+            else:
+                data = np.empty(shape, chunk.dtype)
+            image = data.view(type(chunk))
+            image.metadata.update(chunk.metadata)
+
+        place(image, chunk)
+
+    if image is None:
+        raise ValueError("No chunks to assemble")
+
+    # Make sure a memory mapped image is written out
+    if filename:
+        data.flush()
+
+    return image
+
+
+def concatenate(arrays, axis=0):
+    return stack(arrays, lambda x: np.concatenate(x, axis))
+
+
+def stack_grid(chunks):
+    """ Stack chunks into an image by their proc_grid_rank, along every axis
+    of the grid. The chunks must be sorted by their grid position. """
+
+    def stack_axis(chunks, axis):
+        if axis == len(chunks[0][0]):
+            return chunks[0][1]
+        parts = [stack_axis(list(group), axis + 1) for _, group in
+                 groupby(chunks, lambda x: x[0][axis])]
+        return parts[0] if len(parts) == 1 else concatenate(parts, axis)
+
+    return stack_axis(chunks, 0)
 
 
 def vstack(arrays):
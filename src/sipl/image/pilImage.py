@@ -1,20 +1,351 @@
+import zlib
 import numpy as np
 from PIL import Image as _PILImage
 
 from sipl import Algorithm
 from sipl.image import ImageIn, ImageOut
+from streamImage import StreamImageOut
 
 # References
 # http://docs.scipy.org/doc/numpy/user/basics.subclassing.html
 # http://pillow.readthedocs.org/en/2.3.0/handbook/image-file-formats.html
+# http://docs.scipy.org/doc/numpy/reference/generated/numpy.memmap.html
+# http://partners.adobe.com/public/developer/en/tiff/TIFF6.pdf
+# http://pillow.readthedocs.org/en/latest/reference/Image.html#PIL.Image.Image.draft
+
+# The dtype and number of channels of the PIL modes that map to arrays
+_MODES = {"L": ("u1", 1),
+          "RGB": ("u1", 3),
+          "RGBA": ("u1", 4),
+          "CMYK": ("u1", 4),
+          "I;16": ("<u2", 1),
+          "I;16B": (">u2", 1),
+          "I": ("<i4", 1),
+          "F": ("<f4", 1)}
+
+# The modes without an array layout, and the modes they are converted to
+_CONVERSIONS = {"1": "L", "P": "RGB", "LA": "RGBA", "YCbCr": "RGB"}
+
+# The raw modes of each mode whose pixels are stored as they are in arrays
+_RAW_MODES = {"L": ("L",),
+              "RGB": ("RGB",),
+              "RGBA": ("RGBA",),
+              "CMYK": ("CMYK",),
+              "I;16": ("I;16",),
+              "I;16B": ("I;16B",),
+              "I": ("I", "I;32"),
+              "F": ("F", "F;32F")}
+
+# The TIFF tags and compressions read strip by strip or tile by tile
+_TIFF_TAGS = {"bitsPerSample": 258, "compression": 259, "photometric": 262,
+              "stripOffsets": 273, "rowsPerStrip": 278,
+              "stripByteCounts": 279, "planarConfiguration": 284,
+              "predictor": 317, "tileWidth": 322, "tileLength": 323,
+              "tileOffsets": 324, "tileByteCounts": 325,
+              "extraSamples": 338}
+_TIFF_RAW = 1
+_TIFF_DEFLATE = (8, 32946)
+
+# The number of bytes of pixels copied out of PIL at a time, when a file is
+# decoded in full
+_BLOCK_BYTES = 2 ** 24
+
+
+def pil_mode(pilImage):
+    """ The mode of the arrays read from a PIL image """
+
+    mode = _CONVERSIONS.get(pilImage.mode, pilImage.mode)
+    if mode not in _MODES:
+        raise ValueError("Unsupported PIL mode %s" % pilImage.mode)
+    return mode
+
+
+def pil_image_shape(filename):
+    """ The (rows, cols, channels) shape of an image file. Only the header
+    of the file is read. """
+
+    pilImage = _PILImage.open(filename)
+    numCols, numRows = pilImage.size
+    return (numRows, numCols, _MODES[pil_mode(pilImage)][1])
+
+
+def pil_image_dtype(filename):
+    """ The dtype of the arrays read from an image file """
+
+    dtype = _MODES[pil_mode(_PILImage.open(filename))][0]
+    return np.dtype(dtype).newbyteorder("=")
+
+
+def tiff_segments(pilImage):
+    """ The strips or tiles of a TIFF file as (box, offset, byteCount)
+    tuples, with the compression and predictor. Returns None for layouts
+    which can't be read a piece at a time. """
+
+    if pilImage.mode not in _RAW_MODES:
+        return None
+    itemBits = np.dtype(_MODES[pilImage.mode][0]).itemsize * 8
+
+    # Only read pixels which are stored as PIL would return them. Inverted
+    # grey levels and premultiplied alpha are left to PIL.
+    tags = {}
+    for name, tag in _TIFF_TAGS.iteritems():
+        value = pilImage.tag_v2.get(tag)
+        if name in ("bitsPerSample", "stripOffsets", "stripByteCounts",
+                    "tileOffsets", "tileByteCounts", "extraSamples"):
+            if value is not None and not isinstance(value, tuple):
+                value = (value,)
+        tags[name] = value
+    if (tags["compression"] not in (_TIFF_RAW,) + _TIFF_DEFLATE or
+            tags["photometric"] == 0 or
+            tags["planarConfiguration"] not in (None, 1) or
+            tags["predictor"] not in (None, 1, 2) or
+            1 in (tags["extraSamples"] or ()) or
+            any(bits != itemBits for bits in tags["bitsPerSample"] or ())):
+        return None
+
+    numCols, numRows = pilImage.size
+    if tags["tileOffsets"] is not None:
+        width, length = tags["tileWidth"], tags["tileLength"]
+        offsets, byteCounts = tags["tileOffsets"], tags["tileByteCounts"]
+        boxes = [(left, top, left + width, top + length)
+                 for top in range(0, numRows, length)
+                 for left in range(0, numCols, width)]
+    else:
+        length = tags["rowsPerStrip"] or numRows
+        offsets, byteCounts = tags["stripOffsets"], tags["stripByteCounts"]
+        if offsets is None or byteCounts is None:
+            return None
+        boxes = [(0, top, numCols, top + length)
+                 for top in range(0, numRows, length)]
+
+    if len(boxes) != len(offsets):
+        return None
+    return (zip(boxes, offsets, byteCounts), tags["compression"],
+            tags["predictor"] or 1)
+
+
+def raw_segments(pilImage):
+    """ The strips of files PIL stores as full width raw strips in their own
+    mode (PPM, PGM and the like), as (box, offset, byteCount) tuples. Returns
+    None for anything else. """
+
+    numCols, numRows = pilImage.size
+    segments = []
+    for decoder, box, offset, args in pilImage.tile:
+        if not isinstance(args, tuple):
+            args = (args,)
+        rawmode = args[0]
+        stride = args[1] if len(args) > 1 else 0
+        orientation = args[2] if len(args) > 2 else 1
+        if (decoder != "raw" or
+                rawmode not in _RAW_MODES.get(pilImage.mode, ()) or
+                stride or orientation != 1 or box[0] != 0 or
+                box[2] != numCols):
+            return None
+        segments.append((box, offset, None))
+    return segments
+
+
+def read_segment(filename, segment, compression, predictor, dtype,
+                 numChannels, rows):
+    """ Read the rows (start, stop) of a strip or tile of a file, relative to
+    its top. Raw segments are memory mapped, so only those rows are read.
+    Compressed segments are decompressed in full. """
+
+    (left, top, right, bottom), offset, byteCount = segment
+    rowShape = (right - left, numChannels)
+    rowBytes = int(np.prod(rowShape)) * dtype.itemsize
+    start, stop = rows
+
+    if compression == _TIFF_RAW:
+        return np.memmap(filename, dtype, "r", offset + start * rowBytes,
+                         (stop - start,) + rowShape)
+
+    with open(filename, "rb") as f:
+        f.seek(offset)
+        data = zlib.decompress(f.read(byteCount))
+    data = np.frombuffer(data, dtype)
+    data = data.reshape((-1,) + rowShape)[:stop]
+
+    # Undo the horizontal differencing of the predictor
+    if predictor == 2:
+        data = np.cumsum(data, axis=1, dtype=dtype)
+    return data[start:stop]
+
+
+def read_segments(filename, pilImage, window):
+    """ Read a window of a file that can be read a piece at a time, into an
+    array. Returns None for any other file. """
+
+    if pilImage.format == "TIFF":
+        segments = tiff_segments(pilImage)
+        if segments is None:
+            return None
+        segments, compression, predictor = segments
+        byteOrder = "<" if pilImage.tag_v2.prefix == b"II" else ">"
+    else:
+        segments = raw_segments(pilImage)
+        if segments is None:
+            return None
+        compression, predictor, byteOrder = _TIFF_RAW, 1, None
+
+    # The pixels of strips are stored in the byte order of the file
+    dtype, numChannels = _MODES[pilImage.mode]
+    dtype = np.dtype(dtype)
+    if byteOrder is not None and dtype.itemsize > 1:
+        dtype = dtype.newbyteorder(byteOrder)
+
+    # Copy the part of each segment that is in the window
+    (rowStart, rowStop), (colStart, colStop) = window
+    data = np.empty((rowStop - rowStart, colStop - colStart, numChannels),
+                    dtype.newbyteorder("="))
+    for segment in segments:
+        left, top, right, bottom = segment[0]
+        rows = max(top, rowStart), min(bottom, rowStop)
+        cols = max(left, colStart), min(right, colStop)
+        if rows[0] >= rows[1] or cols[0] >= cols[1]:
+            continue
+        target = data[rows[0] - rowStart:rows[1] - rowStart,
+                      cols[0] - colStart:cols[1] - colStart]
+
+        # Read rows of raw pixels as wide as the window straight into place
+        if compression == _TIFF_RAW and (left, right) == (colStart, colStop):
+            rowBytes = target[0].nbytes
+            with open(filename, "rb") as f:
+                f.seek(segment[1] + (rows[0] - top) * rowBytes)
+                if f.readinto(target) != target.nbytes:
+                    raise IOError("%s is truncated" % filename)
+            if not dtype.isnative:
+                target.byteswap(True)
+            continue
+
+        pixels = read_segment(filename, segment, compression, predictor,
+                              dtype, numChannels,
+                              (rows[0] - top, rows[1] - top))
+        target[...] = pixels[:, cols[0] - left:cols[1] - left]
+
+    return data
+
+
+def decode_window(pilImage, window):
+    """ Decode a window of a PIL image into an array. The whole file is
+    decoded by PIL, and the window is copied out a block of rows at a time,
+    so there is never more than a block in between. """
+
+    mode = pil_mode(pilImage)
+    if mode != pilImage.mode:
+        pilImage = pilImage.convert(mode)
+    dtype, numChannels = _MODES[mode]
+    dtype = np.dtype(dtype)
+
+    (rowStart, rowStop), (colStart, colStop) = window
+    data = np.empty((rowStop - rowStart, colStop - colStart, numChannels),
+                    dtype.newbyteorder("="))
+    rowBytes = max(1, data.strides[0])
+    blockRows = max(1, _BLOCK_BYTES // rowBytes)
+    for start in range(rowStart, rowStop, blockRows):
+        stop = min(start + blockRows, rowStop)
+        block = pilImage.crop((colStart, start, colStop, stop))
+        data[start - rowStart:stop - rowStart] = np.frombuffer(
+            block.tobytes(), dtype).reshape(
+                (stop - start, colStop - colStart, numChannels))
+    return data
+
+
+def reduce_array(data, factor):
+    """ Downscale the rows and columns of an array by a factor, averaging
+    each factor x factor block. The blocks at the far edges may be smaller.
+    """
+
+    if factor == 1:
+        return data
+
+    # Sum the blocks and divide by their sizes
+    sums = data
+    counts = []
+    for axis in (0, 1):
+        starts = np.arange(0, data.shape[axis], factor)
+        sums = np.add.reduceat(sums, starts, axis=axis, dtype=np.float64)
+        counts.append(np.diff(np.append(starts, data.shape[axis])))
+    means = sums / np.outer(*counts)[:, :, np.newaxis]
+
+    if data.dtype.kind in "iu":
+        means = np.rint(means)
+    return means.astype(data.dtype)
+
+
+def read_pil_window(filename, window=None, reduce=1):
+    """ Read a window ((rowStart, rowStop), (colStart, colStop)) of an image
+    file into a (rows, cols, channels) array, downscaled by reduce. The
+    window is the whole image by default, and a stop of None is the edge of
+    the image.
+
+    Raw files (PPM, PGM, uncompressed TIFF) are memory mapped and deflated
+    TIFFs are read a strip or tile at a time, so a window costs in
+    proportion to its size. JPEGs are decoded at 1/2, 1/4 or 1/8 scale when
+    reduce allows, and other formats are decoded in full and then cropped.
+    """
+
+    pilImage = _PILImage.open(filename)
+    numCols, numRows = pilImage.size
+    if window is None:
+        window = ((0, None), (0, None))
+    window = tuple(slice(start, stop).indices(size)[:2]
+                   for (start, stop), size in zip(window, (numRows, numCols)))
+    shape = tuple(max(0, stop - start) for start, stop in window)
+    window = tuple((start, start + size)
+                   for (start, _), size in zip(window, shape))
+
+    # Let the JPEG decoder scale by the largest power of two in reduce that
+    # the window starts on a multiple of, and scale the window with it
+    scale = 1
+    if pilImage.format == "JPEG" and reduce > 1:
+        scale = min(8, reduce & -reduce)
+        while window[0][0] % scale or window[1][0] % scale:
+            scale /= 2
+    if scale > 1:
+        pilImage.draft(pilImage.mode, (max(1, numCols // scale),
+                                       max(1, numRows // scale)))
+        scale = int(round(float(numCols) / pilImage.size[0]))
+        window = tuple((start // scale, min(-(-stop // scale), size))
+                       for (start, stop), size in zip(window,
+                                                      pilImage.size[::-1]))
+
+    data = None
+    if scale == 1:
+        data = read_segments(filename, pilImage, window)
+    if data is None:
+        data = decode_window(pilImage, window)
+
+    # Reduce what is left, and trim the blocks of a scaled window
+    data = reduce_array(data, reduce // scale)
+    return data[:-(-shape[0] // reduce), :-(-shape[1] // reduce)]
 
 
 class ImageToPIL(Algorithm):
 
-    _params = {"decimationFactor": 0}
+    _params = {"decimationFactor": 0,
+               "level": None}
 
     def __call__(self, image):
-        """ Convert an image to a PIL representation """
+        """ Convert an image, or a pyramid of rdds, to a PIL representation.
+        For a pyramid the coarsest level the decimation allows is collected,
+        unless a level is requested, and only the rest is decimated here. """
+
+        # Collect a level of a pyramid, sized against the full image
+        scale = self.decimationFactor + 1
+        if isinstance(image, list):
+            from sipl.spark import RDDToImage
+            level = self.level
+            if level is None:
+                level = 0
+                while (level + 1 < len(image) and
+                       image.factor ** (level + 1) <= scale):
+                    level += 1
+            rows, cols = [d["size"] for d in image[0].first()._dimData[:2]]
+            image = RDDToImage(level=level)(image)
+        else:
+            rows, cols = image.shape[:2]
 
         # I only care about showing images which can map to pixel values
         if image.dtype != np.uint8:
@@ -27,14 +358,14 @@ class ImageToPIL(Algorithm):
         if (mode == "L"):
             # Using squeeze would get rid of a single row or column, so
             # do this method instead.
-            rows, cols = image.shape[:2]
-            pilImage = _PILImage.fromarray(image.reshape((rows, cols)), mode)
-        pilImage = _PILImage.fromarray(image, mode)
+            pilImage = _PILImage.fromarray(
+                image.reshape(image.shape[:2]), mode)
+        else:
+            pilImage = _PILImage.fromarray(image, mode)
 
-        # Decimate if requested
-        if self.decimationFactor > 0:
-            newSize = [dim / (self.decimationFactor + 1)
-                       for dim in pilImage.size]
+        # Decimate if the image is larger than requested
+        newSize = (cols / scale, rows / scale)
+        if newSize != pilImage.size:
             pilImage = pilImage.resize(newSize)
 
         return pilImage
@@ -42,28 +373,29 @@ class ImageToPIL(Algorithm):
 
 class PILImageIn(ImageIn):
 
-    """ An image reader for the standard image types used by PIL. """
+    """ An image reader for the standard image types used by PIL. A region
+    ((rowStart, rowStop), (colStart, colStop)), or just the rows (start,
+    stop), reads a window of the file, and reduce downscales it by an
+    integer factor (see read_pil_window). 8 bit images are uint8, "I;16"
+    images uint16, "I" images int32 and "F" images float32. """
 
     # The filter for a file open dialog box
     fileFilter = "PIL Images (*.png *.bmp *.jpg *.jpeg *.gif *.pcx "
     fileFilter += "*.ppm *.eps *.tiff *.psd *.tga *.xpm)"
 
-    def _open(self, filename):
-
-        # Open the image
-        pilImage = _PILImage.open(filename)
+    def _open(self, filename, region=None, rows=None, reduce=1):
 
-        # Open the file using PIL and convert to a numpy array
-        numCols, numRows = pilImage.size
-        numChannels = {"L": 1, "RGB": 3, "RGBA": 4}[pilImage.mode]
-        obj = np.fromstring(pilImage.tobytes(), dtype=np.uint8)
-        obj = obj.reshape((numRows, numCols, numChannels))
-        return obj
+        # Decode straight into a preallocated array
+        if rows is not None:
+            region = (rows, (0, None))
+        return read_pil_window(filename, region, reduce)
 
 
 class PILImageOut(ImageOut):
 
-    """ An image writer for the standard image types used by PIL. """
+    """ An image writer for the standard image types used by PIL. An rdd or
+    an iterable of chunks is streamed into a raw, PPM/PGM or tiled TIFF file
+    by StreamImageOut instead, without assembling the image. """
 
     def __call__(self, image, **kwargs):
         """ Write an image to disk via PIL """
@@ -71,5 +403,9 @@ class PILImageOut(ImageOut):
         if not self.filename:
             raise IOError("PILImageOut.filename must be set")
 
+        # Stream chunks into the file
+        if not isinstance(image, np.ndarray):
+            return StreamImageOut(filename=self.filename, **kwargs)(image)
+
         # Use the ToPIL algorithm to convert to PIL and then write to disk
         ImageToPIL(**kwargs)(image).save(self.filename)
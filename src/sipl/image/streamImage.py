@@ -0,0 +1,320 @@
+import os
+import struct
+import zlib
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+from sipl.image import Image, ImageOut
+from image_utils import crop_halo
+
+# References
+# http://partners.adobe.com/public/developer/en/tiff/TIFF6.pdf
+# http://netpbm.sourceforge.net/doc/ppm.html
+# http://docs.python.org/2/library/zlib.html
+
+# The formats of the file extensions
+_FORMATS = {".raw": "raw", ".bin": "raw", ".ppm": "ppm", ".pgm": "ppm",
+            ".tif": "tiff", ".tiff": "tiff"}
+
+# TIFF field types, tags and values
+_SHORT = 3
+_LONG = 4
+_TIFF_COMPRESSION = {None: 1, "none": 1, "deflate": 8}
+_TIFF_SAMPLE_FORMAT = {"u": 1, "i": 2, "f": 3}
+
+
+class RawWriter(object):
+
+    """ Writes chunks of an image of shape and dtype into place in a raw
+    file, in C order after a header. Each chunk is written as it arrives,
+    so nothing is held on to. """
+
+    def __init__(self, filename, shape, dtype, header=""):
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        self._file = open(filename, "wb")
+        self._file.write(header)
+        self._offset = len(header)
+        self._file.truncate(self._offset +
+                            int(np.prod(shape)) * self.dtype.itemsize)
+
+    def write(self, rowStart, colStart, data):
+        """ Write the rows and columns of a chunk at its place """
+
+        data = np.ascontiguousarray(data, self.dtype)
+        rowBytes = int(np.prod(self.shape[1:])) * self.dtype.itemsize
+        pixelBytes = rowBytes // self.shape[1]
+
+        # Full width chunks are a single write, and anything else a write
+        # per row
+        if data.shape[1] == self.shape[1]:
+            self._file.seek(self._offset + rowStart * rowBytes)
+            self._file.write(data.data)
+            return
+        for i, row in enumerate(data):
+            self._file.seek(self._offset + (rowStart + i) * rowBytes +
+                            colStart * pixelBytes)
+            self._file.write(row.data)
+
+    def close(self):
+        self._file.close()
+
+    def abort(self):
+        self._file.close()
+
+
+class PPMWriter(RawWriter):
+
+    """ Writes chunks of a grey (PGM) or colour (PPM) image of 8 or 16 bit
+    samples. 16 bit samples are stored big endian. """
+
+    def __init__(self, filename, shape, dtype):
+        dtype = np.dtype(dtype)
+        numChannels = shape[2] if len(shape) > 2 else 1
+        if (dtype.kind != "u" or dtype.itemsize > 2 or
+                numChannels not in (1, 3)):
+            raise ValueError("PPM files hold 1 or 3 channels of uint8 or "
+                             "uint16, not %d of %s" % (numChannels, dtype))
+
+        header = "P%d\n%d %d\n%d\n" % (5 if numChannels == 1 else 6,
+                                       shape[1], shape[0],
+                                       2 ** (8 * dtype.itemsize) - 1)
+        RawWriter.__init__(self, filename, shape, dtype.newbyteorder(">"),
+                           header)
+
+
+def tiff_entry(tag, type, values, dataOffset):
+    """ Pack an IFD entry. Values which don't fit in the entry are returned
+    to be written at dataOffset. """
+
+    data = struct.pack("<%d%s" % (len(values), "H" if type == _SHORT else "I"),
+                       *values)
+    if len(data) <= 4:
+        return struct.pack("<HHI", tag, type, len(values)) + \
+            data.ljust(4, "\0"), ""
+    return struct.pack("<HHII", tag, type, len(values), dataOffset), data
+
+
+class TiledTIFFWriter(object):
+
+    """ Writes a tiled TIFF. Chunks are gathered into a band of tiles, which
+    is compressed on numThreads threads and written as soon as all of its
+    rows have arrived. Integer samples are horizontally differenced before
+    they are compressed if predictor is set. The image must fit in 4 GB. """
+
+    def __init__(self, filename, shape, dtype, tileShape=(256, 256),
+                 compression="deflate", level=6, predictor=True,
+                 numThreads=4):
+
+        if compression not in _TIFF_COMPRESSION:
+            raise ValueError("Unknown TIFF compression %s" % compression)
+        self.dtype = np.dtype(dtype)
+        if self.dtype.kind not in _TIFF_SAMPLE_FORMAT:
+            raise ValueError("TIFF files can't hold %s samples" % self.dtype)
+
+        self.shape = tuple(shape[:2]) + (shape[2] if len(shape) > 2 else 1,)
+        self.tileShape = tuple(tileShape)
+        self.compression = _TIFF_COMPRESSION[compression]
+        self.level = level
+        self.predictor = (predictor and self.dtype.kind in "iu" and
+                          self.compression != 1)
+
+        # The bands waiting for rows, the pixels they still need and the
+        # next band to write
+        self._bands = {}
+        self._missing = {}
+        self._nextBand = 0
+
+        # The tiles are written after the header, whose IFD offset is set
+        # at the end
+        self._offsets = []
+        self._byteCounts = []
+        self._file = open(filename, "wb")
+        self._file.write(struct.pack("<2sHI", "II", 42, 0))
+        self._pool = ThreadPool(numThreads)
+
+    def write(self, rowStart, colStart, data):
+        """ Copy a chunk into its bands, and write any band that is done """
+
+        tileRows = self.tileShape[0]
+        data = data.reshape(data.shape[:2] + (-1,))
+        rowStop = rowStart + data.shape[0]
+        for band in range(rowStart // tileRows, -(-rowStop // tileRows)):
+            top = band * tileRows
+            bottom = min(top + tileRows, self.shape[0])
+            if band not in self._bands:
+                self._bands[band] = np.zeros(
+                    (tileRows, -(-self.shape[1] // self.tileShape[1]) *
+                     self.tileShape[1], self.shape[2]), self.dtype)
+                self._missing[band] = (bottom - top) * self.shape[1]
+
+            start, stop = max(top, rowStart), min(bottom, rowStop)
+            rows = data[start - rowStart:stop - rowStart]
+            self._bands[band][start - top:stop - top,
+                              colStart:colStart + data.shape[1]] = rows
+            self._missing[band] -= rows.shape[0] * rows.shape[1]
+
+        # Write the bands which are complete, in order
+        band = self._nextBand
+        while band in self._bands and not self._missing[band]:
+            self._write_band(self._bands.pop(band))
+            del self._missing[band]
+            band = self._nextBand = band + 1
+
+    def _write_band(self, band):
+        """ Compress the tiles of a band in parallel and write them """
+
+        tileCols = self.tileShape[1]
+        tiles = [band[:, left:left + tileCols]
+                 for left in range(0, band.shape[1], tileCols)]
+        for tile in self._pool.imap(self._encode, tiles):
+            self._offsets.append(self._file.tell())
+            self._byteCounts.append(len(tile))
+            self._file.write(tile)
+
+    def _encode(self, tile):
+        """ The bytes of a tile, little endian and compressed """
+
+        tile = tile.astype(self.dtype.newbyteorder("<"))
+        if self.predictor:
+            tile[:, 1:] -= tile[:, :-1].copy()
+        if self.compression == 1:
+            return tile.tobytes()
+        return zlib.compress(tile.tobytes(), self.level)
+
+    def close(self):
+        """ Write the image file directory, and point the header at it """
+
+        try:
+            if self._bands:
+                raise ValueError("Chunks did not cover the image")
+
+            numRows, numCols, numChannels = self.shape
+            bits = [self.dtype.itemsize * 8] * numChannels
+            sampleFormat = [_TIFF_SAMPLE_FORMAT[self.dtype.kind]] * numChannels
+            tags = [(256, _LONG, [numCols]),
+                    (257, _LONG, [numRows]),
+                    (258, _SHORT, bits),
+                    (259, _SHORT, [self.compression]),
+                    (262, _SHORT, [2 if numChannels in (3, 4) else 1]),
+                    (277, _SHORT, [numChannels]),
+                    (284, _SHORT, [1]),
+                    (322, _LONG, [self.tileShape[1]]),
+                    (323, _LONG, [self.tileShape[0]]),
+                    (324, _LONG, self._offsets),
+                    (325, _LONG, self._byteCounts),
+                    (339, _SHORT, sampleFormat)]
+            if self.predictor:
+                tags.append((317, _SHORT, [2]))
+
+            # The samples past RGB are alpha, and past grey unspecified
+            extraSamples = numChannels - (3 if numChannels >= 3 else 1)
+            if extraSamples:
+                tags.append((338, _SHORT, [2 if numChannels == 4 else 0] +
+                             [0] * (extraSamples - 1)))
+            tags.sort()
+
+            # The entries are followed by the values that don't fit in them
+            ifdOffset = self._file.tell() + self._file.tell() % 2
+            dataOffset = ifdOffset + 2 + 12 * len(tags) + 4
+            if dataOffset > 2 ** 32 - 2 ** 20:
+                raise IOError("TIFF files are limited to 4 GB")
+            entries, data = [], []
+            for tag, type, values in tags:
+                entry, values = tiff_entry(tag, type, values, dataOffset)
+                entries.append(entry)
+                data.append(values)
+                dataOffset += len(values)
+
+            self._file.seek(ifdOffset)
+            self._file.write(struct.pack("<H", len(tags)) + "".join(entries) +
+                             struct.pack("<I", 0) + "".join(data))
+            self._file.seek(4)
+            self._file.write(struct.pack("<I", ifdOffset))
+        finally:
+            self.abort()
+
+    def abort(self):
+        """ Close the file, as it is """
+        self._pool.terminate()
+        self._file.close()
+
+
+class StreamImageOut(ImageOut):
+
+    """ An image writer for chunks, which never holds the whole image. It
+    takes an rdd, or any iterable, of chunks and writes each one into place
+    by the start/stop offsets of its dimData, without its halo. A single
+    image is written as one chunk.
+
+    The format is "raw", "ppm" or "tiff", or taken from the extension of
+    filename. Raw and PPM/PGM chunks are written straight into place. TIFFs
+    are tiled with tileShape tiles, and a band of tiles is kept until its
+    rows have arrived and then compressed in parallel, so the driver holds
+    about one row of chunks when they arrive in proc_grid_rank order. """
+
+    _params = {"filename": None,
+               "format": None,
+               "tileShape": (256, 256),
+               "compression": "deflate",
+               "level": 6,
+               "predictor": True,
+               "numThreads": 4}
+
+    def __call__(self, chunks):
+
+        if not self.filename:
+            raise IOError("StreamImageOut.filename must be set")
+        format = self.format
+        if format is None:
+            extension = os.path.splitext(self.filename)[1].lower()
+            if extension not in _FORMATS:
+                raise ValueError("Unknown image format %s" % extension)
+            format = _FORMATS[extension]
+
+        # Pull the chunks of an rdd a partition at a time
+        if hasattr(chunks, "toLocalIterator"):
+            chunks = chunks.toLocalIterator()
+        elif isinstance(chunks, np.ndarray):
+            chunks = [Image(chunks)]
+
+        writer = None
+        missing = None
+        try:
+            for chunk in chunks:
+                chunk = crop_halo(chunk)
+                dimData = chunk._dimData
+
+                # Open the file from the first chunk
+                if writer is None:
+                    shape = tuple(d["size"] for d in dimData)
+                    writer = self._writer(format, shape, chunk.dtype)
+                    missing = int(np.prod(shape[:2]))
+
+                writer.write(dimData[0]["start"], dimData[1]["start"],
+                             np.asarray(chunk))
+                missing -= chunk.shape[0] * chunk.shape[1]
+
+            if writer is None:
+                raise ValueError("No chunks to write")
+            if missing:
+                raise ValueError("Chunks did not cover the image")
+
+        # Leave the file unfinished if anything went wrong
+        except Exception:
+            if writer is not None:
+                writer.abort()
+            raise
+        writer.close()
+
+    def _writer(self, format, shape, dtype):
+        if format == "raw":
+            return RawWriter(self.filename, shape, dtype)
+        if format == "ppm":
+            return PPMWriter(self.filename, shape, dtype)
+        if format == "tiff":
+            return TiledTIFFWriter(self.filename, shape, dtype,
+                                   self.tileShape, self.compression,
+                                   self.level, self.predictor,
+                                   self.numThreads)
+        raise ValueError("Unknown StreamImageOut.format %s" % format)
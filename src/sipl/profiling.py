@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+import numpy as np
+
+# References
+# http://spark.apache.org/docs/latest/api/python/pyspark.html#pyspark.Accumulator
+# http://docs.python.org/2/library/time.html#time.clock
+
+# The statistics recorded for each algorithm and chunk, in order
+STATS = ("calls", "wallTime", "cpuTime", "inputBytes", "outputBytes",
+         "allocatedBytes")
+
+
+def chunk_rank(x):
+    """ The grid position of a chunk, or None for anything else """
+    dims = getattr(x, "_dims", None)
+    if dims is None:
+        return None
+    return tuple(d["proc_grid_rank"] for d in dims)
+
+
+def merge_records(records, other):
+    """ Add the statistics of other records into records """
+    for key, stats in other.iteritems():
+        if key in records:
+            records[key] = [a + b for a, b in zip(records[key], stats)]
+        else:
+            records[key] = list(stats)
+    return records
+
+
+class ProfileParam(object):
+
+    """ The accumulator param which merges records from the executors. It
+    has the interface of pyspark.AccumulatorParam. """
+
+    def zero(self, value):
+        return {}
+
+    def addInPlace(self, value1, value2):
+        return merge_records(value1, value2)
+
+
+class Profiler(object):
+
+    """ Records the wall time, CPU time, input and output bytes and newly
+    allocated bytes of every Algorithm call, keyed by the algorithm's class
+    name and the proc_grid_rank of its input chunk. The times are self
+    times: time spent in algorithms called from inside a call, such as the
+    stages of a Pipeline, is only recorded for those algorithms, so the
+    records add up to the time profiled. Profiling is enabled while the
+    profiler is used as a context manager. Given a context, the chunk-local
+    algorithms a Pipeline runs on the executors are recorded too, and sent
+    back to the driver through an accumulator. """
+
+    def __init__(self, context=None):
+        self.records = {}
+        self.pid = os.getpid()
+        self.accumulator = None
+        if context is not None:
+            self.accumulator = context.accumulator({}, ProfileParam())
+        self._lock = threading.Lock()
+        self._previous = None
+
+        # The wall and CPU time of the calls made from inside each active
+        # call, innermost last, per thread
+        self._local = threading.local()
+
+    def __enter__(self):
+        from algorithm import Algorithm
+        self._previous = Algorithm.profiler
+        Algorithm.profiler = self
+        return self
+
+    def __exit__(self, *args):
+        from algorithm import Algorithm
+        Algorithm.profiler = self._previous
+
+    def call(self, algorithm, call, input, args, kwargs):
+        """ Call an algorithm and record its self time """
+
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+
+        stack.append([0.0, 0.0])
+        wallTime = time.time()
+        cpuTime = time.clock()
+        try:
+            output = call(algorithm, input, *args, **kwargs)
+        finally:
+            cpuTime = time.clock() - cpuTime
+            wallTime = time.time() - wallTime
+            nestedWallTime, nestedCpuTime = stack.pop()
+
+        # Charge the whole call to the caller's nested time, and only what
+        # is left after the nested calls to this one
+        if stack:
+            stack[-1][0] += wallTime
+            stack[-1][1] += cpuTime
+        wallTime -= nestedWallTime
+        cpuTime -= nestedCpuTime
+
+        # Outputs that don't share memory with their input were allocated
+        inputBytes = getattr(input, "nbytes", 0)
+        outputBytes = getattr(output, "nbytes", 0)
+        allocatedBytes = 0
+        if outputBytes and not (inputBytes and
+                                np.may_share_memory(output, input)):
+            allocatedBytes = outputBytes
+
+        self.add((type(algorithm).__name__, chunk_rank(input)),
+                 (1, wallTime, cpuTime, inputBytes, outputBytes,
+                  allocatedBytes))
+        return output
+
+    def add(self, key, stats):
+        with self._lock:
+            merge_records(self.records, {key: stats})
+
+    def all_records(self):
+        """ The records of the driver and the executors """
+        records = merge_records({}, self.records)
+        if self.accumulator is not None:
+            merge_records(records, self.accumulator.value)
+        return records
+
+    def summary(self):
+        """ The statistics of each algorithm summed over its chunks, as a
+        dictionary of algorithm name to a dictionary of STATS """
+
+        totals = {}
+        for (name, _), stats in self.all_records().iteritems():
+            merge_records(totals, {name: stats})
+        return dict((name, dict(zip(STATS, stats)))
+                    for name, stats in totals.iteritems())
+
+    def report(self):
+        """ A table of the summary, slowest algorithm first """
+
+        lines = ["%-24s %8s %10s %10s %10s %10s %10s" % (
+            "algorithm", "calls", "wall s", "cpu s", "in MB", "out MB",
+            "alloc MB")]
+        summary = self.summary()
+        for name in sorted(summary, key=lambda x: -summary[x]["wallTime"]):
+            stats = summary[name]
+            lines.append("%-24s %8d %10.3f %10.3f %10.1f %10.1f %10.1f" % (
+                name, stats["calls"], stats["wallTime"], stats["cpuTime"],
+                stats["inputBytes"] / 2.0 ** 20,
+                stats["outputBytes"] / 2.0 ** 20,
+                stats["allocatedBytes"] / 2.0 ** 20))
+        return "\n".join(lines)
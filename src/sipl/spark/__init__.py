@@ -1 +1,7 @@
-from rdd_algorithms import ImageToRDD, RDDToImage
+from rdd_algorithms import (ImageToRDD, ImageFileToRDD, ImageDirectoryToRDD,
+                            RDDToImage)
+from halo import HaloExchange
+from statistics import ImageStatistics
+from pyramid import Pyramid, DownsampleRDD, BuildPyramid
+from local_context import LocalContext, LocalRDD, LocalAccumulator
+from streaming import DirectoryStream, MicroBatch, Checkpoint
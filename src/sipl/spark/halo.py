@@ -0,0 +1,98 @@
+import copy
+import numpy as np
+from itertools import product
+
+from sipl import Algorithm
+from sipl.image import Image
+
+# References
+# http://distributed-array-protocol.readthedocs.org/en/rel-0.9.0/#padding
+# http://spark.apache.org/docs/latest/api/python/pyspark.html#pyspark.RDD.cogroup
+
+
+def grid_rank(chunk):
+    """ The position of a chunk in the process grid """
+    return tuple(d["proc_grid_rank"] for d in chunk._dimData)
+
+
+def send_halos(chunk):
+    """ Cut the parts of the region a chunk owns that lie in the halos of its
+    neighbours. Returns (neighbour grid position, (global start of the
+    piece, piece)) pairs. """
+
+    dimData = chunk._dimData
+    rank = grid_rank(chunk)
+
+    # Neighbours can only be offset along the split axes
+    offsets = [(-1, 0, 1) if d["proc_grid_size"] > 1 else (0,)
+               for d in dimData]
+
+    pieces = []
+    for offset in product(*offsets):
+
+        # Skip ourselves and neighbours outside the grid
+        neighbour = tuple(r + o for r, o in zip(rank, offset))
+        if not any(offset) or not all(
+                0 <= n < d["proc_grid_size"]
+                for n, d in zip(neighbour, dimData)):
+            continue
+
+        # The halo width along an axis is the widest padding of the chunk.
+        # Cut the edge of the owned region facing the neighbour, or the
+        # whole owned region along axes the neighbour isn't offset on.
+        index = []
+        starts = []
+        for o, d in zip(offset, dimData):
+            width = max(d["padding"])
+            start, stop = {-1: (d["start"], d["start"] + width),
+                           0: (d["start"], d["stop"]),
+                           1: (d["stop"] - width, d["stop"])}[o]
+            local = d["start"] - d["padding"][0]
+            index.append(slice(start - local, stop - local))
+            starts.append(start)
+
+        piece = np.array(np.asarray(chunk)[tuple(index)])
+        if piece.size:
+            pieces.append((neighbour, (starts, piece)))
+
+    return pieces
+
+
+def receive_halos(chunk, pieces):
+    """ Copy the pieces sent by the neighbours of a chunk into its halo.
+    Returns a new chunk, as the original may be shared or read-only. """
+
+    # Copy the chunk, keeping its metadata and dimData
+    dimData = chunk._dimData
+    refreshed = Image(np.array(chunk))
+    refreshed._share_metadata(chunk)
+    refreshed._dimData = copy.deepcopy(dimData)
+
+    # Place each piece by its global start
+    for starts, piece in pieces:
+        index = tuple(slice(start - d["start"] + d["padding"][0],
+                            start - d["start"] + d["padding"][0] + size)
+                      for start, size, d in zip(starts, piece.shape, dimData))
+        refreshed[index] = piece
+
+    return refreshed
+
+
+class HaloExchange(Algorithm):
+
+    """ Refresh the halos (ghost cells) of an rdd of chunks created with
+    ImageToRDD(halo=...) from the regions owned by their neighbours. The
+    exchange runs on the executors, so iterative neighbourhood operations
+    can run without collecting the image. Each chunk must keep its dimData
+    through the operation. """
+
+    def __call__(self, rdd):
+
+        # Key the chunks and the halo pieces by grid position and join them
+        chunks = rdd.map(lambda chunk: (grid_rank(chunk), chunk))
+        pieces = rdd.flatMap(send_halos)
+
+        def receive(x):
+            _, (chunks, pieces) = x
+            return [receive_halos(chunk, pieces) for chunk in chunks]
+        return chunks.cogroup(pieces).flatMap(receive)
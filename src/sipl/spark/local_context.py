@@ -0,0 +1,438 @@
+import copy
+import glob
+import multiprocessing
+import os
+import threading
+from itertools import chain, imap, ifilter
+from multiprocessing.pool import ThreadPool
+
+from shared_memory import set_owner, share_partition, attach_partition
+
+# References
+# http://spark.apache.org/docs/latest/api/python/pyspark.html#pyspark.SparkContext
+# http://spark.apache.org/docs/latest/api/python/pyspark.html#pyspark.RDD
+# http://docs.python.org/2/library/multiprocessing.html#module-multiprocessing.pool
+
+# The rdd being computed by the worker processes. It is set before the pool
+# forks, so the workers inherit the rdd and its lineage (closures and all) and
+# only the partition indices and results are pickled. If _share is set the
+# large images of the results are returned through shared memory instead.
+_job = None
+_share = False
+
+# The accumulator updates made by the task a worker process is running, which
+# are sent back with its partition. None in the driver, where accumulators
+# are updated directly.
+_updates = None
+
+
+def _init_worker():
+    global _updates
+    _updates = []
+
+
+def _compute_partition(index):
+    """ Compute a partition of the current job in a worker. Returns the
+    partition and the accumulator updates it made. """
+    del _updates[:]
+    partition = list(_job._iterator(index))
+    if _share:
+        partition = share_partition(partition)
+    return partition, list(_updates)
+
+
+def _split(data, numSlices):
+    """ Split a list into numSlices contiguous slices, like parallelize """
+    numSlices = max(1, min(numSlices, len(data)))
+    return [data[len(data) * i // numSlices:len(data) * (i + 1) // numSlices]
+            for i in range(numSlices)]
+
+
+def _local_path(path):
+    """ Strip the file:// scheme from a path on the local filesystem """
+    if path.startswith("file://"):
+        return path[len("file://"):]
+    return path
+
+
+def _read_lines(filename):
+    with open(filename) as f:
+        for line in f:
+            yield line.rstrip("\n")
+
+
+class LocalAccumulator(object):
+
+    """ A shared variable that tasks can only add to, like a Spark
+    accumulator. Adds made in worker processes are applied in the driver
+    when their partition comes back. """
+
+    def __init__(self, id, value, param):
+        self._id = id
+        self._value = value
+        self._param = param
+        self._lock = threading.Lock()
+
+    def add(self, term):
+        if _updates is not None:
+            _updates.append((self._id, term))
+        else:
+            with self._lock:
+                self._value = self._param.addInPlace(self._value, term)
+
+    def __iadd__(self, term):
+        self.add(term)
+        return self
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+
+
+class _AddParam(object):
+
+    """ The accumulator param of numbers """
+
+    def zero(self, value):
+        return type(value)()
+
+    def addInPlace(self, value1, value2):
+        return value1 + value2
+
+
+class LocalRDD(object):
+
+    """ A partitioned dataset computed by a LocalContext. Transformations
+    are lazy and chain the functions of each partition, so a run of narrow
+    transformations is computed in one pass over a partition. Shuffles are
+    done in the driver. """
+
+    def __init__(self, context, numPartitions, compute, parent=None):
+        self.context = context
+        self._numPartitions = numPartitions
+        self._compute = compute
+        self._parent = parent
+        self._persist = False
+        self._cache = None
+
+    def _iterator(self, index):
+        """ Iterate over a partition, from the cache if it is persisted """
+        if self._cache is not None:
+            return iter(self._cache[index])
+        return self._compute(index)
+
+    def _cache_ancestors(self):
+        """ Compute any persisted ancestors which aren't cached yet, oldest
+        first, so the workers inherit their cached partitions """
+
+        ancestors = []
+        rdd = self._parent
+        while rdd is not None:
+            if rdd._persist and rdd._cache is None:
+                ancestors.append(rdd)
+            rdd = rdd._parent
+        for rdd in reversed(ancestors):
+            rdd._cache = self.context._run(rdd)
+
+    def _run(self, lazy=False):
+        """ Compute the partitions, after any persisted ancestors """
+
+        self._cache_ancestors()
+        if self._persist:
+            if self._cache is None:
+                self._cache = self.context._run(self)
+            return iter(self._cache) if lazy else self._cache
+        return self.context._run(self, lazy)
+
+    def _from_partitions(self, partitions):
+        """ A new rdd of computed partitions """
+        return self.context._from_partitions(partitions)
+
+    # Transformations
+
+    def mapPartitionsWithIndex(self, f, preservesPartitioning=False):
+        def compute(index):
+            return iter(f(index, self._iterator(index)))
+        return LocalRDD(self.context, self._numPartitions, compute, self)
+
+    def mapPartitions(self, f, preservesPartitioning=False):
+        return self.mapPartitionsWithIndex(lambda _, x: f(x))
+
+    def map(self, f, preservesPartitioning=False):
+        return self.mapPartitionsWithIndex(lambda _, x: imap(f, x))
+
+    def flatMap(self, f, preservesPartitioning=False):
+        return self.mapPartitionsWithIndex(
+            lambda _, x: chain.from_iterable(imap(f, x)))
+
+    def filter(self, f):
+        return self.mapPartitionsWithIndex(lambda _, x: ifilter(f, x))
+
+    def mapValues(self, f):
+        return self.map(lambda x: (x[0], f(x[1])))
+
+    def keys(self):
+        return self.map(lambda x: x[0])
+
+    def values(self):
+        return self.map(lambda x: x[1])
+
+    def keyBy(self, f):
+        return self.map(lambda x: (f(x), x))
+
+    def union(self, other):
+        return self._from_partitions(self._run() + other._run())
+
+    def sortByKey(self, ascending=True, numPartitions=None,
+                  keyfunc=lambda x: x):
+        items = sorted(self.collect(), key=lambda x: keyfunc(x[0]),
+                       reverse=not ascending)
+        return self._from_partitions(
+            _split(items, numPartitions or self._numPartitions))
+
+    def groupByKey(self, numPartitions=None):
+        return self._group([self], numPartitions).mapValues(lambda x: x[0])
+
+    def reduceByKey(self, func, numPartitions=None):
+
+        # Reduce each partition before the shuffle
+        def combine(items):
+            combined = {}
+            for key, value in items:
+                combined[key] = (func(combined[key], value)
+                                 if key in combined else value)
+            return combined.iteritems()
+
+        def reduce_values(values):
+            return reduce(func, values)
+        return self.mapPartitions(combine).groupByKey(
+            numPartitions).mapValues(reduce_values)
+
+    def cogroup(self, other, numPartitions=None):
+        return self._group([self, other], numPartitions)
+
+    def _group(self, rdds, numPartitions):
+        """ Group the values of each key in each of the rdds. The keys are
+        hash partitioned like Spark's and keep the order they were seen. """
+
+        numPartitions = numPartitions or self._numPartitions
+        groups = [{} for _ in range(numPartitions)]
+        for i, rdd in enumerate(rdds):
+            for partition in rdd._run(lazy=True):
+                for key, value in partition:
+                    group = groups[hash(key) % numPartitions]
+                    if key not in group:
+                        group[key] = [[] for _ in rdds]
+                    group[key][i].append(value)
+
+        return self._from_partitions(
+            [[(key, tuple(values)) for key, values in group.iteritems()]
+             for group in groups])
+
+    def repartition(self, numPartitions):
+        return self._from_partitions(_split(self.collect(), numPartitions))
+
+    def coalesce(self, numPartitions, shuffle=False):
+        return self.repartition(min(numPartitions, self._numPartitions))
+
+    def persist(self, storageLevel=None):
+        self._persist = True
+        return self
+
+    def cache(self):
+        return self.persist()
+
+    def unpersist(self):
+        self._persist = False
+        self._cache = None
+        return self
+
+    # Actions
+
+    def collect(self):
+        return list(chain.from_iterable(self._run()))
+
+    def toLocalIterator(self):
+        return chain.from_iterable(self._run(lazy=True))
+
+    def first(self):
+
+        # Compute the partitions in the driver until one has an element
+        self._cache_ancestors()
+        for index in range(self._numPartitions):
+            for x in self._iterator(index):
+                return x
+        raise ValueError("RDD is empty")
+
+    def take(self, num):
+        self._cache_ancestors()
+        items = []
+        for index in range(self._numPartitions):
+            items.extend(self._iterator(index))
+            if len(items) >= num:
+                break
+        return items[:num]
+
+    def count(self):
+        return sum(imap(len, self._run(lazy=True)))
+
+    def foreach(self, f):
+        def apply(items):
+            for x in items:
+                f(x)
+            return []
+        self.mapPartitions(apply).collect()
+
+    def reduce(self, f):
+        def reduce_partition(items):
+            items = list(items)
+            return [reduce(f, items)] if items else []
+        return reduce(f, self.mapPartitions(reduce_partition).collect())
+
+    def aggregate(self, zeroValue, seqOp, combOp):
+
+        # Aggregate each partition in the workers and combine in the driver
+        def aggregate_partition(items):
+            return [reduce(seqOp, items, copy.deepcopy(zeroValue))]
+        partials = self.mapPartitions(aggregate_partition).collect()
+        return reduce(combOp, partials, copy.deepcopy(zeroValue))
+
+    def treeAggregate(self, zeroValue, seqOp, combOp, depth=2):
+        return self.aggregate(zeroValue, seqOp, combOp)
+
+    def saveAsTextFile(self, path):
+
+        # Write each partition to a part file, like Hadoop's output format
+        path = _local_path(path)
+        if os.path.exists(path):
+            raise IOError("Output directory %s already exists" % path)
+        os.makedirs(path)
+
+        def write(index, items):
+            with open(os.path.join(path, "part-%05d" % index), "w") as f:
+                for x in items:
+                    f.write("%s\n" % x)
+            return []
+        self.mapPartitionsWithIndex(write).collect()
+        open(os.path.join(path, "_SUCCESS"), "w").close()
+
+    def getNumPartitions(self):
+        return self._numPartitions
+
+
+class LocalContext(object):
+
+    """ A stand in for a SparkContext which runs on the cores of a single
+    machine, with none of Spark's startup cost. The partitions of each job
+    are computed on a pool of forked processes, or of threads for kernels
+    which release the GIL. Implements the subset of the SparkContext and
+    RDD interfaces that sipl uses. With sharedMemory set, the processes
+    return large images through shared memory segments, which the driver
+    maps without a copy, rather than pickling them. """
+
+    def __init__(self, numWorkers=None, threads=False, sharedMemory=True):
+        self.defaultParallelism = numWorkers or multiprocessing.cpu_count()
+        self.threads = threads
+        self.sharedMemory = sharedMemory
+        self._accumulators = []
+
+    def parallelize(self, data, numSlices=None):
+        return self._from_partitions(
+            _split(list(data), numSlices or self.defaultParallelism))
+
+    def textFile(self, name, minPartitions=None):
+
+        # Read a directory of part files, as written by saveAsTextFile, or
+        # the files matching a glob
+        name = _local_path(name)
+        if os.path.isdir(name):
+            filenames = [f for f in sorted(glob.glob(os.path.join(name, "*")))
+                         if not os.path.basename(f)[0] in "._"]
+        else:
+            filenames = sorted(glob.glob(name))
+        if not filenames:
+            raise IOError("Input path does not exist: %s" % name)
+
+        # Read each file in the worker that computes its partition, unless
+        # more partitions are needed than there are files
+        if len(filenames) >= (minPartitions or 1):
+            def compute(index):
+                return _read_lines(filenames[index])
+            return LocalRDD(self, len(filenames), compute)
+        lines = list(chain.from_iterable(imap(_read_lines, filenames)))
+        return self.parallelize(lines, minPartitions)
+
+    def accumulator(self, value, accum_param=None):
+        accumulator = LocalAccumulator(len(self._accumulators), value,
+                                       accum_param or _AddParam())
+        self._accumulators.append(accumulator)
+        return accumulator
+
+    def _receive(self, result):
+        """ Apply the accumulator updates of a partition computed by a worker
+        process and map its images """
+        partition, updates = result
+        for id, term in updates:
+            self._accumulators[id].add(term)
+        return attach_partition(partition)
+
+    def _from_partitions(self, partitions):
+        """ An rdd of computed partitions """
+        partitions = partitions or [[]]
+
+        def compute(index):
+            return iter(partitions[index])
+        return LocalRDD(self, len(partitions), compute)
+
+    def _run(self, rdd, lazy=False):
+        """ Compute the partitions of an rdd on the pool. Lazily yields the
+        partitions in order if lazy is set. """
+
+        global _job, _share
+        numPartitions = rdd.getNumPartitions()
+        numWorkers = min(self.defaultParallelism, numPartitions)
+        if numWorkers <= 1:
+            partitions = (list(rdd._iterator(i))
+                          for i in range(numPartitions))
+            return partitions if lazy else list(partitions)
+
+        # Threads share the rdd. Otherwise set the job and then fork the
+        # workers, which inherit it.
+        if self.threads:
+            pool = ThreadPool(numWorkers)
+            partitions = pool.imap(lambda i: list(rdd._iterator(i)),
+                                   range(numPartitions))
+        else:
+            _job = rdd
+            _share = self.sharedMemory
+            if _share:
+                set_owner(os.getpid())
+            pool = multiprocessing.Pool(numWorkers, _init_worker)
+            partitions = imap(self._receive,
+                              pool.imap(_compute_partition,
+                                        range(numPartitions)))
+        if lazy:
+            return self._drain(pool, partitions)
+        try:
+            return list(partitions)
+        finally:
+            self._close(pool)
+
+    def _drain(self, pool, partitions):
+        try:
+            for partition in partitions:
+                yield partition
+        finally:
+            self._close(pool)
+
+    @staticmethod
+    def _close(pool):
+        pool.terminate()
+        pool.join()
+
+    def stop(self):
+        pass
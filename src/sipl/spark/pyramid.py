@@ -0,0 +1,193 @@
+import os
+import numpy as np
+from itertools import product
+
+from sipl import Algorithm
+from sipl.image import Image, crop_halo
+
+# References
+# https://en.wikipedia.org/wiki/Pyramid_(image_processing)
+# http://docs.scipy.org/doc/numpy/reference/generated/numpy.ufunc.reduceat.html
+
+# The downsampled axes. Any further axes, such as channels, are kept.
+SPATIAL_AXES = 2
+
+
+class Pyramid(list):
+
+    """ The levels of an image pyramid, as rdds of chunks. Level n is
+    downsampled by factor ** n, and level 0 is the original rdd. """
+
+    def __init__(self, levels, factor):
+        list.__init__(self, levels)
+        self.factor = factor
+
+
+def axis_blocks(d, factor):
+    """ The output blocks a chunk covers along one axis. Returns the first
+    and last (exclusive) block it owns, the number of its input pixels in
+    each block it covers, and whether its last block belongs to the next
+    chunk. A block belongs to the chunk holding its last pixel, so a block
+    straddling the boundary between two chunks goes to the later one. """
+
+    start, stop, size = d["start"], d["stop"], d["size"]
+    if stop < size and stop - start < factor:
+        raise ValueError("Chunks must be at least as large as the factor")
+
+    first = start // factor
+    last = (stop + factor - 1) // factor
+    edges = np.clip(np.arange(first, last + 1) * factor, start, stop)
+    shared = stop % factor != 0 and stop < size
+    return first, last, np.diff(edges), shared
+
+
+def downsample_chunk(chunk, factor):
+    """ Area-sum a chunk into blocks of factor pixels along the spatial axes.
+    Blocks that straddle the chunk's far edges belong to its neighbours, so
+    the sums and pixel counts are returned as pieces keyed by the grid
+    position of the chunk that owns them: (position, (block starts, sums,
+    counts, template)). Only the chunk's own piece carries a template of its
+    metadata and dimData. """
+
+    chunk = crop_halo(chunk)
+    dimData = chunk._dimData
+    axes = range(min(SPATIAL_AXES, chunk.ndim))
+
+    # Sum the pixels of each block along each spatial axis
+    sums = np.asarray(chunk)
+    sums = sums.astype(np.complex128 if np.iscomplexobj(sums)
+                       else np.float64)
+    blocks = []
+    for axis in axes:
+        first, last, counts, shared = axis_blocks(dimData[axis], factor)
+        sums = np.add.reduceat(sums, np.cumsum(counts) - counts, axis)
+        blocks.append((first, last, counts, shared))
+
+    # Split the blocks into the ones this chunk owns and the shared last
+    # block along each axis
+    rank = [d["proc_grid_rank"] for d in dimData]
+    template = (dict(chunk._meta or {}), dimData.tolist())
+    pieces = []
+    for offsets in product(*[(0, 1) if shared else (0,)
+                             for _, _, _, shared in blocks]):
+        index = []
+        starts = []
+        counts = np.ones((1,) * len(axes))
+        for axis, offset in enumerate(offsets):
+            first, last, axisCounts, shared = blocks[axis]
+            stop = len(axisCounts) - 1 if shared else len(axisCounts)
+            local = slice(stop, None) if offset else slice(0, stop)
+            index.append(local)
+            starts.append(first + local.indices(len(axisCounts))[0])
+            shape = [1] * len(axes)
+            shape[axis] = -1
+            counts = counts * axisCounts[local].reshape(shape)
+
+        position = list(rank)
+        for axis, offset in enumerate(offsets):
+            position[axis] += offset
+        pieces.append((tuple(position),
+                       (starts, sums[tuple(index)], counts,
+                        None if any(offsets) else template)))
+
+    return pieces
+
+
+def merge_blocks(pieces, factor, dtype):
+    """ Merge the pieces of the blocks owned by one chunk into the
+    downsampled chunk """
+
+    pieces = list(pieces)
+    numAxes = len(pieces[0][0])
+
+    # The owned blocks are the bounding box of the pieces
+    starts = [min(p[0][axis] for p in pieces) for axis in range(numAxes)]
+    stops = [max(p[0][axis] + p[1].shape[axis] for p in pieces)
+             for axis in range(numAxes)]
+    shape = tuple(stop - start for start, stop in zip(starts, stops))
+
+    # Add up the sums and counts of each piece in place
+    sums = None
+    counts = np.zeros(shape)
+    template = None
+    for pieceStarts, pieceSums, pieceCounts, pieceTemplate in pieces:
+        if sums is None:
+            sums = np.zeros(shape + pieceSums.shape[numAxes:],
+                            pieceSums.dtype)
+        index = tuple(slice(s - start, s - start + n) for s, start, n in
+                      zip(pieceStarts, starts, pieceSums.shape))
+        sums[index] += pieceSums
+        counts[index] += pieceCounts
+        if pieceTemplate is not None:
+            template = pieceTemplate
+
+    # Average, adding axes to the counts for any channels
+    means = sums / counts.reshape(counts.shape + (1,) * (sums.ndim - numAxes))
+    if np.issubdtype(dtype, np.integer):
+        means = np.rint(means.real)
+    chunk = Image(means.astype(dtype))
+
+    # The chunk keeps its metadata and place in the grid, with the extents
+    # of the blocks it owns in the downsampled image. The template is copied,
+    # as the pieces may be merged again if the rdd is recomputed.
+    metadata, dimData = template
+    chunk.metadata = metadata
+    dimData = [dict(d) for d in dimData]
+    for axis in range(numAxes):
+        size = dimData[axis]["size"]
+        dimData[axis]["size"] = (size + factor - 1) // factor
+        dimData[axis]["start"] = starts[axis]
+        dimData[axis]["stop"] = stops[axis]
+    chunk._dimData = dimData
+    return chunk
+
+
+class DownsampleRDD(Algorithm):
+
+    """ Downsample an rdd of chunks by area averaging factor x factor blocks
+    of pixels. Blocks that straddle chunk boundaries are averaged correctly,
+    by sending partial sums to the chunk that owns the block. Every chunk but
+    the last along each split axis must be at least factor pixels. """
+
+    _params = {"factor": 2}
+
+    def __call__(self, rdd):
+
+        factor = self.factor
+        dtype = rdd.first().dtype
+
+        def downsample(chunk):
+            return downsample_chunk(chunk, factor)
+
+        def merge(x):
+            return merge_blocks(x[1], factor, dtype)
+
+        return rdd.flatMap(downsample).groupByKey().map(merge)
+
+
+class BuildPyramid(Algorithm):
+
+    """ Build a pyramid of downsampled levels of an rdd of chunks on the
+    executors. Level n is downsampled by factor ** n with DownsampleRDD and
+    keeps the chunk/dimData scheme of level 0. Levels are persisted, so
+    later previews reuse them, and are also written as chunk stores under
+    filename/level-n if filename is set. Returns a Pyramid. """
+
+    _params = {"levels": 4,
+               "factor": 2,
+               "filename": None}
+
+    def __call__(self, rdd):
+
+        from sipl.hdfs import RDDToHDFS
+
+        levels = [rdd]
+        for level in range(1, self.levels + 1):
+            rdd = DownsampleRDD(factor=self.factor)(rdd).persist()
+            if self.filename:
+                RDDToHDFS(filename=os.path.join(self.filename,
+                                                "level-%d" % level),
+                          format="chunks")(rdd)
+            levels.append(rdd)
+
+        return Pyramid(levels, self.factor)
@@ -1,51 +1,355 @@
-from sipl import DEFAULT_NUM_SPLITS, Algorithm
-from sipl.image import Image, vsplit, vstack
+import glob
+import heapq
+import os
+import numpy as np
+from multiprocessing.pool import ThreadPool
+from os.path import abspath
+
+from sipl import DEFAULT_NUM_SPLITS, DEFAULT_CHUNK_BYTES, Algorithm
+from sipl.image import (Image, tilesplit, ndsplit, crop_halo, assemble,
+                        stack_grid)
+from sipl.image.image import write_shared_metadata, refer_metadata
+from sipl.image.pilImage import (PILImageIn, pil_image_shape,
+                                 pil_image_dtype, read_pil_window)
+
+
+def plan_num_splits(shape, dtype, parallelism, chunkBytes=DEFAULT_CHUNK_BYTES,
+                    minSplits=None, maxSplits=None, alignment=1, axes=(0,)):
+    """ The number of chunks to split an image of shape and dtype into along
+    axes, so each is about chunkBytes. More chunks than the parallelism are
+    rounded up to a multiple of it, so every wave of tasks keeps the cluster
+    busy. The number is then clipped to minSplits and maxSplits, and to the
+    number of chunks of alignment rows (or bands, or frames) there are. """
+
+    numBytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    numSplits = max(1, -(-numBytes // chunkBytes))
+    if parallelism and numSplits > parallelism:
+        numSplits = -(-numSplits // parallelism) * parallelism
+
+    if minSplits is not None:
+        numSplits = max(numSplits, minSplits)
+    if maxSplits is not None:
+        numSplits = min(numSplits, maxSplits)
+    numBlocks = int(np.prod([-(-shape[axis] // alignment) for axis in axes]))
+    return max(1, min(numSplits, numBlocks))
+
+
+def split_grid(shape, numSplits=None, tileShape=None, halo=0, alignment=1,
+               axes=(0,)):
+    """ Plan the chunks of an image with the given shape, as numSplits
+    chunks along axes (row strips by default) aligned to multiples of
+    alignment, or as a grid of tiles of at most tileShape. Returns the shape
+    of the process grid and, for each chunk, its grid position, the extents
+    it owns and those extents grown by the halo. """
+
+    # Split into a grid of tiles
+    if tileShape is not None:
+        gridShape, tiles = tilesplit(shape, tileShape)
+
+    # Otherwise split along the axes. Row strips are a grid with one column.
+    else:
+        gridShape, tiles = ndsplit(shape, numSplits, axes, alignment)
+
+    # Neighbouring chunks can only exchange halos narrower than a chunk
+    for axis in range(len(gridShape)):
+        if gridShape[axis] > 1 and halo > min(
+                stop - start for _, extents in tiles
+                for start, stop in extents[axis:axis + 1]):
+            raise ValueError("The halo is wider than a chunk")
+
+    # Grow the extents by the halo, clipped to the image
+    chunks = []
+    for rank, extents in tiles:
+        padded = tuple((max(start - halo, 0), min(stop + halo, size))
+                       for (start, stop), size in zip(extents, shape))
+        chunks.append((rank, extents, padded))
+
+    return gridShape, chunks
+
+
+def set_grid_dim_data(chunk, shape, gridShape, rank, extents, padded):
+    """ Set the dimData of a chunk read from the padded extents of an image
+    with the given shape: its position in the process grid and the region it
+    owns, with the halo as padding """
+
+    for axis in range(len(gridShape)):
+        dimData = chunk._dimData[axis]
+        dimData["size"] = shape[axis]
+        dimData["proc_grid_rank"] = rank[axis]
+        dimData["proc_grid_size"] = gridShape[axis]
+        dimData["start"], dimData["stop"] = extents[axis]
+        dimData["padding"] = (extents[axis][0] - padded[axis][0],
+                              padded[axis][1] - extents[axis][1])
 
 
 class ImageToRDD(Algorithm):
 
+    """ Split an image into an rdd of chunks. By default the image is split
+    into numSplits row strips. If tileShape is set, the image is split into
+    a grid of tiles of at most tileShape instead, with numSplits partitions
+    (one tile per partition by default). A halo of ghost cells is shipped
+    with each chunk along the split axes and recorded in the padding of its
+    dimData. If metadataFile is set, the image's metadata is written to it
+    once, and the chunks refer to it rather than each carrying a copy. It
+    must be a path every executor can read.
+
+    Setting axes splits along other axes than the rows, such as the bands
+    of a hyperspectral cube or the frames of a (time, rows, cols, channels)
+    stack, or along several of them. numSplits is then the number of chunks
+    along each of the axes, or the total number of chunks (see ndsplit).
+
+    If numSplits is None the chunks are planned from the size of the image
+    to be about chunkBytes each, between minSplits and maxSplits (see
+    plan_num_splits). Chunks start on multiples of alignment along the
+    axes, such as the row blocks of a codec. """
+
     _params = {"numSplits": DEFAULT_NUM_SPLITS,
-               "context": None}
+               "context": None,
+               "tileShape": None,
+               "halo": 0,
+               "metadataFile": None,
+               "chunkBytes": DEFAULT_CHUNK_BYTES,
+               "minSplits": None,
+               "maxSplits": None,
+               "alignment": 1,
+               "axes": (0,)}
 
     def __call__(self, image):
 
-        # If numSplits was not specified, use the default parallelism
-        if self.numSplits is None:
-            self.numSplits = self.context.defaultParallelism
+        if not self.context:
+            raise RuntimeError("Must set ImageToRDD.context")
+
+        # If numSplits was not specified, plan it from the image's size
+        numSplits = self.numSplits
+        if numSplits is None and self.tileShape is None:
+            numSplits = plan_num_splits(
+                image.shape, image.dtype, self.context.defaultParallelism,
+                self.chunkBytes, self.minSplits, self.maxSplits,
+                self.alignment, self.axes)
 
-        # Create an rdd of the split offsets and sizes
-        splits = vsplit(image, self.numSplits)
+        # Plan the chunks
+        gridShape, chunks = split_grid(image.shape, numSplits,
+                                       self.tileShape, self.halo,
+                                       self.alignment, self.axes)
+
+        # Share the metadata through the file
+        if self.metadataFile:
+            ref = write_shared_metadata(self.metadataFile, image.metadata)
+            image = refer_metadata(image, ref)
 
         # Split the images. Make sure to make a copy using the Image
         # constructor, otherwise the metadata is shared by each array.
-        images = [Image(image[s[0]:s[0] + s[1]]) for s in splits]
-
-        # Update their chunkIndex metadata
-        for i in range(len(images)):
-            images[i]._dimData[0]["proc_grid_rank"] = i
-            images[i]._dimData[0]["proc_grid_size"] = self.numSplits
+        images = []
+        for rank, extents, padded in chunks:
+            index = tuple(slice(start, stop) for start, stop in padded)
+            images.append(Image(image[index]))
+            set_grid_dim_data(images[-1], image.shape, gridShape, rank,
+                              extents, padded)
 
-        # Create an rdd to save
-        if not self.context:
-            raise RuntimeError("Must set ImageToRDD.context")
-        rdd = self.context.parallelize(images, self.numSplits)
+        # Create an rdd to save, with a partition per chunk unless tiles
+        # are grouped into numSplits partitions
+        numPartitions = len(images)
+        if self.tileShape is not None and numSplits:
+            numPartitions = numSplits
+        rdd = self.context.parallelize(images, numPartitions)
 
         # Return the rdd
         return rdd
 
 
+class ImageFileToRDD(Algorithm):
+
+    """ Read an image file into an rdd of chunks on the executors. Only
+    lightweight read plans are distributed, and each executor decodes its own
+    window of the file. The chunks carry the same dimData as ImageToRDD, and
+    the same params split the image. Files with a shape set are raw arrays of
+    dtype, starting at offset, and are memory mapped. Anything else is read
+    through PIL. """
+
+    _params = {"numSplits": DEFAULT_NUM_SPLITS,
+               "context": None,
+               "tileShape": None,
+               "halo": 0,
+               "chunkBytes": DEFAULT_CHUNK_BYTES,
+               "minSplits": None,
+               "maxSplits": None,
+               "alignment": 1,
+               "axes": (0,),
+               "shape": None,
+               "dtype": "uint8",
+               "offset": 0}
+
+    def __call__(self, filename):
+
+        if not self.context:
+            raise RuntimeError("Must set ImageFileToRDD.context")
+
+        # The readers need the full path on every executor
+        filename = abspath(filename)
+
+        # Only read the header of the file on the driver
+        shape, dtype = self.shape, self.dtype
+        if shape is None:
+            shape = pil_image_shape(filename)
+            dtype = pil_image_dtype(filename)
+        shape = tuple(shape)
+
+        # If numSplits was not specified, plan it from the image's size
+        numSplits = self.numSplits
+        if numSplits is None and self.tileShape is None:
+            numSplits = plan_num_splits(
+                shape, dtype, self.context.defaultParallelism,
+                self.chunkBytes, self.minSplits, self.maxSplits,
+                self.alignment, self.axes)
+
+        # Plan the chunks and describe how to read each one
+        gridShape, chunks = split_grid(shape, numSplits, self.tileShape,
+                                       self.halo, self.alignment, self.axes)
+        plans = [{"filename": filename,
+                  "raw": self.shape is not None,
+                  "dtype": self.dtype,
+                  "offset": self.offset,
+                  "shape": shape,
+                  "gridShape": gridShape,
+                  "rank": rank,
+                  "extents": extents,
+                  "padded": padded} for rank, extents, padded in chunks]
+
+        # Distribute the plans and read on the executors, with a partition
+        # per chunk unless tiles are grouped into numSplits partitions
+        numPartitions = len(plans)
+        if self.tileShape is not None and numSplits:
+            numPartitions = numSplits
+        rdd = self.context.parallelize(plans, numPartitions)
+        return rdd.map(read_plan)
+
+
+def read_plan(plan):
+    """ Read the chunk described by a read plan of ImageFileToRDD """
+
+    padded = plan["padded"]
+    if plan["raw"]:
+        data = np.memmap(plan["filename"], plan["dtype"], "r",
+                         plan["offset"], plan["shape"])
+        data = data[tuple(slice(start, stop) for start, stop in padded)]
+    else:
+        window = (padded + ((0, plan["shape"][1]),))[:2]
+        data = read_pil_window(plan["filename"], window)
+        if len(padded) > 2:
+            data = data[:, :, slice(*padded[2])]
+
+    # Set the same metadata and dimData as PILImageIn and ImageToRDD
+    chunk = Image(data)
+    chunk.metadata["filename"] = plan["filename"]
+    set_grid_dim_data(chunk, plan["shape"], plan["gridShape"], plan["rank"],
+                      plan["extents"], padded)
+    return chunk
+
+
+def balance_files(filenames, numSplits):
+    """ Split files into numSplits groups of about the same number of bytes
+    on disk. Each file, largest first, goes to the group with the fewest
+    bytes so far. The files of a group keep their order. """
+
+    # Only stat the files, so nothing is read on the driver
+    sizes = [(os.path.getsize(f), i) for i, f in enumerate(filenames)]
+    groups = [(0, i, []) for i in range(min(numSplits, len(filenames)))]
+    for size, i in sorted(sizes, reverse=True):
+        total, index, group = heapq.heappop(groups)
+        group.append(i)
+        heapq.heappush(groups, (total + size, index, group))
+
+    return [[filenames[i] for i in sorted(group)]
+            for _, _, group in sorted(groups, key=lambda x: x[1])]
+
+
+class ImageDirectoryToRDD(Algorithm):
+
+    """ Read a directory, a glob or a list of image files into an rdd with an
+    image per file. The files are balanced across numSplits partitions by
+    size on disk and decoded on the executors, numThreads at a time per
+    partition. The reader is an ImageIn, so the images have their filename
+    metadata set. """
+
+    _params = {"numSplits": DEFAULT_NUM_SPLITS,
+               "context": None,
+               "numThreads": 4,
+               "reader": PILImageIn}
+
+    def __call__(self, path):
+
+        if not self.context:
+            raise RuntimeError("Must set ImageDirectoryToRDD.context")
+
+        # List the files, with full paths for the executors
+        if isinstance(path, list):
+            filenames = [abspath(f) for f in path]
+        else:
+            if os.path.isdir(path):
+                path = os.path.join(path, "*")
+            filenames = sorted(abspath(f) for f in glob.glob(path)
+                               if os.path.isfile(f))
+        if not filenames:
+            raise IOError("No images found at %s" % path)
+
+        # If numSplits was not specified, use the default parallelism
+        numSplits = self.numSplits
+        if numSplits is None:
+            numSplits = self.context.defaultParallelism
+        groups = balance_files(filenames, numSplits)
+
+        # Decode each group on a thread pool, as the decoders release the GIL
+        reader = self.reader
+        numThreads = self.numThreads
+
+        def read_group(groups):
+            imageIn = reader()
+
+            def read(filename):
+                return Image(imageIn(filename))
+
+            pool = ThreadPool(numThreads)
+            try:
+                for group in groups:
+                    for image in pool.imap(read, group):
+                        yield image
+            finally:
+                pool.terminate()
+
+        rdd = self.context.parallelize(groups, len(groups))
+        return rdd.mapPartitions(read_group)
+
+
 class RDDToImage(Algorithm):
 
+    """ Collect an rdd of chunks into an image. By default the chunks are
+    sorted by grid position, collected and stacked. In streaming mode the
+    image is allocated once and the chunks are pulled a partition at a time
+    and written into place, without a sort. Setting filename streams into a
+    memory mapped file, for images larger than the driver's memory. Given a
+    Pyramid, the chunks of the requested level are collected. """
+
+    _params = {"streaming": False,
+               "filename": None,
+               "level": 0}
+
     def __call__(self, rdd):
 
-        # Regenerate the keys from the chunk's metadata
-        # TODO: Make 2d indices instead of 1d. I'm not sure how i'll split
-        # the data in the future. It might be in chunks instead of rows.
+        # Pick the level of a pyramid
+        if isinstance(rdd, list):
+            rdd = rdd[self.level]
+
+        # Stream the chunks into place
+        if self.streaming or self.filename:
+            return assemble(rdd.toLocalIterator(), self.filename)
+
+        # Regenerate the keys from the chunk's position in the process grid,
+        # along every axis
         def gen_keys(x):
-            return [x._dimData[0]["proc_grid_rank"], x]
+            return [tuple(d["proc_grid_rank"] for d in x._dimData), x]
 
-        # Sort by the keys (chunk index) and collect
-        arrays = rdd.map(gen_keys).sortByKey().collect()
+        # Sort by the keys (grid position) and collect without the halos
+        arrays = rdd.map(crop_halo).map(gen_keys).sortByKey().collect()
 
-        # Return the stacked data from the rdd
-        return vstack([data for _, data in arrays])
+        # Stack the chunks along each axis of the grid in turn
+        return stack_grid(arrays)
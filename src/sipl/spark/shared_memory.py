@@ -0,0 +1,153 @@
+import atexit
+import glob
+import os
+import tempfile
+import numpy as np
+
+from sipl.image import Image
+
+# References
+# http://docs.scipy.org/doc/numpy/reference/generated/numpy.memmap.html
+# http://man7.org/linux/man-pages/man7/shm_overview.7.html
+
+# Segments are files on the shared memory filesystem where there is one.
+# Images smaller than MIN_SHARED_BYTES are cheaper to pickle.
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+MIN_SHARED_BYTES = 1 << 16
+ALIGNMENT = 64
+
+# The pid of the driver, which names the segments so they can be cleaned up
+# if a worker dies before the driver has mapped them
+_owner = None
+
+
+class SharedImage(object):
+
+    """ The descriptor of an image in a segment, which is pickled in its
+    place """
+
+    __slots__ = ("offset", "dtype", "shape", "metadata", "dimData")
+
+    def __init__(self, offset, dtype, shape, metadata, dimData):
+        self.offset = offset
+        self.dtype = dtype
+        self.shape = shape
+        self.metadata = metadata
+        self.dimData = dimData
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+class SharedPartition(object):
+
+    """ A computed partition whose images are in a segment """
+
+    def __init__(self, path, items):
+        self.path = path
+        self.items = items
+
+
+def set_owner(pid):
+    """ Name the segments after the driver, and remove them at exit """
+
+    global _owner
+    if _owner is None:
+        atexit.register(remove_segments, pid)
+    _owner = pid
+
+
+def remove_segments(pid):
+    """ Remove the segments of a driver that were never mapped """
+    for path in glob.glob(os.path.join(SHM_DIR, "sipl-%d-*" % pid)):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _replace(item, f):
+    """ Apply f to the images in an item, looking inside tuples and lists
+    like the (key, image) pairs of a shuffle """
+
+    if isinstance(item, Image):
+        return f(item)
+    if isinstance(item, (tuple, list)):
+        return type(item)(_replace(x, f) for x in item)
+    return item
+
+
+def share_partition(items):
+    """ Write the large images of a computed partition into one segment and
+    replace them by descriptors. Called in the worker, so only the
+    descriptors are pickled back to the driver. Returns the items unchanged
+    if nothing is worth sharing or the segment can't be written. """
+
+    images = []
+
+    def collect(image):
+        if image.nbytes >= MIN_SHARED_BYTES:
+            images.append(image)
+        return image
+    items = [_replace(item, collect) for item in items]
+    if not images:
+        return items
+
+    fd, path = tempfile.mkstemp(prefix="sipl-%d-" % _owner, dir=SHM_DIR)
+    try:
+        # Write the pixels of each image at an aligned offset, recording its
+        # descriptor. Writing rather than mapping surfaces a full filesystem
+        # as an error instead of a bus error.
+        offsets = {}
+        with os.fdopen(fd, "wb") as f:
+            for image in images:
+                offset = -f.tell() % ALIGNMENT
+                f.write("\0" * offset)
+                offsets[id(image)] = SharedImage(
+                    f.tell(), image.dtype.str, image.shape,
+                    image._meta or {}, image._dims)
+                f.write(np.ascontiguousarray(image).data)
+    except (IOError, OSError):
+        os.remove(path)
+        return items
+
+    def describe(image):
+        return offsets.get(id(image), image)
+    return SharedPartition(path, [_replace(item, describe) for item in items])
+
+
+def attach_partition(partition):
+    """ Map a partition's segment and rebuild its images as views of it, in
+    the driver. The segment is removed once mapped, so the kernel frees it
+    when the last view (in the driver or a forked worker) is gone. The
+    mapping is copy on write, so workers that write to the views don't
+    change the driver's images. """
+
+    if not isinstance(partition, SharedPartition):
+        return partition
+
+    try:
+        segment = np.memmap(partition.path, np.uint8, "c")
+    finally:
+        os.remove(partition.path)
+
+    def attach(item):
+        if not isinstance(item, SharedImage):
+            return item
+        nbytes = np.dtype(item.dtype).itemsize * int(np.prod(item.shape))
+        image = segment[item.offset:item.offset + nbytes].view(item.dtype)
+        image = image.reshape(item.shape).view(Image)
+        image.metadata = item.metadata
+        if item.dimData is not None:
+            image._dimData = item.dimData
+        return image
+
+    def attach_all(item):
+        if isinstance(item, (tuple, list)):
+            return type(item)(attach_all(x) for x in item)
+        return attach(item)
+    return [attach_all(item) for item in partition.items]
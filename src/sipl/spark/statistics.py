@@ -0,0 +1,207 @@
+import warnings
+import numpy as np
+
+from sipl import Algorithm
+from sipl.image import crop_halo
+
+# References
+# http://spark.apache.org/docs/latest/api/python/pyspark.html#pyspark.RDD.treeAggregate
+# http://docs.scipy.org/doc/numpy/reference/generated/numpy.bincount.html
+# http://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Parallel_algorithm
+
+
+# The number of pixels reduced at a time. Only a block is converted to
+# float64, so the temporaries stay a few MB whatever the size of the chunk.
+BLOCK_PIXELS = 2 ** 16
+
+
+def channel_values(chunk):
+    """ The pixels of a chunk as a (pixels, channels) array of its own
+    dtype, without its halo """
+
+    values = np.asarray(crop_halo(chunk))
+    numChannels = values.shape[-1] if values.ndim == 3 else 1
+    return values.reshape((-1, numChannels))
+
+
+def default_range(dtype):
+    """ The histogram range of a dtype, or None if it must be found from the
+    data. Integers cover every value, so 256 bins of a uint8 image hold one
+    value each. """
+
+    dtype = np.dtype(dtype)
+    if dtype == np.bool_:
+        return (0, 2)
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        return (int(info.min), int(info.max) + 1)
+    return None
+
+
+def empty_statistics(numChannels, bins=None):
+    """ The partial statistics of no pixels. Their min/max values are
+    replaced by any merge. """
+
+    return {"count": 0,
+            "mean": np.zeros(numChannels),
+            "m2": np.zeros(numChannels),
+            "min": np.full(numChannels, np.inf),
+            "max": np.full(numChannels, -np.inf),
+            "histogram": (np.zeros((numChannels, bins), np.int64)
+                          if bins else None)}
+
+
+def block_statistics(block, bins=None, range=None):
+    """ The partial statistics of a (pixels, channels) block. Complex pixels
+    are reduced to their magnitude, and NaNs are left out of the min/max. """
+
+    if np.iscomplexobj(block):
+        block = np.abs(block)
+    if np.issubdtype(block.dtype, np.floating):
+
+        # Channels which are all NaN have a NaN min/max, without a warning
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            minimum = np.nanmin(block, axis=0)
+            maximum = np.nanmax(block, axis=0)
+    else:
+        minimum, maximum = block.min(axis=0), block.max(axis=0)
+
+    values = block.astype(np.float64)
+    partial = {"count": len(block),
+               "min": minimum.astype(np.float64),
+               "max": maximum.astype(np.float64),
+               "histogram": None}
+
+    # Count every channel in one bincount by offsetting each channel's bins
+    if bins:
+        numChannels = block.shape[1]
+        low, high = range
+        index = np.floor((values - low) * (bins / float(high - low)))
+        index[values == high] = bins - 1
+        with np.errstate(invalid="ignore"):
+            inside = (index >= 0) & (index < bins)
+        index += np.arange(numChannels) * bins
+        counts = np.bincount(index[inside].astype(np.int64),
+                             minlength=numChannels * bins)
+        partial["histogram"] = counts.reshape((numChannels, bins))
+
+    # The mean and the sum of squared differences from it, which don't
+    # cancel like a sum of squares does
+    partial["mean"] = values.mean(axis=0)
+    values -= partial["mean"]
+    partial["m2"] = np.einsum("ij,ij->j", values, values)
+
+    return partial
+
+
+def chunk_statistics(chunk, bins=None, range=None):
+    """ The partial statistics of a chunk per channel: count, mean, sum of
+    squared differences from the mean (m2), min, max and, if bins is set, a
+    histogram of bins equal bins over range. Values outside the range are
+    left out of the histogram, except the top edge, which goes in the last
+    bin. The pixels are reduced in blocks of BLOCK_PIXELS. """
+
+    values = channel_values(chunk)
+    partial = empty_statistics(values.shape[1], bins)
+    for start in xrange(0, len(values), BLOCK_PIXELS):
+        partial = merge_statistics(partial, block_statistics(
+            values[start:start + BLOCK_PIXELS], bins, range))
+    return partial
+
+
+def merge_statistics(a, b):
+    """ Merge two partial statistics with Chan et al.'s parallel update of
+    the mean and m2. Either may be None, for no chunks. """
+
+    if a is None or not a["count"]:
+        return b
+    if b is None or not b["count"]:
+        return a
+
+    count = a["count"] + b["count"]
+    delta = b["mean"] - a["mean"]
+    weight = b["count"] / float(count)
+
+    histogram = None
+    if a["histogram"] is not None:
+        histogram = a["histogram"] + b["histogram"]
+
+    # fmin/fmax skip the NaN min/max of channels which are all NaN
+    return {"count": count,
+            "mean": a["mean"] + delta * weight,
+            "m2": a["m2"] + b["m2"] + delta * delta * a["count"] * weight,
+            "min": np.fmin(a["min"], b["min"]),
+            "max": np.fmax(a["max"], b["max"]),
+            "histogram": histogram}
+
+
+class ImageStatistics(Algorithm):
+
+    """ Compute the statistics of an image per channel: count, min, max,
+    mean, standard deviation and a histogram of bins equal bins. Works on a
+    single image or an rdd of chunks, where the chunks are reduced on the
+    executors with treeAggregate and the driver only receives the merged
+    results. The histogram range defaults to every value of integer dtypes.
+    Floating point images, or any image if adaptive is set, take the range
+    from the data in a first pass. Without bins only the moments and the
+    min/max are computed, in a single pass. """
+
+    _params = {"bins": 256,
+               "range": None,
+               "adaptive": False}
+
+    def __call__(self, input):
+
+        # Without bins there is no histogram, and no range to find
+        if not self.bins:
+            return finish_statistics(self._aggregate(input, None, None))
+
+        # The dtype of the image, or of the first chunk of an rdd
+        if hasattr(input, "first"):
+            dtype = input.first().dtype
+        else:
+            dtype = input.dtype
+
+        # Find the range from the data if needed
+        range = self.range
+        if range is None and not self.adaptive:
+            range = default_range(dtype)
+        if range is None:
+            partial = self._aggregate(input, None, None)
+            range = (float(np.nanmin(partial["min"])),
+                     float(np.nanmax(partial["max"])))
+
+        # Make sure the range isn't empty
+        if range[1] <= range[0]:
+            range = (range[0], range[0] + 1)
+
+        partial = self._aggregate(input, self.bins, range)
+        return finish_statistics(partial, self.bins, range)
+
+    def _aggregate(self, input, bins, range):
+        """ Compute the merged partial statistics of an image or an rdd """
+
+        if not hasattr(input, "treeAggregate"):
+            return chunk_statistics(input, bins, range)
+
+        def add(partial, chunk):
+            return merge_statistics(partial,
+                                    chunk_statistics(chunk, bins, range))
+        return input.treeAggregate(None, add, merge_statistics)
+
+
+def finish_statistics(partial, bins=None, range=None):
+    """ Turn merged partial statistics into the final statistics. The
+    histogram and its bin edges are None without bins. """
+
+    binEdges = None
+    if bins:
+        binEdges = np.linspace(range[0], range[1], bins + 1)
+    return {"count": partial["count"],
+            "min": partial["min"],
+            "max": partial["max"],
+            "mean": partial["mean"],
+            "std": np.sqrt(partial["m2"] / max(partial["count"], 1)),
+            "histogram": partial["histogram"],
+            "binEdges": binEdges}
@@ -0,0 +1,281 @@
+import json
+import os
+import sys
+import threading
+import time
+from Queue import Queue, Empty, Full
+from multiprocessing.pool import ThreadPool
+
+from sipl import DEFAULT_NUM_SPLITS, Algorithm
+from sipl.image import Image
+from sipl.image.pilImage import PILImageIn
+from sipl.hdfs.filesystem import LocalFileSystem
+from rdd_algorithms import ImageDirectoryToRDD
+
+# References
+# http://spark.apache.org/docs/latest/streaming-programming-guide.html
+# http://docs.python.org/2/library/queue.html
+
+
+class Checkpoint(object):
+
+    """ The files a stream has consumed, so a restarted stream carries on
+    where it stopped. Each committed batch is appended to the file as a line
+    of json, so a crash can at most lose the line being written, and that
+    batch is read again. """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.consumed = set()
+        self.batches = 0
+        if filename is None or not os.path.exists(filename):
+            return
+
+        with open(filename) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self.consumed.update(record["files"])
+                self.batches = record["batch"] + 1
+
+    def commit(self, batch, files):
+        """ Record the files of a batch as consumed """
+
+        self.consumed.update(files)
+        self.batches = batch + 1
+        if self.filename is None:
+            return
+
+        with open(self.filename, "a") as f:
+            f.write(json.dumps({"batch": batch, "files": files}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class MicroBatch(object):
+
+    """ The frames of the files which arrived since the last batch. images is
+    an rdd if the stream has a context, and a list otherwise. The batch is
+    committed to the checkpoint when the next batch is requested, or when
+    commit is called. """
+
+    def __init__(self, stream, index, entries, backlog, images, readTime):
+        self.index = index
+        self.files = [entry["path"] for entry in entries]
+        self.images = images
+        self.stats = {"batch": index,
+                      "files": len(entries),
+                      "bytes": sum(entry["size"] for entry in entries),
+                      "backlog": backlog,
+                      "readTime": readTime}
+        self._oldest = min(entry["modified"] for entry in entries)
+        self._stream = stream
+        self._started = time.time()
+        self._committed = False
+
+    def commit(self):
+        """ Mark the files of the batch as consumed, and record its stats """
+
+        if self._committed:
+            return
+        self._committed = True
+
+        now = time.time()
+        stats = self.stats
+        stats["processTime"] = now - self._started
+        stats["latency"] = now - self._oldest
+        seconds = stats["readTime"] + stats["processTime"]
+        stats["throughput"] = (stats["bytes"] / 2.0 ** 20 / seconds
+                               if seconds else 0.0)
+        self._stream._checkpoint.commit(self.index, self.files)
+        self._stream.stats.append(stats)
+
+
+class DirectoryStream(Algorithm):
+
+    """ Stream the image files which appear in a directory as micro-batches.
+    The directory is polled every interval seconds, and files which haven't
+    been modified for minAge seconds (so they are completely written) and
+    weren't consumed already are read in order of arrival. A batch holds at
+    most batchSize files and batchBytes bytes on disk, but at least one
+    file. When processing falls behind the files wait on disk rather than in
+    memory, and the backlog of each batch says how many.
+
+    With a context each batch is an rdd with an image per file, decoded on
+    the executors (see ImageDirectoryToRDD). Without one the images are read
+    into a list on numThreads threads, and up to maxPending batches are read
+    ahead while the last one is processed. The next batch is only read when
+    there is room, so at most maxPending + 2 batches are in memory.
+
+    Setting checkpoint to a filename keeps the consumed files across
+    restarts. A batch is committed when the next one is requested, so a
+    batch which was being processed when the stream stopped is streamed
+    again. The stream ends when no file has arrived for timeout seconds, or
+    runs forever if timeout is None. The stats of each committed batch are
+    appended to the stats list of the stream. """
+
+    _params = {"context": None,
+               "numSplits": DEFAULT_NUM_SPLITS,
+               "numThreads": 4,
+               "reader": PILImageIn,
+               "pattern": "*",
+               "batchSize": 64,
+               "batchBytes": 256 * 2 ** 20,
+               "maxPending": 1,
+               "interval": 1.0,
+               "minAge": 1.0,
+               "timeout": None,
+               "checkpoint": None}
+
+    def __call__(self, directory):
+
+        self._checkpoint = Checkpoint(self.checkpoint)
+        self.stats = []
+        return self._stream(directory)
+
+    def poll(self, directory, seen):
+        """ The files in the directory which are ready to be read and haven't
+        been seen yet, oldest first """
+
+        now = time.time()
+        entries = LocalFileSystem().ls(os.path.join(directory, self.pattern))
+        return sorted((entry for entry in entries
+                       if entry["type"] == "file" and
+                       entry["path"] not in seen and
+                       now - entry["modified"] >= self.minAge),
+                      key=lambda x: (x["modified"], x["path"]))
+
+    def plan(self, directory, stopped=None):
+        """ Generate the entries of the files of each batch, with the number
+        of files left waiting, until the stopped event is set """
+
+        seen = set(self._checkpoint.consumed)
+        idleSince = time.time()
+        while stopped is None or not stopped.is_set():
+            entries = self.poll(directory, seen)
+            if not entries:
+                if (self.timeout is not None and
+                        time.time() - idleSince >= self.timeout):
+                    return
+                time.sleep(self.interval)
+                continue
+
+            # Take files until the batch is full
+            batch = entries[:1]
+            size = entries[0]["size"]
+            for entry in entries[1:self.batchSize]:
+                size += entry["size"]
+                if size > self.batchBytes:
+                    break
+                batch.append(entry)
+
+            seen.update(entry["path"] for entry in batch)
+            yield batch, len(entries) - len(batch)
+            idleSince = time.time()
+
+    def read(self, entries, pool):
+        """ Read the images of a batch on the driver, with a pool of threads.
+        Returns the images and the seconds it took. """
+
+        start = time.time()
+        imageIn = self.reader()
+        images = pool.map(lambda entry: Image(imageIn(entry["path"])),
+                          entries)
+        return images, time.time() - start
+
+    def _stream(self, directory):
+
+        # Each batch is committed once the consumer asks for the next one
+        for entries, backlog, images, readTime in self._batches(directory):
+            batch = MicroBatch(self, self._checkpoint.batches, entries,
+                               backlog, images, readTime)
+            yield batch
+            batch.commit()
+
+    def _batches(self, directory):
+        """ Generate the entries, backlog, images and read time of each
+        batch """
+
+        # The executors read the files when the rdd is computed
+        if self.context:
+            toRDD = ImageDirectoryToRDD(context=self.context,
+                                        numSplits=self.numSplits,
+                                        numThreads=self.numThreads,
+                                        reader=self.reader)
+            for entries, backlog in self.plan(directory):
+                rdd = toRDD([entry["path"] for entry in entries])
+                yield entries, backlog, rdd, 0.0
+            return
+
+        # Decode on threads which last as long as the stream
+        pool = ThreadPool(self.numThreads)
+        try:
+            if not self.maxPending:
+                for entries, backlog in self.plan(directory):
+                    images, readTime = self.read(entries, pool)
+                    yield entries, backlog, images, readTime
+            else:
+                for item in self._read_ahead(directory, pool):
+                    yield item
+        finally:
+            pool.terminate()
+
+    def _read_ahead(self, directory, pool):
+        """ Generate the batches of _batches, read on a thread """
+
+        # Read ahead on a thread. The bounded queue blocks the reader while
+        # maxPending batches are waiting, which holds back the polling too.
+        queue = Queue(self.maxPending)
+        stopped = threading.Event()
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def read_ahead():
+            try:
+                for entries, backlog in self.plan(directory, stopped):
+                    images, readTime = self.read(entries, pool)
+                    if not put((entries, backlog, images, readTime)):
+                        return
+                put(None)
+            except Exception:
+                put(sys.exc_info())
+
+        thread = threading.Thread(target=read_ahead)
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                try:
+                    item = queue.get(timeout=0.1)
+                except Empty:
+                    continue
+                if item is None:
+                    return
+                if len(item) == 3:
+                    raise item[0], item[1], item[2]
+                yield item
+        finally:
+            stopped.set()
+            thread.join()
+
+    def report(self):
+        """ A table of the stats of each committed batch """
+
+        lines = ["%6s %6s %9s %8s %9s %9s %9s %9s" % (
+            "batch", "files", "MB", "backlog", "read s", "process s",
+            "latency s", "MB/s")]
+        for stats in self.stats:
+            lines.append("%6d %6d %9.1f %8d %9.3f %9.3f %9.3f %9.1f" % (
+                stats["batch"], stats["files"], stats["bytes"] / 2.0 ** 20,
+                stats["backlog"], stats["readTime"], stats["processTime"],
+                stats["latency"], stats["throughput"]))
+        return "\n".join(lines)
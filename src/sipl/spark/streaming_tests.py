@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import numpy as np
+
+from sipl.image import Image, PILImageOut
+from streaming import DirectoryStream
+
+
+def write_frames(directory, shape, fps, seconds):
+    """ Write noisy ppm frames into a directory at fps frames per second, as
+    a camera would. Each frame is written under a temporary name and then
+    renamed, so the stream never sees half of one. """
+
+    for i in range(int(fps * seconds)):
+        start = time.time()
+        frame = Image(np.random.randint(0, 256, shape).astype(np.uint8))
+        filename = os.path.join(directory, "frame%06d.ppm" % i)
+        PILImageOut(filename=filename + ".tmp.ppm")(frame)
+        os.rename(filename + ".tmp.ppm", filename)
+        time.sleep(max(0, 1.0 / fps - (time.time() - start)))
+
+
+def time_stream(shape, fps, seconds, processTime=0.0, **params):
+    """ Stream frames written at fps for the given seconds, spending
+    processTime seconds on each frame. Returns the stream, with the stats
+    of its batches. """
+
+    directory = tempfile.mkdtemp()
+    try:
+        writer = threading.Thread(target=write_frames,
+                                  args=(directory, shape, fps, seconds))
+        writer.start()
+
+        params.setdefault("timeout", 1.0)
+        stream = DirectoryStream(pattern="frame??????.ppm", minAge=0,
+                                 interval=0.1, **params)
+        for batch in stream(directory):
+            time.sleep(processTime * len(batch.images))
+
+        writer.join()
+        return stream
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+
+    # Keeping up, and falling behind. When processing can't keep up the
+    # batches grow to batchSize and the backlog and latency grow with them.
+    for processTime in [0.02, 0.1]:
+        print "480p frames at 20 fps, %.0f ms per frame" % (processTime * 1e3)
+        print time_stream((480, 640, 3), 20, 2, processTime,
+                          batchSize=16).report()
@@ -0,0 +1,148 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from sipl.image import Image
+from sipl.image.image import ALIGNMENT
+from sipl.spark import ImageToRDD, RDDToImage, LocalContext
+from sipl.hdfs import RDDToHDFS, HDFSToRDD, read_index, select_chunks
+from sipl.hdfs.chunk_store import (read_chunk, write_chunks, write_index,
+                                   is_chunk_store, INDEX_FILENAME)
+
+
+class ChunkStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "store")
+        self.context = LocalContext(numWorkers=2, threads=True)
+
+        # A grid of 3 x 2 tiles in 2 partitions
+        self.image = Image(np.arange(30 * 20 * 3, dtype=np.uint16)
+                           .reshape((30, 20, 3)))
+        self.image.metadata["filename"] = "store.raw"
+        rdd = ImageToRDD(context=self.context, tileShape=(10, 10),
+                         numSplits=2)(self.image)
+        RDDToHDFS(filename=self.path, format="chunks")(rdd)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_index(self):
+        self.assertTrue(is_chunk_store(self.path))
+        self.assertTrue(is_chunk_store("file://" + self.path))
+        self.assertFalse(is_chunk_store(self.directory))
+
+        entries = read_index(self.path)
+        self.assertEqual([entry["rank"] for entry in entries],
+                         [[0, 0, 0], [0, 1, 0], [1, 0, 0], [1, 1, 0],
+                          [2, 0, 0], [2, 1, 0]])
+        self.assertEqual(entries[3]["extents"], [[10, 20], [10, 20], [0, 3]])
+        self.assertEqual(sorted(set(entry["block"] for entry in entries)),
+                         ["part-00000", "part-00001"])
+
+        # The chunks of a block are back to back, with their pixels aligned
+        # like the binary wire format
+        blocks = {}
+        for entry in entries:
+            blocks.setdefault(entry["block"], []).append(entry)
+        for block, blockEntries in blocks.iteritems():
+            blockEntries.sort(key=lambda entry: entry["offset"])
+            offset = 0
+            for entry in blockEntries:
+                self.assertEqual(entry["offset"], offset)
+                self.assertEqual(
+                    (entry["dataOffset"] - entry["offset"]) % ALIGNMENT, 0)
+                self.assertEqual(entry["offset"] + entry["length"] -
+                                 entry["dataOffset"], 10 * 10 * 3 * 2)
+                offset += entry["length"]
+            self.assertEqual(os.path.getsize(os.path.join(self.path, block)),
+                             offset)
+
+    def test_write_index(self):
+
+        # The entries of the partitions are sorted by rank
+        path = os.path.join(self.directory, "other")
+        os.makedirs(path)
+        chunks = ImageToRDD(context=self.context, numSplits=3)(
+            self.image).collect()
+        entries = (write_chunks(path, 1, chunks[2:]) +
+                   write_chunks(path, 0, chunks[:2]))
+        write_index(path, entries)
+        with open(os.path.join(path, INDEX_FILENAME)) as f:
+            index = json.load(f)
+        self.assertEqual(index["version"], 1)
+        self.assertEqual([entry["rank"][0] for entry in index["chunks"]],
+                         [0, 1, 2])
+        self.assertEqual([entry["block"] for entry in index["chunks"]],
+                         ["part-00000", "part-00000", "part-00001"])
+
+    def test_newer_version(self):
+        with open(os.path.join(self.path, INDEX_FILENAME), "w") as f:
+            json.dump({"version": 2, "chunks": []}, f)
+        self.assertRaises(ValueError, read_index, self.path)
+
+    def test_select_chunks(self):
+        entries = read_index(self.path)
+
+        def ranks(**params):
+            return [tuple(entry["rank"][:2]) for entry in
+                    select_chunks(entries, **params)]
+
+        self.assertEqual(len(ranks()), 6)
+        self.assertEqual(ranks(ranks=[1]), [(1, 0), (1, 1)])
+        self.assertEqual(ranks(ranks=[(2, 1), 0]), [(0, 0), (0, 1), (2, 1)])
+        self.assertEqual(ranks(ranks=[]), [])
+
+        # Windows select every chunk they overlap, on the axes given
+        self.assertEqual(ranks(window=[(5, 15)]),
+                         [(0, 0), (0, 1), (1, 0), (1, 1)])
+        self.assertEqual(ranks(window=[(5, 15), (10, 11)]), [(0, 1), (1, 1)])
+        self.assertEqual(ranks(window=[(10, 20), (0, 10)]), [(1, 0)])
+        self.assertEqual(ranks(window=[(30, 40)]), [])
+        self.assertEqual(ranks(ranks=[0], window=[(0, 30), (15, 16)]),
+                         [(0, 1)])
+
+    def test_read_chunk(self):
+        for entry in read_index(self.path):
+            index = tuple(slice(start, stop) for start, stop in
+                          entry["extents"])
+            for mmap in [True, False]:
+                chunk = read_chunk(self.path, entry, mmap)
+                self.assertTrue(np.array_equal(chunk, self.image[index]))
+                self.assertEqual(chunk.dtype, np.uint16)
+                self.assertEqual(chunk.metadata["filename"], "store.raw")
+                self.assertEqual([[d["start"], d["stop"]] for d in
+                                  chunk._dimData], entry["extents"])
+                self.assertEqual(isinstance(chunk.base, np.memmap), mmap)
+
+    def test_empty_chunk(self):
+        path = os.path.join(self.directory, "empty")
+        os.makedirs(path)
+        write_index(path, write_chunks(path, 0, [Image(np.zeros((0, 4, 1),
+                                                              np.uint8))]))
+        chunk = read_chunk(path, read_index(path)[0])
+        self.assertEqual(chunk.shape, (0, 4, 1))
+
+    def test_hdfs_to_rdd(self):
+        read = HDFSToRDD(context=self.context)
+        image = RDDToImage()(read(self.path))
+        self.assertTrue(np.array_equal(image, self.image))
+
+        read.ranks = [(1, 1)]
+        chunks = read(self.path).collect()
+        self.assertEqual(len(chunks), 1)
+        self.assertTrue(np.array_equal(chunks[0], self.image[10:20, 10:20]))
+
+        read.ranks = None
+        read.window = [(25, 30), (0, 5)]
+        chunks = read(self.path).collect()
+        self.assertEqual(len(chunks), 1)
+        self.assertTrue(np.array_equal(chunks[0], self.image[20:30, :10]))
+
+
+if __name__ == "__main__":
+    unittest.main()
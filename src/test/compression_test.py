@@ -0,0 +1,142 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from sipl.image import Image
+from sipl.image.image import read_binary_header, FORMAT_VERSION, _PREAMBLE
+from sipl.image.compression import (CODECS, get_codec, encode, decode,
+                                    shuffle, unshuffle)
+from sipl.spark import ImageToRDD, RDDToImage, LocalContext
+from sipl.hdfs import RDDToHDFS, HDFSToRDD
+
+
+def test_images():
+    """ Smooth images of several dtypes, which compress well """
+    ramp = np.add.outer(np.arange(40), np.arange(30))[:, :, np.newaxis]
+    return [Image((ramp * 1000).astype(np.uint16)),
+            Image(ramp.astype(np.uint8)),
+            Image(np.sin(ramp / 10.0).astype(np.float32)),
+            Image((ramp * -70000).astype(np.int64))]
+
+
+class CompressionTest(unittest.TestCase):
+
+    def test_shuffle(self):
+        data = np.arange(6, dtype=">u2").tostring()
+        self.assertEqual(shuffle(data, 2),
+                         "\x00" * 6 + "".join(map(chr, range(6))))
+        self.assertEqual(unshuffle(shuffle(data, 2), 2), data)
+
+    def test_encode(self):
+        for codec in CODECS:
+            for image in test_images():
+                for shuffled in [True, False]:
+                    payload, wasShuffled = encode(image, codec, shuffled)
+                    self.assertEqual(wasShuffled, shuffled and
+                                     image.dtype.itemsize > 1)
+                    data = decode(payload, image.dtype, image.shape, codec,
+                                  wasShuffled)
+                    self.assertEqual(data.dtype, image.dtype)
+                    self.assertTrue(np.array_equal(data, image),
+                                    (codec, image.dtype, shuffled))
+
+        # Non-contiguous arrays are encoded as their pixels
+        image = test_images()[0][::3, 1::2]
+        payload, shuffled = encode(image, "zlib")
+        self.assertTrue(np.array_equal(
+            decode(payload, image.dtype, image.shape, "zlib", shuffled),
+            image))
+
+    def test_compresses(self):
+        image = test_images()[0]
+        for codec in CODECS:
+            if codec != "none":
+                self.assertLess(len(encode(image, codec)[0]), image.nbytes)
+
+        # Shuffling groups the slowly changing high bytes together
+        walk = np.cumsum(np.random.randint(-3, 4, 10000)) + 30000
+        walk = walk.astype(np.uint16)
+        self.assertLess(len(encode(walk, "zlib", True)[0]),
+                        len(encode(walk, "zlib", False)[0]))
+
+    def test_unknown_codec(self):
+        self.assertRaises(ValueError, get_codec, "snappy")
+        if "lzma" not in CODECS:
+            self.assertRaises(ValueError, get_codec, "lzma")
+
+    def test_dumpb(self):
+        for codec in [codec for codec in CODECS if codec != "none"]:
+            for image in test_images():
+                image.metadata["filename"] = "ramp.raw"
+                for shuffled in [True, False]:
+                    data = image.dumpb(codec, shuffled)
+                    header, offset = read_binary_header(data)
+                    self.assertEqual(header["codec"]["name"], codec)
+                    self.assertEqual(header["codec"]["length"],
+                                     len(data) - offset)
+                    self.assertEqual(_PREAMBLE.unpack_from(data)[1],
+                                     FORMAT_VERSION)
+                    loaded = Image.loads(data)
+                    self.assertTrue(np.array_equal(loaded, image))
+                    self.assertEqual(loaded.dtype, image.dtype)
+                    self.assertEqual(loaded.metadata["filename"], "ramp.raw")
+                    self.assertEqual(loaded._dimData, image._dimData)
+
+        # Uncompressed images are still written as version 1
+        for codec in [None, "none"]:
+            data = test_images()[0].dumpb(codec)
+            self.assertNotIn("codec", read_binary_header(data)[0])
+            self.assertEqual(_PREAMBLE.unpack_from(data)[1], 1)
+
+
+class CompressedStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.context = LocalContext(numWorkers=2, threads=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def round_trip(self, format, codec, shuffled, image):
+        path = os.path.join(self.directory, "%s-%s-%s-%s" % (
+            format, codec, shuffled, image.dtype))
+        rdd = ImageToRDD(context=self.context, numSplits=3)(image)
+        RDDToHDFS(filename=path, format=format, codec=codec,
+                  shuffle=shuffled)(rdd)
+        return path, RDDToImage()(HDFSToRDD(context=self.context)(path))
+
+    def test_formats(self):
+        for format in ["chunks", "text"]:
+            for codec in CODECS.keys() + [None]:
+                for shuffled in [True, False]:
+                    for image in test_images()[::2]:
+                        path, read = self.round_trip(format, codec,
+                                                     shuffled, image)
+                        self.assertEqual(read.dtype, image.dtype)
+                        self.assertTrue(np.array_equal(read, image),
+                                        (format, codec, shuffled))
+
+    def test_text_is_base64(self):
+        path, _ = self.round_trip("text", "zlib", True, test_images()[0])
+        with open(os.path.join(path, "part-00000")) as f:
+            line = f.readline().strip()
+        self.assertTrue(line.startswith("U0lQ"))
+        self.assertEqual(read_binary_header(line.decode("base64"))[0]
+                         ["codec"]["name"], "zlib")
+
+    def test_unknown_codec(self):
+
+        # Checked before anything is written
+        rdd = ImageToRDD(context=self.context, numSplits=3)(
+            test_images()[0])
+        path = os.path.join(self.directory, "store")
+        self.assertRaises(ValueError, RDDToHDFS(
+            filename=path, format="chunks", codec="snappy"), rdd)
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from sipl.hdfs import (LocalFileSystem, HDFSFileSystem, get_filesystem,
+                       hdfs_rm, hdfs_exists, hdfs_ls)
+from sipl.hdfs.filesystem import Client, _matches
+
+
+class LocalFileSystemTest(unittest.TestCase):
+
+    def setUp(self):
+
+        # a.txt, b.png, sub/c.png and an empty directory
+        self.directory = tempfile.mkdtemp()
+        self.fs = LocalFileSystem()
+        os.makedirs(self.path("sub"))
+        os.makedirs(self.path("empty"))
+        for name, data in [("a.txt", "a"), ("b.png", "bb"),
+                           ("sub/c.png", "ccc")]:
+            with open(self.path(name), "w") as f:
+                f.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, *names):
+        return os.path.join(self.directory, *names)
+
+    def test_ls(self):
+        entries = self.fs.ls(self.directory)
+        self.assertEqual([entry["path"] for entry in entries],
+                         [self.path(name) for name in
+                          ["a.txt", "b.png", "empty", "sub"]])
+        entry = entries[1]
+        self.assertEqual((entry["type"], entry["size"]), ("file", 2))
+        self.assertAlmostEqual(entry["modified"], time.time(), delta=60)
+        self.assertEqual(entries[2]["type"], "directory")
+
+    def test_ls_recursive(self):
+        paths = [entry["path"] for entry in
+                 self.fs.ls(self.directory, recursive=True)]
+        self.assertEqual(sorted(paths), sorted(
+            self.path(name) for name in
+            ["a.txt", "b.png", "empty", "sub", "sub/c.png"]))
+
+    def test_ls_globs_and_schemes(self):
+        entries = self.fs.ls(["file://" + self.path("*.png"),
+                              self.path("sub", "*")])
+        self.assertEqual([entry["path"] for entry in entries],
+                         [self.path("b.png"), self.path("sub", "c.png")])
+        self.assertEqual(self.fs.ls(self.path("missing*")), [])
+
+    def test_exists(self):
+        self.assertTrue(self.fs.exists(self.path("a.txt")))
+        self.assertFalse(self.fs.exists(self.path("missing")))
+        self.assertEqual(self.fs.exists([self.path("*.png"),
+                                         self.path("*.jpg"),
+                                         "file://" + self.path("sub")]),
+                         [True, False, True])
+
+    def test_rm(self):
+        self.fs.rm([self.path("*.png"), self.path("missing")])
+        self.assertEqual(self.fs.exists([self.path("b.png"),
+                                         self.path("a.txt")]),
+                         [False, True])
+
+        # Directories are only removed with their contents if recursive
+        self.assertRaises(OSError, self.fs.rm, self.path("sub"))
+        self.fs.rm(self.path("sub"), recursive=True)
+        self.assertFalse(self.fs.exists(self.path("sub")))
+
+    def test_rmdir(self):
+        self.fs.rmdir(self.path("empty"))
+        self.assertFalse(self.fs.exists(self.path("empty")))
+        self.assertRaises(OSError, self.fs.rmdir, self.path("sub"))
+
+    def test_mkdir(self):
+        self.fs.mkdir([self.path("x", "y"), "file://" + self.path("sub")])
+        self.assertTrue(os.path.isdir(self.path("x", "y")))
+        self.assertTrue(os.path.exists(self.path("sub", "c.png")))
+
+    def test_utils(self):
+        url = "file://" + self.directory
+        self.assertIsInstance(get_filesystem(url), LocalFileSystem)
+        self.assertIs(get_filesystem(url), get_filesystem(url + "/a.txt"))
+        self.assertEqual(len(hdfs_ls(url + "/sub")), 1)
+        self.assertTrue(hdfs_exists(url + "/sub/c.png"))
+        hdfs_rm(url + "/sub")
+        self.assertFalse(hdfs_exists(url + "/sub"))
+
+
+class HDFSShellTest(unittest.TestCase):
+
+    """ The hdfs dfs fallback, with the shell's output given """
+
+    def setUp(self):
+        self.fs = HDFSFileSystem()
+        self.fs._client = None
+        self.commands = []
+        self.output = ""
+
+        def dfs(*args):
+            self.commands.append(args)
+            return 0, self.output
+        self.fs._dfs = dfs
+
+    def test_ls(self):
+        self.output = (
+            "Found 2 items\n"
+            "drwxr-xr-x   - user group          0 2016-01-02 03:04 /data/a\n"
+            "-rw-r--r--   3 user group       1024 2016-01-02 03:04 "
+            "/data/b c.png\n")
+        entries = self.fs.ls("hdfs://namenode:8020/data", recursive=True)
+        self.assertEqual(self.commands,
+                         [("-ls", "-R", "hdfs://namenode:8020/data")])
+        self.assertEqual([(e["path"], e["type"], e["size"]) for e in entries],
+                         [("/data/a", "directory", 0),
+                          ("/data/b c.png", "file", 1024)])
+
+    def test_exists_globs(self):
+        self.output = (
+            "-rw-r--r--   3 user group   1 2016-01-02 03:04 "
+            "hdfs://namenode:8020/data/x.png\n"
+            "drwxr-xr-x   - user group   0 2016-01-02 03:04 /data/sub\n")
+        self.assertEqual(self.fs.exists(["hdfs://namenode:8020/data/*.png",
+                                         "/data/sub", "/data/*.jpg",
+                                         "/*.png", "/data/s?b"]),
+                         [True, True, False, False, True])
+        self.assertEqual(len(self.commands), 1)
+
+    def test_rm(self):
+        self.fs.rm(["/a", "/b"], recursive=True)
+        self.assertEqual(self.commands, [("-rm", "-f", "-r", "/a", "/b")])
+
+    def test_matches(self):
+        self.assertTrue(_matches("/data/a.png", "/data/*.png"))
+        self.assertTrue(_matches("/data/sub/", "/data/s[tu]b"))
+        self.assertFalse(_matches("/data/sub/a.png", "/data/*.png"))
+        self.assertFalse(_matches("/data/A.png", "/data/a.png"))
+
+
+@unittest.skipIf(Client is None, "needs snakebite")
+class HDFSSnakebiteTest(unittest.TestCase):
+
+    def test_rm_ignores_missing(self):
+        from snakebite.errors import FileNotFoundException
+        deleted = []
+
+        class FakeClient(object):
+            def delete(self, paths, recurse=False):
+                for path in paths:
+                    if path == "/missing":
+                        raise FileNotFoundException(path)
+                    deleted.append(path)
+                    yield {"path": path, "result": True}
+
+        fs = HDFSFileSystem.__new__(HDFSFileSystem)
+        fs._client = FakeClient()
+        fs.rm(["/missing", "hdfs://namenode/a"], recursive=True)
+        self.assertEqual(deleted, ["/a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
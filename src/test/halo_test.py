@@ -0,0 +1,86 @@
+import unittest
+import numpy as np
+
+from sipl.image import Image, crop_halo
+from sipl.spark import ImageToRDD, HaloExchange, LocalContext
+from sipl.spark.halo import grid_rank, send_halos, receive_halos
+
+
+def padded_index(chunk):
+    """ The region of the image a chunk holds, with its halo """
+    return tuple(slice(d["start"] - d["padding"][0],
+                       d["stop"] + d["padding"][1]) for d in chunk._dimData)
+
+
+def stale_halos(chunk):
+    """ Double the region a chunk owns and zero its halo, as an iteration
+    of a neighbourhood operation would leave it """
+    owned = Image(np.asarray(crop_halo(chunk)) * 2)
+    stale = Image(np.zeros_like(np.asarray(chunk)))
+    stale._share_metadata(chunk)
+    stale._dimData = chunk._dimData
+    index = tuple(slice(d["padding"][0], d["padding"][0] + size)
+                  for d, size in zip(chunk._dimData, owned.shape))
+    stale[index] = owned
+    return stale
+
+
+class HaloExchangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.context = LocalContext(numWorkers=3, threads=True)
+        self.image = Image(np.arange(24 * 30 * 2, dtype=np.int32)
+                           .reshape((24, 30, 2)))
+        self.image.metadata["filename"] = "halo.raw"
+
+    def exchange(self, **params):
+        """ Split the image, make the halos stale and refresh them. Returns
+        the chunks, which must hold the doubled image with their halos. """
+        rdd = ImageToRDD(context=self.context, **params)(self.image)
+        chunks = HaloExchange()(rdd.map(stale_halos)).collect()
+        doubled = np.asarray(self.image) * 2
+        for chunk in chunks:
+            self.assertTrue(np.array_equal(np.asarray(chunk),
+                                           doubled[padded_index(chunk)]))
+        return chunks
+
+    def test_row_strips(self):
+        chunks = self.exchange(numSplits=4, halo=2)
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(sorted(grid_rank(chunk)[0] for chunk in chunks),
+                         range(4))
+
+    def test_tiles(self):
+
+        # The corners of the halos come from the diagonal neighbours
+        chunks = self.exchange(tileShape=(8, 10), halo=3)
+        self.assertEqual(len(chunks), 9)
+
+    def test_keeps_metadata_and_dim_data(self):
+        rdd = ImageToRDD(context=self.context, tileShape=(12, 15),
+                         halo=1)(self.image)
+        before = dict((grid_rank(chunk), chunk._dimData.tolist())
+                      for chunk in rdd.collect())
+        for chunk in HaloExchange()(rdd).collect():
+            self.assertEqual(chunk.metadata["filename"], "halo.raw")
+            self.assertEqual(chunk._dimData.tolist(),
+                             before[grid_rank(chunk)])
+
+    def test_no_halo(self):
+        rdd = ImageToRDD(context=self.context, numSplits=3)(self.image)
+        self.assertEqual(sum(len(send_halos(chunk))
+                             for chunk in rdd.collect()), 0)
+        self.exchange(numSplits=3)
+
+    def test_receive_copies(self):
+        chunk = ImageToRDD(context=self.context, numSplits=2,
+                           halo=2)(self.image).first()
+        data = np.array(chunk)
+        refreshed = receive_halos(chunk, [([12, 0, 0],
+                                           np.ones((2, 30, 2), np.int32))])
+        self.assertTrue(np.array_equal(np.asarray(chunk), data))
+        self.assertTrue(np.all(np.asarray(refreshed)[12:] == 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from PIL import Image as PILImage
+
+from sipl.spark import ImageDirectoryToRDD, LocalContext
+from sipl.spark.rdd_algorithms import balance_files
+
+
+class ImageDirectoryToRDDTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.context = LocalContext(numWorkers=3, threads=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write_sizes(self, sizes):
+        """ Write files of the given numbers of bytes """
+        filenames = []
+        for i, size in enumerate(sizes):
+            filenames.append(self.path("file%02d" % i))
+            with open(filenames[-1], "wb") as f:
+                f.write("x" * size)
+        return filenames
+
+    def write_images(self, shapes):
+        """ Write a PNG of random pixels for each shape """
+        images = {}
+        for i, shape in enumerate(shapes):
+            data = np.random.randint(0, 256, shape).astype(np.uint8)
+            PILImage.fromarray(data).save(self.path("image%02d.png" % i))
+            images[self.path("image%02d.png" % i)] = data
+        return images
+
+    def test_balance_files(self):
+        filenames = self.write_sizes([100, 10, 60, 50, 40, 30, 5])
+        groups = balance_files(filenames, 3)
+        self.assertEqual(len(groups), 3)
+
+        # Largest first to the lightest group, the first of equals:
+        # 100 | 60, 30, 10 | 50, 40, 5
+        self.assertEqual(groups, [[filenames[0]],
+                                  [filenames[1], filenames[2],
+                                   filenames[5]],
+                                  [filenames[3], filenames[4],
+                                   filenames[6]]])
+        totals = [sum(os.path.getsize(f) for f in group) for group in groups]
+        self.assertEqual(totals, [100, 100, 95])
+
+        # The files of a group keep their order
+        for group in groups:
+            self.assertEqual(group, sorted(group, key=filenames.index))
+
+    def test_balance_few_files(self):
+        filenames = self.write_sizes([3, 2])
+        self.assertEqual(balance_files(filenames, 4),
+                         [[filenames[0]], [filenames[1]]])
+        self.assertEqual(balance_files(filenames, 1), [filenames])
+        self.assertEqual(balance_files([], 3), [])
+
+    def test_directory(self):
+        images = self.write_images([(10, 12, 3), (40, 50, 3), (5, 5),
+                                    (30, 20, 3), (8, 9, 3)])
+        with open(self.path("notes.txt"), "w") as f:
+            f.write("not an image")
+        os.makedirs(self.path("sub.png"))
+
+        rdd = ImageDirectoryToRDD(context=self.context, numSplits=2,
+                                  numThreads=2)(self.path("*.png"))
+        self.assertEqual(rdd.getNumPartitions(), 2)
+        read = rdd.collect()
+        self.assertEqual(sorted(image.metadata["filename"] for image in
+                                read), sorted(images))
+        for image in read:
+            data = images[image.metadata["filename"]]
+            self.assertTrue(np.array_equal(
+                image, data.reshape(data.shape[:2] + (-1,))))
+
+    def test_list(self):
+        images = self.write_images([(10, 12, 3), (20, 12, 3), (6, 7, 3)])
+        filenames = sorted(images)[::-1]
+        rdd = ImageDirectoryToRDD(context=self.context, numSplits=1)(
+            [os.path.relpath(f) for f in filenames])
+
+        # A single group keeps the order of the list, with full paths
+        read = rdd.collect()
+        self.assertEqual([image.metadata["filename"] for image in read],
+                         filenames)
+        for image in read:
+            self.assertTrue(np.array_equal(
+                image, images[image.metadata["filename"]]))
+
+    def test_partitions_by_bytes(self):
+
+        # One large image and several small ones in two partitions
+        images = self.write_images([(200, 200, 3)] + [(20, 20, 3)] * 6)
+        rdd = ImageDirectoryToRDD(context=self.context, numSplits=2)(
+            self.directory)
+        sizes = rdd.mapPartitions(lambda x: [len(list(x))]).collect()
+        self.assertEqual(sizes, [1, 6])
+        self.assertEqual(rdd.count(), len(images))
+
+    def test_no_images(self):
+        self.assertRaises(IOError, ImageDirectoryToRDD(context=self.context),
+                          self.path("*.png"))
+        self.assertRaises(RuntimeError, ImageDirectoryToRDD(),
+                          self.directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+import numpy as np
+
+from sipl.image import Image
+from sipl.image.image import dim_data_dict
+from sipl.spark import ImageToRDD, LocalContext
+
+
+def dims(image):
+    return image._dimData.tolist()
+
+
+class GetItemTest(unittest.TestCase):
+
+    def setUp(self):
+
+        # A chunk in the middle of a grid, with a halo on every side
+        context = LocalContext(numWorkers=1, threads=True)
+        image = Image(np.arange(30 * 36 * 3).reshape((30, 36, 3)))
+        image.metadata["filename"] = "grid.raw"
+        chunks = ImageToRDD(context=context, tileShape=(10, 12),
+                            halo=2)(image).collect()
+        self.chunk = [chunk for chunk in chunks
+                      if chunk._dimData[0]["proc_grid_rank"] == 1 and
+                      chunk._dimData[1]["proc_grid_rank"] == 1][0]
+        self.pixels = np.asarray(self.chunk)
+        self.assertEqual(self.chunk.shape, (14, 16, 3))
+
+    def assertSame(self, a, b):
+        """ Check two images have the same pixels and dimData """
+        self.assertEqual(a.shape, b.shape)
+        self.assertTrue(np.array_equal(a, b))
+        self.assertEqual(dims(a), dims(b))
+
+    def test_fast_path_agrees(self):
+
+        # Everything the fast path takes gives the same as the general path
+        chunk = self.chunk
+        for index in [3, -1, -14, (3, 4), (-2, -3, -1), slice(2, 12),
+                      slice(None, 5), slice(-4, None), slice(-20, 100),
+                      slice(8, 3), (slice(1, -1), slice(2, 14)),
+                      (slice(0, 14), 5, slice(1, 2)), (2, slice(None)),
+                      (np.int64(3), slice(2, -2, 1)), ()]:
+            fast = chunk[index]
+            general = chunk._getitem_general(index)
+            self.assertSame(fast, general)
+            self.assertEqual(fast.metadata["filename"], "grid.raw")
+
+    def test_window(self):
+
+        # The owned region of the chunk is [10, 20) x [12, 24), with two
+        # pixels of halo on each side
+        window = self.chunk[1:13, 4:16]
+        self.assertEqual([(d["start"], d["stop"], d["padding"])
+                          for d in window._dimData[:2]],
+                         [(10, 20, (1, 1)), (14, 24, (0, 2))])
+        self.assertEqual(window._dimData[0]["proc_grid_rank"], 1)
+        self.assertEqual(self.chunk[-1]._dimData[0]["padding"], (0, 1))
+        self.assertTrue(np.array_equal(window, self.pixels[1:13, 4:16]))
+
+    def test_ints_keep_their_dimension(self):
+        self.assertEqual(self.chunk[3].shape, (1, 16, 3))
+        self.assertEqual(self.chunk[3, -1].shape, (1, 1, 3))
+        self.assertEqual(self.chunk[..., 1].shape, (14, 16, 1))
+        self.assertRaises(IndexError, self.chunk.__getitem__, 14)
+        self.assertRaises(IndexError, self.chunk.__getitem__, (0, -17))
+
+    def test_steps(self):
+
+        # A slice with a step spans the pixels it picks
+        for index, span in [((slice(1, 10, 2),), [(1, 10)]),
+                            ((slice(None, None, 3), slice(4, 0, -1)),
+                             [(0, 13), (1, 5)]),
+                            ((slice(-1, None, -5),), [(3, 14)]),
+                            ((slice(5, 5, 2),), [(5, 5)])]:
+            stepped = self.chunk[index]
+            self.assertTrue(np.array_equal(stepped, self.pixels[index]))
+            self.assertEqual(dims(stepped),
+                             dims(self.chunk._window(span)))
+
+    def test_ellipsis(self):
+        self.assertSame(self.chunk[..., 1], self.chunk[:, :, 1])
+        self.assertSame(self.chunk[2, ...], self.chunk[2])
+        self.assertSame(self.chunk[..., 3:9, :], self.chunk[:, 3:9])
+        self.assertSame(self.chunk[1:3, ..., ::2][..., 0],
+                        self.chunk[1:3, :, 0])
+        self.assertSame(self.chunk[...], self.chunk[:])
+
+    def test_newaxis(self):
+        expanded = self.chunk[None, 2:5]
+        self.assertEqual(expanded.shape, (1, 3, 16, 3))
+        self.assertTrue(np.array_equal(expanded, self.pixels[None, 2:5]))
+        self.assertEqual(dims(expanded)[0], dim_data_dict())
+        self.assertEqual(dims(expanded)[1:], dims(self.chunk[2:5]))
+
+        expanded = self.chunk[:, np.newaxis, -1, ..., None]
+        self.assertEqual(expanded.shape, (14, 1, 1, 3, 1))
+        self.assertEqual(dims(expanded)[0], dims(self.chunk)[0])
+        self.assertEqual(dims(expanded)[2], dims(self.chunk[:, -1])[1])
+        self.assertEqual(dims(expanded)[4], dim_data_dict())
+
+    def test_index_arrays(self):
+
+        # Fancy indexing can't be described, so the result gets the default
+        rows = self.chunk[[1, 5, 6]]
+        self.assertTrue(np.array_equal(rows, self.pixels[[1, 5, 6]]))
+        self.assertEqual(dims(rows), dims(Image(np.asarray(rows))))
+        mask = self.pixels[..., 0] % 2 == 0
+        self.assertTrue(np.array_equal(self.chunk[mask], self.pixels[mask]))
+
+
+if __name__ == "__main__":
+    unittest.main()
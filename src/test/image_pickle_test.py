@@ -0,0 +1,63 @@
+import unittest
+import cPickle as pickle
+import numpy as np
+
+from sipl.image import Image
+from sipl.image.image import PickleBuffer, rebuild_image
+from sipl.image.image_serialization_tests import pickle_round_trip
+
+
+def make_chunk(shape=(6, 5, 3), dtype=np.uint16):
+    """ A chunk with some metadata and a place in a process grid """
+    image = Image(np.arange(np.prod(shape), dtype=dtype).reshape(shape))
+    image.metadata["filename"] = "chunk.raw"
+    image._dimData[0]["proc_grid_rank"] = 1
+    image._dimData[0]["proc_grid_size"] = 2
+    return image
+
+
+class ImagePickleTest(unittest.TestCase):
+
+    def assertSameChunk(self, copy, image):
+        self.assertIsInstance(copy, Image)
+        self.assertEqual(copy.dtype, image.dtype)
+        self.assertTrue(np.array_equal(copy, image))
+        self.assertEqual(copy.metadata, image.metadata)
+        self.assertEqual(copy._dimData.tolist(), image._dimData.tolist())
+
+    def test_protocols(self):
+        image = make_chunk()
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copy = pickle.loads(pickle.dumps(image, protocol))
+            self.assertSameChunk(copy, image)
+
+    def test_dtypes(self):
+        for dtype in [np.uint8, np.int32, np.float32, np.complex64]:
+            image = make_chunk(dtype=dtype)
+            copy, _ = pickle_round_trip(image)
+            self.assertSameChunk(copy, image)
+
+    def test_non_contiguous(self):
+        image = make_chunk((8, 10, 3))[1:7:2, ::3]
+        copy, _ = pickle_round_trip(image)
+        self.assertTrue(np.array_equal(copy, np.asarray(image)))
+        self.assertEqual(copy.metadata, image.metadata)
+
+    def test_rebuild_views_buffer(self):
+        image = make_chunk()
+        data = np.ascontiguousarray(image)
+        copy = rebuild_image(data.data, image.dtype.str, image.shape,
+                             image.metadata.copy(), image._dimData)
+        self.assertSameChunk(copy, image)
+        self.assertTrue(np.may_share_memory(copy, data))
+
+    @unittest.skipIf(PickleBuffer is None, "needs pickle protocol 5")
+    def test_out_of_band(self):
+        image = make_chunk((64, 64, 3))
+        copy, size = pickle_round_trip(image)
+        self.assertSameChunk(copy, image)
+        self.assertLess(size, image.nbytes)
+
+
+if __name__ == "__main__":
+    unittest.main()
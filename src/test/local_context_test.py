@@ -0,0 +1,178 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from sipl.image import Image
+from sipl.spark import LocalContext
+
+
+def counted(accumulator):
+    """ The identity function, counting its calls in an accumulator """
+    def count(x):
+        accumulator.add(1)
+        return x
+    return count
+
+
+class LocalContextTest(unittest.TestCase):
+
+    # Run the tests on forked worker processes. The subclass below runs them
+    # on threads.
+    threads = False
+
+    def setUp(self):
+        self.context = LocalContext(numWorkers=3, threads=self.threads)
+
+    def test_parallelize(self):
+        rdd = self.context.parallelize(range(10), 4)
+        self.assertEqual(rdd.getNumPartitions(), 4)
+        self.assertEqual(rdd.collect(), range(10))
+        self.assertEqual(
+            rdd.mapPartitions(lambda x: [len(list(x))]).collect(),
+            [2, 3, 2, 3])
+        self.assertEqual(self.context.parallelize(range(10)).
+                         getNumPartitions(), 3)
+        self.assertEqual(self.context.parallelize([], 2).collect(), [])
+
+    def test_narrow_transformations(self):
+        rdd = self.context.parallelize(range(10), 3)
+        self.assertEqual(rdd.map(lambda x: x * 2).collect(),
+                         range(0, 20, 2))
+        self.assertEqual(rdd.flatMap(lambda x: [x] * (x % 3)).collect(),
+                         [1, 2, 2, 4, 5, 5, 7, 8, 8])
+        self.assertEqual(rdd.filter(lambda x: x % 2).collect(),
+                         [1, 3, 5, 7, 9])
+        self.assertEqual(rdd.mapPartitions(lambda x: [sum(x)]).collect(),
+                         [3, 12, 30])
+        self.assertEqual(rdd.mapPartitionsWithIndex(
+            lambda i, x: [(i, len(list(x)))]).collect(),
+            [(0, 3), (1, 3), (2, 4)])
+        self.assertEqual(rdd.keyBy(lambda x: x % 2).values().collect(),
+                         range(10))
+
+    def test_sort_by_key(self):
+        pairs = [(3, "c"), (1, "a"), (4, "d"), (2, "b")]
+        rdd = self.context.parallelize(pairs, 2)
+        self.assertEqual(rdd.sortByKey().collect(), sorted(pairs))
+        self.assertEqual(rdd.sortByKey(False).collect(),
+                         sorted(pairs, reverse=True))
+        self.assertEqual(rdd.sortByKey(keyfunc=lambda k: -k).keys().collect(),
+                         [4, 3, 2, 1])
+        self.assertEqual(rdd.sortByKey(numPartitions=4).getNumPartitions(),
+                         4)
+
+    def test_group_by_key(self):
+        rdd = self.context.parallelize([(i % 3, i) for i in range(9)], 3)
+        groups = dict(rdd.groupByKey().collect())
+        self.assertEqual(groups, {0: [0, 3, 6], 1: [1, 4, 7], 2: [2, 5, 8]})
+        self.assertEqual(sorted(rdd.reduceByKey(lambda a, b: a + b).
+                                collect()),
+                         [(0, 9), (1, 12), (2, 15)])
+
+    def test_cogroup(self):
+        a = self.context.parallelize([(1, "a"), (2, "b"), (1, "c")], 2)
+        b = self.context.parallelize([(1, "x"), (3, "y")], 2)
+        groups = dict(a.cogroup(b).collect())
+        self.assertEqual(groups, {1: (["a", "c"], ["x"]),
+                                  2: (["b"], []),
+                                  3: ([], ["y"])})
+
+    def test_tree_aggregate(self):
+
+        # The zero value is copied for every partition
+        rdd = self.context.parallelize(range(10), 4)
+
+        def add(total, x):
+            total.append(x)
+            return total
+        values = rdd.treeAggregate([], add, lambda a, b: a + b)
+        self.assertEqual(sorted(values), range(10))
+        self.assertEqual(rdd.treeAggregate(0, lambda a, x: a + x,
+                                           lambda a, b: a + b), 45)
+
+    def test_actions(self):
+        rdd = self.context.parallelize(range(10), 3)
+        self.assertEqual(rdd.count(), 10)
+        self.assertEqual(rdd.first(), 0)
+        self.assertEqual(rdd.take(4), [0, 1, 2, 3])
+        self.assertEqual(rdd.reduce(lambda a, b: a + b), 45)
+        self.assertEqual(list(rdd.toLocalIterator()), range(10))
+        self.assertEqual(rdd.union(rdd).count(), 20)
+        self.assertEqual(rdd.repartition(5).getNumPartitions(), 5)
+        self.assertRaises(ValueError,
+                          self.context.parallelize([], 2).first)
+
+    def test_accumulator(self):
+        accumulator = self.context.accumulator(0)
+        self.context.parallelize(range(10), 3).map(
+            counted(accumulator)).collect()
+        self.assertEqual(accumulator.value, 10)
+
+    def test_persist(self):
+        accumulator = self.context.accumulator(0)
+        rdd = self.context.parallelize(range(6), 3).map(
+            counted(accumulator)).persist()
+        self.assertEqual(rdd.collect(), range(6))
+        self.assertEqual(rdd.map(lambda x: -x).collect(),
+                         [-x for x in range(6)])
+        self.assertEqual(accumulator.value, 6)
+
+        # Without persist every action recomputes the partitions
+        rdd.unpersist().collect()
+        self.assertEqual(accumulator.value, 12)
+
+    def test_text_files(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "out")
+            self.context.parallelize(range(7), 3).saveAsTextFile(
+                "file://" + path)
+            self.assertEqual(sorted(os.listdir(path)),
+                             ["_SUCCESS", "part-00000", "part-00001",
+                              "part-00002"])
+            self.assertRaises(IOError, self.context.parallelize(
+                range(7)).saveAsTextFile, path)
+
+            lines = self.context.textFile(path)
+            self.assertEqual(lines.getNumPartitions(), 3)
+            self.assertEqual(lines.collect(), [str(x) for x in range(7)])
+            self.assertEqual(self.context.textFile(path, 5).
+                             getNumPartitions(), 5)
+            self.assertEqual(self.context.textFile(
+                os.path.join(path, "part-0000[01]")).count(), 4)
+            self.assertRaises(IOError, self.context.textFile,
+                              os.path.join(directory, "missing"))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_images(self):
+
+        # Large images come back from the workers intact, with their
+        # metadata and dimData
+        image = Image(np.random.randint(0, 256, (300, 400, 3))
+                      .astype(np.uint8))
+        image.metadata["filename"] = "image.raw"
+        image._dimData[0]["proc_grid_rank"] = 2
+        images = self.context.parallelize([image, image], 2).map(
+            lambda x: x.copy()).collect()
+        for result in images:
+            self.assertTrue(np.array_equal(result, image))
+            self.assertEqual(result.metadata["filename"], "image.raw")
+            self.assertEqual(result._dimData[0]["proc_grid_rank"], 2)
+
+    def test_errors(self):
+        def fail(x):
+            raise KeyError(x)
+        self.assertRaises(KeyError, self.context.parallelize(
+            range(4), 2).map(fail).collect)
+
+
+class ThreadedLocalContextTest(LocalContextTest):
+
+    threads = True
+
+
+if __name__ == "__main__":
+    unittest.main()
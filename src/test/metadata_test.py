@@ -0,0 +1,149 @@
+import copy
+import cPickle as pickle
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from sipl.image import Image
+from sipl.image.image import (METADATA_REF, _sharedMetadata,
+                              write_shared_metadata, refer_metadata)
+
+
+class MetadataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parent = Image(np.zeros((10, 8, 3), np.uint8))
+        self.parent.metadata.update({"filename": "a.tif", "bands": [1, 2]})
+        self.original = {"filename": "a.tif", "bands": [1, 2]}
+
+    def views(self):
+        """ Images sharing the parent's metadata, made in different ways """
+        return [self.parent[2:5], self.parent[..., 1], self.parent + 1,
+                Image(self.parent), self.parent.copy(),
+                self.parent.view(Image)]
+
+    def test_shared_until_written(self):
+        for view in self.views():
+            self.assertIs(view._meta, self.parent._meta)
+            self.assertEqual(view.metadata.copy(), self.original)
+
+    def test_write_through_view(self):
+        for view in self.views():
+            sibling = self.parent[5:]
+            view.metadata["filename"] = "b.tif"
+            view.metadata["row"] = 2
+            self.assertEqual(self.parent.metadata.copy(), self.original)
+            self.assertEqual(sibling.metadata.copy(), self.original)
+            self.assertEqual(view.metadata.copy(), {"filename": "b.tif",
+                                                    "bands": [1, 2],
+                                                    "row": 2})
+
+            # The parent and sibling still share their dictionary
+            self.assertIs(sibling._meta, self.parent._meta)
+
+    def test_delete_and_update_through_view(self):
+        view, sibling = self.parent[:5], self.parent[5:]
+        del view.metadata["bands"]
+        view.metadata.update(row=1)
+        self.assertEqual(view.metadata.copy(), {"filename": "a.tif",
+                                                "row": 1})
+        self.assertEqual(self.parent.metadata.copy(), self.original)
+        self.assertEqual(sibling.metadata.copy(), self.original)
+
+    def test_write_to_parent(self):
+        views = self.views()
+        self.parent.metadata["filename"] = "c.tif"
+        for view in views:
+            self.assertEqual(view.metadata["filename"], "a.tif")
+
+    def test_copies(self):
+
+        # Copies of the metadata are plain dictionaries of their own
+        metadata = self.parent.metadata.copy()
+        metadata["filename"] = "d.tif"
+        self.assertEqual(self.parent.metadata["filename"], "a.tif")
+
+        # Setting the metadata from a dictionary doesn't keep the dictionary
+        other = Image(np.zeros((2, 2, 1)))
+        other.metadata = metadata
+        metadata["row"] = 3
+        self.assertNotIn("row", other.metadata)
+        other.metadata = self.parent.metadata
+        other.metadata["row"] = 4
+        self.assertNotIn("row", self.parent.metadata)
+
+    def test_nested_values_are_not_copied(self):
+
+        # Only the dictionary is copied on write, as a shallow copy
+        view = self.parent[:5]
+        view.metadata["row"] = 1
+        self.assertIs(view.metadata["bands"], self.parent.metadata["bands"])
+
+    def test_no_metadata(self):
+        image = Image(np.zeros((4, 4, 1)))
+        view = image[1:3]
+        self.assertIsNone(view._meta)
+        view.metadata["row"] = 1
+        self.assertIsNone(image._meta)
+        self.assertEqual(len(image.metadata), 0)
+
+    def test_pickling(self):
+        view, sibling = self.parent[2:5], self.parent[5:]
+        view.metadata["row"] = 2
+        for image, expected in [(self.parent, self.original),
+                                (sibling, self.original),
+                                (view, dict(self.original, row=2))]:
+            for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+                loaded = pickle.loads(pickle.dumps(image, protocol))
+                self.assertEqual(loaded.metadata.copy(), expected)
+
+                # The loaded image owns its metadata
+                loaded.metadata["filename"] = "e.tif"
+                self.assertEqual(image.metadata["filename"],
+                                 expected["filename"])
+            self.assertEqual(copy.deepcopy(image).metadata.copy(), expected)
+
+        # Sharing images are pickled with the shared contents each
+        loaded = pickle.loads(pickle.dumps([self.parent, sibling], 2))
+        self.assertEqual(loaded[1].metadata.copy(), self.original)
+
+
+class SharedMetadataViewTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "metadata.json")
+        self.shared = {"filename": "a.tif", "bands": [1, 2]}
+        self.ref = write_shared_metadata(self.path, self.shared)
+        image = Image(np.zeros((10, 8, 3), np.uint8))
+        image.metadata.update(self.shared)
+        self.image = refer_metadata(image, self.ref)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        _sharedMetadata.clear()
+
+    def test_write_through_view(self):
+        view, sibling = self.image[:5], self.image[5:]
+        view.metadata["filename"] = "b.tif"
+        del view.metadata["bands"]
+        self.assertEqual(view.metadata.copy(), {"filename": "b.tif"})
+        self.assertEqual(sibling.metadata.copy(), self.shared)
+        self.assertEqual(self.image.metadata.copy(), self.shared)
+        self.assertEqual(_sharedMetadata[self.ref], self.shared)
+
+    def test_pickling(self):
+
+        # The reference is pickled rather than the shared contents
+        view = self.image[:5]
+        view.metadata["row"] = 1
+        loaded = pickle.loads(pickle.dumps(view, 2))
+        self.assertEqual(sorted(loaded._meta), [METADATA_REF, "row"])
+        _sharedMetadata.clear()
+        self.assertEqual(loaded.metadata.copy(), dict(self.shared, row=1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,179 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from sipl.image import Image, ndsplit, tilesplit, stack_grid
+from sipl.image.image_utils import grid, split_counts
+from sipl.spark import ImageToRDD, ImageFileToRDD, RDDToImage, LocalContext
+from sipl.spark.rdd_algorithms import plan_num_splits
+
+
+def extents_along(tiles, axis):
+    """ The distinct (start, stop) extents of the tiles along an axis """
+    return sorted(set(extents[axis] for _, extents in tiles))
+
+
+class NDSplitTest(unittest.TestCase):
+
+    def test_per_axis_counts(self):
+        gridShape, tiles = ndsplit((10, 16, 20, 3), [2, 4], axes=(0, 1))
+        self.assertEqual(gridShape, (2, 4))
+        self.assertEqual(len(tiles), 8)
+        self.assertEqual(extents_along(tiles, 0), [(0, 5), (5, 10)])
+        self.assertEqual(extents_along(tiles, 1),
+                         [(0, 4), (4, 8), (8, 12), (12, 16)])
+
+        # Row-major order
+        self.assertEqual([rank for rank, _ in tiles][:5],
+                         [(0, 0), (0, 1), (0, 2), (0, 3), (1, 0)])
+
+    def test_total_count(self):
+
+        # The first axis takes as many chunks as it can
+        gridShape, tiles = ndsplit((10, 16, 20, 3), 6, axes=(0, 1))
+        self.assertEqual(gridShape, (6, 1))
+
+        # What is left over is split along the next axis
+        gridShape, tiles = ndsplit((3, 16, 20, 3), 6, axes=(0, 1))
+        self.assertEqual(gridShape, (3, 2))
+        self.assertEqual(extents_along(tiles, 1), [(0, 8), (8, 16)])
+
+    def test_never_more_than_total(self):
+
+        # Rounding up along the later axes would give 3 x 2 chunks
+        self.assertEqual(ndsplit((3, 16, 8), 5, axes=(0, 1))[0], (1, 5))
+        self.assertEqual(ndsplit((3, 16, 8), 4, axes=(0, 1))[0], (2, 2))
+        self.assertEqual(ndsplit((3, 16, 8), 12, axes=(0, 1))[0], (3, 4))
+        for numSplits in range(1, 60):
+            for numBlocks in [[3, 16], [5, 5, 3], [1, 7], [10, 1, 6]]:
+                counts = split_counts(numSplits, numBlocks)
+                self.assertLessEqual(np.prod(counts), numSplits)
+                self.assertTrue(all(1 <= count <= blocks for count, blocks
+                                    in zip(counts, numBlocks)))
+
+    def test_alignment(self):
+        gridShape, tiles = ndsplit((10, 16, 20, 3), 6, axes=(0, 1),
+                                   alignment=4)
+        self.assertEqual(gridShape, (3, 2))
+        self.assertEqual(extents_along(tiles, 0),
+                         [(0, 4), (4, 8), (8, 10)])
+        self.assertEqual(extents_along(tiles, 1), [(0, 8), (8, 16)])
+
+    def test_later_axis(self):
+
+        # Splitting the bands of a cube leaves the axes before them whole
+        gridShape, tiles = ndsplit((20, 30, 200), 4, axes=(2,))
+        self.assertEqual(gridShape, (1, 1, 4))
+        self.assertEqual([extents for _, extents in tiles][1],
+                         ((0, 20), (0, 30), (50, 100)))
+
+    def test_array(self):
+        array = np.zeros((12, 5))
+        self.assertEqual(ndsplit(array, 3), ndsplit(array.shape, 3))
+        self.assertEqual(ndsplit(array, 3)[0], (3,))
+
+    def test_grid(self):
+        gridShape, chunks = grid([[(0, 2), (2, 5)], [(0, 3)], [(0, 1),
+                                                               (1, 4)]])
+        self.assertEqual(gridShape, (2, 1, 2))
+        self.assertEqual(chunks[0], ((0, 0, 0), ((0, 2), (0, 3), (0, 1))))
+        self.assertEqual(chunks[3], ((1, 0, 1), ((2, 5), (0, 3), (1, 4))))
+        self.assertEqual(tilesplit((5, 3), (2, 3))[0], (3, 1))
+
+    def test_stack_grid(self):
+        image = Image(np.arange(6 * 8 * 4).reshape((6, 8, 4)))
+        image.metadata["filename"] = "cube.raw"
+        gridShape, tiles = ndsplit(image, [2, 1, 3], axes=(0, 1, 2))
+        chunks = [(rank, image[tuple(slice(*e) for e in extents)])
+                  for rank, extents in tiles]
+        stacked = stack_grid(chunks)
+        self.assertTrue(np.array_equal(stacked, image))
+        self.assertEqual(stacked.metadata["filename"], "cube.raw")
+
+        # A single chunk is returned as it is
+        self.assertIs(stack_grid(chunks[:1]), chunks[0][1])
+
+
+class NDSplitRDDTest(unittest.TestCase):
+
+    def setUp(self):
+        self.context = LocalContext(numWorkers=3, threads=True)
+        self.cube = Image(np.random.rand(20, 30, 200).astype(np.float32))
+        self.video = Image(np.random.randint(0, 255, (10, 16, 20, 3))
+                           .astype(np.uint8))
+
+    def round_trip(self, image, **params):
+        rdd = ImageToRDD(context=self.context, **params)(image)
+        return rdd, RDDToImage()(rdd)
+
+    def test_bands(self):
+        rdd, image = self.round_trip(self.cube, numSplits=4, axes=(2,),
+                                     halo=3)
+        self.assertTrue(np.array_equal(image, self.cube))
+        chunk = rdd.collect()[1]
+        self.assertEqual(chunk.shape, (20, 30, 56))
+        self.assertEqual(chunk._dimData[2]["padding"], (3, 3))
+        self.assertEqual(chunk._dimData[2]["proc_grid_size"], 4)
+        self.assertEqual(chunk._dimData[0]["padding"], (0, 0))
+
+    def test_frames(self):
+        for axes, numSplits in [((0,), 5), ((0, 1), [2, 4]), ((0, 1), 6)]:
+            rdd, image = self.round_trip(self.video, numSplits=numSplits,
+                                         axes=axes, halo=1)
+            self.assertTrue(np.array_equal(image, self.video), axes)
+
+        # Streamed back into place too
+        rdd = ImageToRDD(context=self.context, numSplits=[2, 4],
+                         axes=(0, 1), halo=1)(self.video)
+        self.assertTrue(np.array_equal(RDDToImage(streaming=True)(rdd),
+                                       self.video))
+
+    def test_halo_too_wide(self):
+        self.assertRaises(ValueError, ImageToRDD(
+            context=self.context, numSplits=4, axes=(2,), halo=60),
+            self.cube)
+
+    def test_image_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "cube.raw")
+            self.cube.tofile(filename)
+            rdd = ImageFileToRDD(context=self.context, numSplits=5,
+                                 axes=(2,), halo=2, shape=self.cube.shape,
+                                 dtype="float32")(filename)
+            self.assertEqual(rdd.count(), 5)
+            self.assertTrue(np.array_equal(RDDToImage()(rdd), self.cube))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_plan_num_splits(self):
+
+        # Planned over the blocks of the split axes only
+        self.assertEqual(plan_num_splits((20, 30, 200), np.float32, 0,
+                                         chunkBytes=20 * 30 * 4,
+                                         axes=(2,)), 200)
+        self.assertEqual(plan_num_splits((20, 30, 200), np.float32, 0,
+                                         chunkBytes=100, axes=(0,)), 20)
+        self.assertEqual(plan_num_splits((10, 16, 20, 3), np.uint8, 0,
+                                         chunkBytes=10, axes=(0, 1)), 160)
+        self.assertEqual(plan_num_splits((10, 16, 20, 3), np.uint8, 0,
+                                         chunkBytes=10, alignment=4,
+                                         axes=(0, 1)), 12)
+        # The grid never has more chunks than maxSplits
+        for maxSplits in range(1, 20):
+            rdd = ImageToRDD(context=self.context, numSplits=None,
+                             chunkBytes=10, maxSplits=maxSplits,
+                             axes=(0, 1))(Image(np.zeros((3, 16, 8))))
+            self.assertLessEqual(rdd.count(), maxSplits)
+        self.assertEqual(rdd.count(), 18)
+
+        rdd = ImageToRDD(context=self.context, numSplits=None,
+                         chunkBytes=20 * 30 * 4 * 100, axes=(2,))(self.cube)
+        self.assertEqual(rdd.count(), 2)
+        self.assertEqual(rdd.first().shape, (20, 30, 100))
+
+
+if __name__ == "__main__":
+    unittest.main()
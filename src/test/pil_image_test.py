@@ -0,0 +1,189 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from PIL import Image as PILImage
+
+from sipl.image import PILImageIn, StreamImageOut, Image
+from sipl.image.pilImage import (read_pil_window, pil_image_shape,
+                                 pil_image_dtype)
+
+
+def block_mean(data, factor):
+    """ Average factor x factor blocks of an array, the slow way """
+    rows, cols = -(-data.shape[0] // factor), -(-data.shape[1] // factor)
+    means = np.empty((rows, cols, data.shape[2]))
+    for i in range(rows):
+        for j in range(cols):
+            block = data[i * factor:(i + 1) * factor,
+                         j * factor:(j + 1) * factor]
+            means[i, j] = block.reshape((-1, data.shape[2])).mean(axis=0)
+    if data.dtype.kind in "iu":
+        means = np.rint(means)
+    return means.astype(data.dtype)
+
+
+class PILImageInTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.rgb = np.random.randint(0, 256, (61, 83, 3)).astype(np.uint8)
+
+        # The same pixels in the lossless formats, and the layouts read a
+        # piece at a time
+        for name, params in [("raw.tif", {}),
+                             ("deflate.tif", {"compression": "tiff_deflate"}),
+                             ("lzw.tif", {"compression": "tiff_lzw"}),
+                             ("image.ppm", {}),
+                             ("image.png", {})]:
+            self.save(PILImage.fromarray(self.rgb), name, **params)
+        StreamImageOut(filename=self.path("tiled.tif"), tileShape=(16, 32))(
+            Image(self.rgb))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def save(self, pilImage, name, **params):
+        pilImage.save(self.path(name), **params)
+        return self.path(name)
+
+    def test_whole(self):
+        for name in ["raw.tif", "deflate.tif", "lzw.tif", "tiled.tif",
+                     "image.ppm", "image.png"]:
+            image = PILImageIn()(self.path(name))
+            self.assertTrue(np.array_equal(image, self.rgb), name)
+            self.assertEqual(image.metadata["filename"], self.path(name))
+            self.assertEqual(pil_image_shape(self.path(name)), (61, 83, 3))
+            self.assertEqual(pil_image_dtype(self.path(name)), np.uint8)
+
+    def test_windows(self):
+
+        # Windows inside the image, at its edges, running off it and with
+        # stops of None all match a crop by PIL
+        windows = [((10, 40), (5, 70)), ((0, 61), (0, 83)),
+                   ((60, 61), (82, 83)), ((50, 100), (70, 200)),
+                   ((20, None), (0, None)), ((0, 1), (None, None)),
+                   ((30, 30), (0, 10))]
+        for name in ["raw.tif", "deflate.tif", "lzw.tif", "tiled.tif",
+                     "image.ppm", "image.png"]:
+            for window in windows:
+                (top, bottom), (left, right) = window
+                expected = self.rgb[top:bottom, left:right]
+                self.assertTrue(np.array_equal(
+                    read_pil_window(self.path(name), window), expected),
+                    (name, window))
+
+    def test_region_and_rows(self):
+        image = PILImageIn()(self.path("deflate.tif"),
+                             region=((10, 20), (30, 50)))
+        self.assertTrue(np.array_equal(image, self.rgb[10:20, 30:50]))
+        image = PILImageIn()(self.path("raw.tif"), rows=(5, 17))
+        self.assertTrue(np.array_equal(image, self.rgb[5:17]))
+        image = PILImageIn()(self.path("image.ppm"), rows=(40, None))
+        self.assertTrue(np.array_equal(image, self.rgb[40:]))
+
+    def test_reduce(self):
+        for name in ["raw.tif", "tiled.tif", "image.png"]:
+            for reduce in [2, 3, 4, 8, 12]:
+                for window in [((0, None), (0, None)), ((3, 50), (5, 77))]:
+                    (top, bottom), (left, right) = window
+                    data = read_pil_window(self.path(name), window, reduce)
+                    self.assertTrue(np.array_equal(
+                        data, block_mean(self.rgb[top:bottom, left:right],
+                                         reduce)), (name, reduce, window))
+
+    def test_reduce_jpeg(self):
+
+        # The decoder scales by a power of two, so only the shapes and the
+        # rough pixel values are the same
+        smooth = np.zeros((200, 300, 3), np.uint8)
+        smooth[..., 0] = np.arange(300) * 255 // 300
+        smooth[..., 1] = (np.arange(200) * 255 // 200)[:, np.newaxis]
+        name = self.save(PILImage.fromarray(smooth), "image.jpg",
+                         quality=95)
+        for reduce in [1, 2, 3, 4, 8, 12]:
+            for window in [((0, None), (0, None)), ((3, 150), (5, 250)),
+                           ((16, 80), (8, 96))]:
+                (top, bottom), (left, right) = window
+                expected = block_mean(smooth[top:bottom, left:right],
+                                      reduce)
+                data = read_pil_window(name, window, reduce)
+                self.assertEqual(data.shape, expected.shape,
+                                 (reduce, window))
+                self.assertLess(np.abs(data.astype(int) - expected).mean(),
+                                4, (reduce, window))
+
+    def test_reduce_shapes(self):
+        for reduce, shape in [(2, (31, 42, 3)), (3, (21, 28, 3)),
+                              (4, (16, 21, 3)), (8, (8, 11, 3)),
+                              (12, (6, 7, 3))]:
+            self.assertEqual(read_pil_window(self.path("deflate.tif"),
+                                             reduce=reduce).shape, shape)
+            self.assertEqual(PILImageIn()(self.path("image.ppm"),
+                                          rows=(1, 61),
+                                          reduce=reduce).shape[0],
+                             -(-60 // reduce))
+
+    def test_16_bit(self):
+        data = np.random.randint(0, 2 ** 16, (37, 45)).astype(np.uint16)
+        for mode, compression in [("I;16", None), ("I;16", "tiff_deflate"),
+                                  ("I;16B", None), ("I;16", "tiff_lzw")]:
+            raw = data.astype(">u2" if mode == "I;16B" else "<u2")
+            pilImage = PILImage.frombuffer(mode, (45, 37), raw.tobytes(),
+                                           "raw", mode, 0, 1)
+            name = self.save(pilImage, "deep.tif", compression=compression)
+            self.assertEqual(pil_image_dtype(name), np.uint16)
+            image = PILImageIn()(name)
+            self.assertEqual(image.dtype, np.uint16)
+            self.assertTrue(np.array_equal(np.asarray(image)[..., 0], data),
+                            mode)
+            self.assertTrue(np.array_equal(
+                read_pil_window(name, ((5, 30), (10, 40)))[..., 0],
+                data[5:30, 10:40]))
+
+    def test_32_bit(self):
+        ints = np.random.randint(-2 ** 31, 2 ** 31, (37, 45)).astype(np.int32)
+        floats = np.random.randn(37, 45).astype(np.float32)
+        for data, compression in [(ints, None), (ints, "tiff_deflate"),
+                                  (floats, None)]:
+            name = self.save(PILImage.fromarray(data), "deep.tif",
+                             compression=compression)
+            image = PILImageIn()(name)
+            self.assertEqual(image.dtype, data.dtype)
+            self.assertTrue(np.array_equal(np.asarray(image)[..., 0], data))
+            self.assertTrue(np.array_equal(
+                read_pil_window(name, ((5, 30), (10, 40)))[..., 0],
+                data[5:30, 10:40]))
+
+        # Reduced floats are averaged without rounding
+        name = self.save(PILImage.fromarray(floats), "deep.tif")
+        self.assertTrue(np.allclose(
+            read_pil_window(name, reduce=4),
+            block_mean(floats[..., np.newaxis], 4)))
+
+    def test_conversions(self):
+
+        # Palette and 1 bit images are read as PIL converts them
+        palette = PILImage.fromarray(self.rgb).convert("P")
+        bits = PILImage.fromarray(self.rgb).convert("1")
+        for pilImage, mode, channels in [(palette, "RGB", 3),
+                                         (bits, "L", 1)]:
+            name = self.save(pilImage, "converted.png")
+            expected = np.asarray(PILImage.open(name).convert(mode))
+            expected = expected.reshape((61, 83, channels))
+            self.assertEqual(pil_image_shape(name), (61, 83, channels))
+            self.assertTrue(np.array_equal(PILImageIn()(name), expected))
+            self.assertTrue(np.array_equal(
+                read_pil_window(name, ((10, 20), (30, 60))),
+                expected[10:20, 30:60]))
+
+    def test_unsupported(self):
+        name = self.save(PILImage.new("LAB", (4, 4)), "image.tif")
+        self.assertRaises(ValueError, PILImageIn(), name)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+import unittest
+import numpy as np
+
+from sipl import Algorithm
+from sipl.algorithm import Pipeline, Scratch, run_chunk
+from sipl.image import Image
+from sipl.spark import ImageToRDD, RDDToImage, LocalContext
+
+
+class Double(Algorithm):
+
+    """ Returns a new chunk """
+
+    chunkLocal = True
+
+    def __call__(self, chunk):
+        return chunk * 2
+
+
+class Increment(Algorithm):
+
+    """ Writes into its input """
+
+    chunkLocal = True
+    inPlace = True
+
+    def __call__(self, chunk):
+        chunk += 1
+        return chunk
+
+
+class Negate(Algorithm):
+
+    """ Negates through a scratch buffer, and records the buffers it was
+    given """
+
+    chunkLocal = True
+    usesScratch = True
+    _params = {"buffers": None}
+
+    def __call__(self, chunk, scratch):
+        buffer = scratch.get("negate", chunk.shape, chunk.dtype)
+        np.negative(chunk, out=buffer)
+        if self.buffers is not None:
+            self.buffers.append(buffer.ctypes.data)
+        return Image(buffer.copy())
+
+
+class Collect(Algorithm):
+
+    """ A stage which isn't chunk-local """
+
+    def __call__(self, rdd):
+        return rdd
+
+
+def make_chunk():
+    chunk = Image(np.arange(12, dtype=np.int32).reshape((4, 3, 1)))
+    chunk._dimData[0]["proc_grid_rank"] = 1
+    chunk._dimData[0]["proc_grid_size"] = 2
+    return chunk
+
+
+class PipelineTest(unittest.TestCase):
+
+    def test_or_flattens(self):
+        a, b, c = Double(), Increment(), Collect()
+        pipeline = a | b | c
+        self.assertIsInstance(pipeline, Pipeline)
+        self.assertEqual(pipeline.algorithms, [a, b, c])
+        self.assertEqual((a | (b | c)).algorithms, [a, b, c])
+
+    def test_stages(self):
+        a, b, c, d = Double(), Increment(), Collect(), Double()
+        self.assertEqual((a | b | c | d).stages(),
+                         [(True, [a, b]), (False, [c]), (True, [d])])
+
+    def test_single_image(self):
+        chunk = make_chunk()
+        result = (Double() | Increment())(chunk)
+        self.assertTrue(np.array_equal(result, np.asarray(chunk) * 2 + 1))
+
+    def test_in_place_never_writes_input(self):
+        chunk = make_chunk()
+        data = np.array(chunk)
+        result = (Increment() | Increment())(chunk)
+        self.assertTrue(np.array_equal(chunk, data))
+        self.assertTrue(np.array_equal(result, data + 2))
+        self.assertFalse(np.may_share_memory(result, chunk))
+
+    def test_in_place_writes_owned_result(self):
+
+        # The result of Double is private, so Increment needn't copy it
+        copies = []
+        original = Image.copy
+
+        def counted_copy(self, *args):
+            copies.append(self)
+            return original(self, *args)
+        Image.copy = counted_copy
+        try:
+            run_chunk([Double(), Increment()], make_chunk(), Scratch())
+            self.assertEqual(copies, [])
+            run_chunk([Increment()], make_chunk(), Scratch())
+            self.assertEqual(len(copies), 1)
+        finally:
+            Image.copy = original
+
+    def test_keeps_dim_data(self):
+        chunk = make_chunk()
+        for algorithms in [[Double()], [Increment()], [Negate()]]:
+            result = run_chunk(algorithms, chunk, Scratch())
+            self.assertEqual(result._dimData.tolist(),
+                             chunk._dimData.tolist())
+
+    def test_rdd(self):
+        context = LocalContext(numWorkers=2, threads=True)
+        image = Image(np.arange(60, dtype=np.int32).reshape((10, 6, 1)))
+        rdd = ImageToRDD(context=context, numSplits=4)(image)
+        before = [np.array(chunk) for chunk in rdd.collect()]
+        result = RDDToImage()((Double() | Increment() | Negate())(rdd))
+        self.assertTrue(np.array_equal(result, -(np.asarray(image) * 2 + 1)))
+
+        # The chunks of the input rdd are unchanged
+        for chunk, data in zip(rdd.collect(), before):
+            self.assertTrue(np.array_equal(chunk, data))
+
+
+class ImageCopyTest(unittest.TestCase):
+
+    def test_copy_keeps_dim_data(self):
+        chunk = make_chunk()
+        chunk.metadata["filename"] = "chunk.raw"
+        copy = chunk.copy()
+        self.assertIsInstance(copy, Image)
+        self.assertFalse(np.may_share_memory(copy, chunk))
+        self.assertEqual(copy._dimData.tolist(), chunk._dimData.tolist())
+        self.assertEqual(copy.metadata, chunk.metadata)
+
+        # Writing the copy's dimData leaves the original alone
+        copy._dimData[0]["proc_grid_rank"] = 0
+        self.assertEqual(chunk._dimData[0]["proc_grid_rank"], 1)
+
+
+class ScratchTest(unittest.TestCase):
+
+    def test_reuses_memory(self):
+        scratch = Scratch()
+        a = scratch.get("a", (4, 4), np.float64)
+        b = scratch.get("a", (2, 8), np.float32)
+        self.assertEqual((b.shape, b.dtype), ((2, 8), np.float32))
+        self.assertEqual(a.ctypes.data, b.ctypes.data)
+
+    def test_grows(self):
+        scratch = Scratch()
+        scratch.get("a", (2, 2), np.uint8)
+        a = scratch.get("a", (100, 100), np.float64)
+        self.assertEqual(a.shape, (100, 100))
+        self.assertTrue(np.may_share_memory(
+            a, scratch.get("a", (10,), np.uint8)))
+
+    def test_names_are_separate(self):
+        scratch = Scratch()
+        a = scratch.get("a", (4,), np.int32)
+        b = scratch.get("b", (4,), np.int32)
+        self.assertFalse(np.may_share_memory(a, b))
+
+    def test_shared_by_partition(self):
+
+        # Every chunk of a partition gets the same buffer
+        buffers = []
+        context = LocalContext(numWorkers=1, threads=True)
+        image = Image(np.zeros((12, 4, 1), np.int32))
+        rdd = ImageToRDD(context=context, numSplits=3)(image)
+        rdd = context.parallelize(rdd.collect(), 1)
+        Pipeline(Negate(buffers=buffers))(rdd).collect()
+        self.assertEqual(len(buffers), 3)
+        self.assertEqual(len(set(buffers)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
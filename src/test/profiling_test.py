@@ -0,0 +1,126 @@
+import time
+import unittest
+import numpy as np
+
+from sipl import Algorithm, Profiler
+from sipl.image import Image
+from sipl.spark import ImageToRDD, RDDToImage, LocalContext
+
+
+class Sleep(Algorithm):
+
+    chunkLocal = True
+    _params = {"seconds": 0.05}
+
+    def __call__(self, chunk):
+        time.sleep(self.seconds)
+        return chunk
+
+
+class Outer(Algorithm):
+
+    """ Sleeps, and calls another algorithm """
+
+    _params = {"seconds": 0.05, "inner": None}
+
+    def __call__(self, chunk):
+        time.sleep(self.seconds)
+        return self.inner(chunk)
+
+
+class Fail(Algorithm):
+
+    def __call__(self, chunk):
+        raise ValueError("failed")
+
+
+def total(profiler, name, stat):
+    return profiler.summary()[name][stat]
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def test_disabled(self):
+        profiler = Profiler()
+        with profiler:
+            pass
+        Sleep(seconds=0)(Image(np.zeros((2, 2, 1))))
+        self.assertEqual(profiler.records, {})
+
+    def test_self_time(self):
+        chunk = Image(np.zeros((4, 4, 1)))
+        outer = Outer(seconds=0.05, inner=Sleep(seconds=0.1))
+        with Profiler() as profiler:
+            start = time.time()
+            outer(chunk)
+            elapsed = time.time() - start
+
+        # The inner call isn't counted in the outer one's time
+        self.assertAlmostEqual(total(profiler, "Outer", "wallTime"), 0.05,
+                               delta=0.03)
+        self.assertAlmostEqual(total(profiler, "Sleep", "wallTime"), 0.1,
+                               delta=0.03)
+        self.assertLessEqual(sum(stats["wallTime"] for stats in
+                                 profiler.summary().values()), elapsed)
+
+    def test_pipeline(self):
+        chunk = Image(np.zeros((4, 4, 1)))
+        with Profiler() as profiler:
+            start = time.time()
+            (Sleep(seconds=0.05) | Sleep(seconds=0.05))(chunk)
+            elapsed = time.time() - start
+
+        summary = profiler.summary()
+        self.assertEqual(summary["Sleep"]["calls"], 2)
+        self.assertEqual(summary["Pipeline"]["calls"], 1)
+        self.assertLess(summary["Pipeline"]["wallTime"], 0.03)
+        self.assertAlmostEqual(sum(stats["wallTime"] for stats in
+                                   summary.values()), elapsed, delta=0.01)
+
+    def test_exception(self):
+
+        # Failed calls aren't recorded, and don't leave their nested time
+        # behind to be taken from later calls
+        chunk = Image(np.zeros((4, 4, 1)))
+        outer = Outer(seconds=0, inner=Fail())
+        with Profiler() as profiler:
+            self.assertRaises(ValueError, Outer(seconds=0, inner=outer),
+                              chunk)
+            Outer(seconds=0.05, inner=Sleep(seconds=0.05))(chunk)
+        self.assertEqual(profiler._local.stack, [])
+        self.assertNotIn("Fail", profiler.summary())
+        self.assertEqual(total(profiler, "Outer", "calls"), 1)
+        self.assertAlmostEqual(total(profiler, "Outer", "wallTime"), 0.05,
+                               delta=0.03)
+
+    def test_executors(self):
+        context = LocalContext(numWorkers=2)
+        image = Image(np.zeros((8, 6, 1)))
+        with Profiler(context) as profiler:
+            rdd = ImageToRDD(context=context, numSplits=4)(image)
+            RDDToImage()((Sleep(seconds=0.01) | Sleep(seconds=0))(rdd))
+
+        records = profiler.all_records()
+        ranks = sorted(rank for name, rank in records if name == "Sleep")
+        self.assertEqual(ranks, [(i, 0, 0) for i in range(4)])
+        self.assertEqual(total(profiler, "Sleep", "calls"), 8)
+
+    def test_threads(self):
+
+        # Partitions running on threads at the same time, after profiling
+        # was disabled, each record their own calls
+        context = LocalContext(numWorkers=4, threads=True)
+        image = Image(np.zeros((16, 6, 1)))
+        with Profiler(context) as profiler:
+            rdd = ImageToRDD(context=context, numSplits=16)(image)
+            rdd = (Sleep(seconds=0.01) | Sleep(seconds=0.01))(rdd)
+        rdd.collect()
+        self.assertEqual(total(profiler, "Sleep", "calls"), 32)
+        ranks = [rank for name, rank in profiler.all_records()
+                 if name == "Sleep"]
+        self.assertEqual(sorted(ranks), [(i, 0, 0) for i in range(16)])
+        self.assertNotIn("Sleep", [name for name, _ in profiler.records])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import unittest
+import numpy as np
+
+from sipl.image import Image
+from sipl.spark import (ImageToRDD, RDDToImage, DownsampleRDD, BuildPyramid,
+                        Pyramid, LocalContext)
+from sipl.spark.pyramid import axis_blocks
+
+
+def area_average(data, factor):
+    """ Average factor x factor blocks of the whole image, with the partial
+    blocks at the far edges averaged over the pixels they have """
+    sums = data.astype(np.float64)
+    counts = np.ones(data.shape[:2])
+    for axis in range(2):
+        starts = np.arange(0, data.shape[axis], factor)
+        sums = np.add.reduceat(sums, starts, axis)
+        counts = np.add.reduceat(counts, starts, axis)
+    return sums / counts.reshape(counts.shape + (1,) * (data.ndim - 2))
+
+
+class DownsampleRDDTest(unittest.TestCase):
+
+    def setUp(self):
+        self.context = LocalContext(numWorkers=3, threads=True)
+        self.data = np.random.rand(25, 31, 3)
+
+    def downsample(self, data, factor, **params):
+        image = Image(data)
+        image.metadata["filename"] = "pyramid.raw"
+        rdd = ImageToRDD(context=self.context, **params)(image)
+        return rdd, DownsampleRDD(factor=factor)(rdd)
+
+    def test_row_strips(self):
+
+        # The strips end at rows 9 and 17, inside blocks of 2 and 4
+        for factor in [2, 3, 4]:
+            _, rdd = self.downsample(self.data, factor, numSplits=3)
+            self.assertTrue(np.allclose(RDDToImage()(rdd),
+                                        area_average(self.data, factor)))
+
+    def test_tiles(self):
+        for factor in [2, 3]:
+            _, rdd = self.downsample(self.data, factor, tileShape=(7, 9))
+            self.assertTrue(np.allclose(RDDToImage()(rdd),
+                                        area_average(self.data, factor)))
+
+    def test_halo(self):
+        _, rdd = self.downsample(self.data, 2, numSplits=3, halo=2)
+        self.assertTrue(np.allclose(RDDToImage()(rdd),
+                                    area_average(self.data, 2)))
+
+    def test_integer_rounding(self):
+        data = np.random.randint(0, 256, (25, 31, 1)).astype(np.uint8)
+        _, rdd = self.downsample(data, 2, numSplits=4)
+        result = RDDToImage()(rdd)
+        self.assertEqual(result.dtype, np.uint8)
+        self.assertTrue(np.array_equal(
+            result, np.rint(area_average(data, 2)).astype(np.uint8)))
+
+    def test_keeps_layout(self):
+        rdd, downsampled = self.downsample(self.data, 2, tileShape=(10, 12))
+        ranks = sorted(tuple(d["proc_grid_rank"] for d in chunk._dimData)
+                       for chunk in rdd.collect())
+        chunks = downsampled.collect()
+        self.assertEqual(sorted(tuple(d["proc_grid_rank"]
+                                      for d in chunk._dimData)
+                                for chunk in chunks), ranks)
+        for chunk in chunks:
+            self.assertEqual(chunk.metadata["filename"], "pyramid.raw")
+            self.assertEqual([d["size"] for d in chunk._dimData[:2]],
+                             [13, 16])
+            self.assertEqual(tuple(d["stop"] - d["start"]
+                                   for d in chunk._dimData[:2]),
+                             chunk.shape[:2])
+
+    def test_recompute(self):
+
+        # Merging the same pieces again must not downsample the dimData twice
+        _, rdd = self.downsample(self.data, 2, numSplits=3)
+        first = [chunk._dimData.tolist() for chunk in rdd.collect()]
+        second = [chunk._dimData.tolist() for chunk in rdd.collect()]
+        self.assertEqual(first, second)
+
+    def test_small_chunks(self):
+        with self.assertRaises(ValueError):
+            self.downsample(self.data, 4, numSplits=12)[1].collect()
+
+
+class AxisBlocksTest(unittest.TestCase):
+
+    def test_straddling_block_goes_to_later_chunk(self):
+
+        # Block 2 holds pixels 4 and 5, which are split between the chunks.
+        # The later chunk holds its last pixel, so owns it.
+        first, last, counts, shared = axis_blocks(
+            {"start": 0, "stop": 5, "size": 10}, 2)
+        self.assertEqual((first, last, list(counts), shared),
+                         (0, 3, [2, 2, 1], True))
+        first, last, counts, shared = axis_blocks(
+            {"start": 5, "stop": 10, "size": 10}, 2)
+        self.assertEqual((first, last, list(counts), shared),
+                         (2, 5, [1, 2, 2], False))
+
+    def test_partial_last_block(self):
+        first, last, counts, shared = axis_blocks(
+            {"start": 6, "stop": 11, "size": 11}, 2)
+        self.assertEqual((first, last, list(counts), shared),
+                         (3, 6, [2, 2, 1], False))
+
+
+class BuildPyramidTest(unittest.TestCase):
+
+    def test_levels(self):
+        context = LocalContext(numWorkers=2, threads=True)
+        data = np.random.rand(40, 36, 1)
+        rdd = ImageToRDD(context=context, numSplits=4)(Image(data))
+        pyramid = BuildPyramid(levels=3, factor=2)(rdd)
+
+        self.assertIsInstance(pyramid, Pyramid)
+        self.assertEqual((len(pyramid), pyramid.factor), (4, 2))
+        self.assertIs(pyramid[0], rdd)
+        expected = data
+        for level in range(4):
+            self.assertTrue(np.allclose(RDDToImage(level=level)(pyramid),
+                                        expected))
+            expected = area_average(expected, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from sipl.image import Image
+from sipl.image.image import (METADATA_REF, _sharedMetadata, shared_metadata,
+                              write_shared_metadata, refer_metadata)
+from sipl.spark import ImageToRDD, RDDToImage, LocalContext
+from sipl.hdfs import RDDToHDFS, HDFSToRDD
+
+
+class SharedMetadataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "metadata.json")
+        self.context = LocalContext(numWorkers=2, threads=True)
+        self.image = Image(np.arange(40 * 6 * 3, dtype=np.uint16)
+                           .reshape((40, 6, 3)))
+        self.image.metadata.update({"filename": "a.tif", "bands": [1, 2]})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        _sharedMetadata.clear()
+
+    def test_refer(self):
+        ref = write_shared_metadata(self.path, self.image.metadata)
+        chunk = refer_metadata(self.image[:10], ref)
+        chunk.metadata["row"] = 0
+        self.assertEqual(sorted(chunk._meta), [METADATA_REF, "row"])
+        self.assertEqual(chunk.metadata.copy(),
+                         {"filename": "a.tif", "bands": [1, 2], "row": 0})
+
+        # Another process reads the sidecar the first time it is needed
+        _sharedMetadata.clear()
+        self.assertEqual(shared_metadata(ref),
+                         {"filename": "a.tif", "bands": [1, 2]})
+
+    def test_rewritten_at_same_path(self):
+
+        # A later job rewrites the sidecar. Its chunks get the new metadata,
+        # even in a process which cached the old one.
+        old = write_shared_metadata(self.path, {"filename": "a.tif"})
+        shared_metadata(old)
+        new = write_shared_metadata(self.path, {"filename": "b.tif"})
+        self.assertNotEqual(old, new)
+        _sharedMetadata.pop(new)
+        self.assertEqual(shared_metadata(new), {"filename": "b.tif"})
+
+        # A process which never read the old sidecar can't read it any more
+        _sharedMetadata.clear()
+        self.assertRaises(IOError, shared_metadata, old)
+
+    def test_same_contents(self):
+        self.assertEqual(write_shared_metadata(self.path, {"a": 1}),
+                         write_shared_metadata(self.path, {"a": 1}))
+
+    def test_image_to_rdd(self):
+        rdd = ImageToRDD(context=self.context, numSplits=4,
+                         metadataFile=self.path)(self.image)
+        for chunk in rdd.collect():
+            self.assertEqual(list(chunk._meta), [METADATA_REF])
+            self.assertEqual(chunk.metadata.copy(),
+                             self.image.metadata.copy())
+        image = RDDToImage()(rdd)
+        self.assertEqual(image.metadata.copy(), self.image.metadata.copy())
+
+    def test_chunk_store(self):
+        path = os.path.join(self.directory, "store")
+        rdd = ImageToRDD(context=self.context, numSplits=3)(self.image)
+        RDDToHDFS(filename=path, format="chunks", shareMetadata=True)(rdd)
+        _sharedMetadata.clear()
+        image = RDDToImage()(HDFSToRDD(context=self.context)(path))
+        self.assertTrue(np.array_equal(image, self.image))
+        self.assertEqual(image.metadata.copy(), self.image.metadata.copy())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+import numpy as np
+
+from sipl.image import Image
+from sipl.spark import ImageStatistics, ImageToRDD, LocalContext
+from sipl.spark.statistics import (chunk_statistics, merge_statistics,
+                                   BLOCK_PIXELS)
+
+
+class ImageStatisticsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.context = LocalContext(numWorkers=3, threads=True)
+
+    def to_rdd(self, data, **params):
+        return ImageToRDD(context=self.context, **params)(Image(data))
+
+    def assertMoments(self, stats, data):
+        values = data.reshape((-1, data.shape[-1]))
+        self.assertEqual(stats["count"], len(values))
+        self.assertTrue(np.allclose(stats["mean"], values.mean(axis=0)))
+        self.assertTrue(np.allclose(stats["std"], values.std(axis=0)))
+        self.assertTrue(np.array_equal(stats["min"], values.min(axis=0)))
+        self.assertTrue(np.array_equal(stats["max"], values.max(axis=0)))
+
+    def test_uint8(self):
+        data = np.random.randint(0, 256, (120, 90, 3)).astype(np.uint8)
+        for input in [Image(data), self.to_rdd(data, numSplits=4)]:
+            stats = ImageStatistics()(input)
+            self.assertMoments(stats, data)
+            for channel in range(3):
+                self.assertTrue(np.array_equal(
+                    stats["histogram"][channel],
+                    np.bincount(data[:, :, channel].ravel(), minlength=256)))
+            self.assertEqual(len(stats["binEdges"]), 257)
+
+    def test_large_offset(self):
+
+        # A sum of squares cancels to nothing at this offset
+        data = 1e8 + np.random.rand(100, 100, 1)
+        for input in [Image(data), self.to_rdd(data, numSplits=7)]:
+            stats = ImageStatistics(bins=None)(input)
+            self.assertAlmostEqual(stats["std"][0], data.std(), places=6)
+            self.assertAlmostEqual(stats["mean"][0], data.mean(), places=6)
+
+    def test_blocks(self):
+
+        # Chunks larger than a block are reduced a block at a time
+        data = np.random.rand(BLOCK_PIXELS // 100 + 3, 100, 2) * 1000
+        self.assertMoments(ImageStatistics()(Image(data)), data)
+
+    def test_without_bins(self):
+        data = np.random.rand(20, 30, 2).astype(np.float32)
+        for bins in [None, 0]:
+            stats = ImageStatistics(bins=bins)(self.to_rdd(data))
+            self.assertIsNone(stats["histogram"])
+            self.assertIsNone(stats["binEdges"])
+            self.assertMoments(stats, data)
+
+    def test_adaptive_range(self):
+        data = np.random.rand(40, 30, 1) * 10 - 5
+        stats = ImageStatistics(bins=10)(self.to_rdd(data, numSplits=3))
+        self.assertAlmostEqual(stats["binEdges"][0], data.min())
+        self.assertAlmostEqual(stats["binEdges"][-1], data.max())
+        self.assertEqual(stats["histogram"].sum(), data.size)
+
+    def test_nan(self):
+        data = np.random.rand(30, 20, 2)
+        data[3, 4, 0] = np.nan
+        data[:, :, 1] = np.nan
+        stats = ImageStatistics(bins=16)(self.to_rdd(data, numSplits=3))
+        self.assertEqual(stats["min"][0], np.nanmin(data[:, :, 0]))
+        self.assertEqual(stats["max"][0], np.nanmax(data[:, :, 0]))
+        self.assertTrue(np.isnan(stats["min"][1]))
+        self.assertEqual(stats["histogram"][0].sum(), data[:, :, 0].size - 1)
+        self.assertEqual(stats["histogram"][1].sum(), 0)
+
+    def test_halo_is_left_out(self):
+        data = np.random.randint(0, 100, (30, 20, 1)).astype(np.int16)
+        stats = ImageStatistics()(self.to_rdd(data, numSplits=3, halo=2))
+        self.assertMoments(stats, data)
+
+    def test_merge_empty(self):
+        data = np.random.rand(5, 4, 2)
+        partial = chunk_statistics(Image(data))
+        empty = chunk_statistics(Image(np.zeros((0, 4, 2))))
+        self.assertEqual(empty["count"], 0)
+        for merged in [merge_statistics(partial, empty),
+                       merge_statistics(empty, partial),
+                       merge_statistics(None, partial)]:
+            self.assertTrue(np.allclose(merged["mean"], partial["mean"]))
+            self.assertTrue(np.allclose(merged["m2"], partial["m2"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
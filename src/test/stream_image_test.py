@@ -0,0 +1,132 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from PIL import Image as PILImage
+
+from sipl.image import Image, StreamImageOut, PILImageIn, PILImageOut
+from sipl.image.pilImage import read_pil_window
+from sipl.spark import ImageToRDD, LocalContext
+
+
+class StreamImageOutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.context = LocalContext(numWorkers=3, threads=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def chunks(self, data, **params):
+        params.setdefault("tileShape", (23, 17))
+        params.setdefault("halo", 2)
+        return ImageToRDD(context=self.context, **params)(Image(data))
+
+    def test_raw(self):
+        data = np.random.rand(50, 40, 2).astype(np.float32)
+        StreamImageOut(filename=self.path("image.raw"))(self.chunks(data))
+        written = np.fromfile(self.path("image.raw"), np.float32)
+        self.assertTrue(np.array_equal(written.reshape(data.shape), data))
+
+    def test_ppm(self):
+        for name, shape, dtype in [("image.ppm", (50, 40, 3), np.uint8),
+                                   ("image.pgm", (50, 40), np.uint8),
+                                   ("deep.ppm", (50, 40, 3), np.uint16)]:
+            data = np.random.randint(0, 2 ** 16, shape).astype(dtype)
+            StreamImageOut(filename=self.path(name))(
+                self.chunks(data, numSplits=4, tileShape=None))
+            if dtype == np.uint8:
+                read = np.asarray(PILImage.open(self.path(name)))
+            else:
+                with open(self.path(name), "rb") as f:
+                    f.read(len("P6\n40 50\n65535\n"))
+                    read = np.fromstring(f.read(), ">u2").reshape(shape)
+            self.assertTrue(np.array_equal(read, data), name)
+
+    def test_ppm_dtype(self):
+        data = np.zeros((10, 10, 3), np.float32)
+        self.assertRaises(ValueError,
+                          StreamImageOut(filename=self.path("image.ppm")),
+                          Image(data))
+
+    def test_tiff(self):
+        for compression, predictor in [("deflate", True), ("deflate", False),
+                                       (None, True)]:
+            for shape, dtype in [((70, 90, 3), np.uint8),
+                                 ((70, 90, 1), np.uint16),
+                                 ((70, 90, 4), np.uint8)]:
+                data = np.random.randint(0, 255, shape).astype(dtype)
+                name = self.path("image.tif")
+                StreamImageOut(filename=name, tileShape=(32, 48),
+                               compression=compression,
+                               predictor=predictor,
+                               numThreads=2)(
+                    self.chunks(data, tileShape=(24, 20)))
+
+                # Pillow and the tile reader both read it back
+                self.assertTrue(np.array_equal(
+                    np.asarray(PILImageIn()(name)).reshape(shape), data))
+                self.assertTrue(np.array_equal(
+                    read_pil_window(name, ((10, 60), (5, 80))).reshape(
+                        (50, 75, shape[2])),
+                    data[10:60, 5:80]))
+
+    def test_tiff_float(self):
+        data = np.random.rand(40, 30, 1).astype(np.float32)
+        name = self.path("image.tiff")
+        StreamImageOut(filename=name, tileShape=(16, 16))(self.chunks(data))
+        self.assertTrue(np.array_equal(
+            read_pil_window(name).reshape(data.shape), data))
+
+    def test_out_of_order(self):
+        data = np.random.randint(0, 255, (64, 64, 3)).astype(np.uint8)
+        chunks = self.chunks(data, tileShape=(16, 16), halo=0).collect()
+        np.random.shuffle(chunks)
+        StreamImageOut(filename=self.path("image.tif"),
+                       tileShape=(32, 32))(chunks)
+        self.assertTrue(np.array_equal(PILImageIn()(self.path("image.tif")),
+                                       data))
+
+    def test_single_image(self):
+        data = np.random.randint(0, 255, (20, 30, 3)).astype(np.uint8)
+        PILImageOut(filename=self.path("image.ppm"))(self.chunks(data))
+        self.assertTrue(np.array_equal(PILImageIn()(self.path("image.ppm")),
+                                       data))
+        for image in [Image(data), data]:
+            StreamImageOut(filename=self.path("image.raw"))(image)
+            self.assertTrue(np.array_equal(
+                np.fromfile(self.path("image.raw"),
+                            np.uint8).reshape(data.shape), data))
+        StreamImageOut(filename=self.path("image.tif"))(data)
+        self.assertTrue(np.array_equal(PILImageIn()(self.path("image.tif")),
+                                       data))
+
+    def test_errors(self):
+        data = np.random.randint(0, 255, (40, 40, 3)).astype(np.uint8)
+        chunks = self.chunks(data, numSplits=4, tileShape=None).collect()
+        for name in ["image.raw", "image.tif"]:
+            self.assertRaises(ValueError,
+                              StreamImageOut(filename=self.path(name)),
+                              chunks[:-1])
+        self.assertRaises(ValueError,
+                          StreamImageOut(filename=self.path("image.raw")),
+                          [])
+        self.assertRaises(ValueError,
+                          StreamImageOut(filename=self.path("image.jpg")),
+                          chunks)
+        self.assertRaises(ValueError,
+                          StreamImageOut(filename=self.path("image"),
+                                         format="bmp"), chunks)
+        self.assertRaises(IOError, StreamImageOut(), chunks)
+        self.assertRaises(ValueError,
+                          StreamImageOut(filename=self.path("image.tif"),
+                                         compression="lzw"), chunks)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,175 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+from PIL import Image as PILImage
+
+from sipl.image import PILImageIn
+from sipl.spark import DirectoryStream, LocalContext
+from sipl.spark.streaming import Checkpoint
+
+
+class CountingImageIn(PILImageIn):
+
+    """ A reader which records the files it read """
+
+    read = []
+
+    def _open(self, filename, **kwargs):
+        CountingImageIn.read.append(os.path.basename(filename))
+        return PILImageIn._open(self, filename, **kwargs)
+
+
+class DirectoryStreamTest(unittest.TestCase):
+
+    def setUp(self):
+
+        # Ten files, which arrived a second apart a minute ago
+        self.directory = tempfile.mkdtemp()
+        self.frames = os.path.join(self.directory, "frames")
+        os.makedirs(self.frames)
+        self.names = ["frame%02d.png" % i for i in range(10)]
+        for i, name in enumerate(self.names):
+            path = os.path.join(self.frames, name)
+            PILImage.fromarray(np.full((4, 6, 3), i, np.uint8)).save(path)
+            modified = time.time() - 60 + i
+            os.utime(path, (modified, modified))
+        self.checkpoint = os.path.join(self.directory, "checkpoint")
+        CountingImageIn.read = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def stream(self, **params):
+        params.setdefault("batchSize", 3)
+        params.setdefault("minAge", 0)
+        params.setdefault("interval", 0.01)
+        params.setdefault("timeout", 0.1)
+        params.setdefault("checkpoint", self.checkpoint)
+        return DirectoryStream(**params)
+
+    def names_of(self, batch):
+        return [os.path.basename(path) for path in batch.files]
+
+    def test_batches(self):
+        stream = self.stream()
+        batches = []
+        for batch in stream(self.frames):
+            self.assertEqual([int(image[0, 0, 0]) for image in
+                              batch.images],
+                             [int(name[5:7]) for name in
+                              self.names_of(batch)])
+            batches.append(self.names_of(batch))
+        self.assertEqual(batches, [self.names[0:3], self.names[3:6],
+                                   self.names[6:9], self.names[9:]])
+        self.assertEqual([stats["backlog"] for stats in stream.stats],
+                         [7, 4, 1, 0])
+        self.assertEqual([stats["batch"] for stats in stream.stats],
+                         [0, 1, 2, 3])
+
+    def test_restart(self):
+
+        # Stop while the second batch is being processed
+        stream = self.stream()
+        batches = stream(self.frames)
+        first = next(batches)
+        second = next(batches)
+        self.assertEqual(self.names_of(first), self.names[:3])
+        batches.close()
+        self.assertEqual(Checkpoint(self.checkpoint).consumed,
+                         set(first.files))
+
+        # The second batch is streamed again, and the first isn't
+        stream = self.stream()
+        restarted = list(stream(self.frames))
+        self.assertEqual(restarted[0].files, second.files)
+        self.assertEqual(restarted[0].index, 1)
+        self.assertEqual(sum(len(batch.files) for batch in restarted), 7)
+        checkpoint = Checkpoint(self.checkpoint)
+        self.assertEqual(checkpoint.batches, 4)
+        self.assertEqual(len(checkpoint.consumed), 10)
+
+        # Nothing is left after a full run
+        self.assertEqual(list(self.stream()(self.frames)), [])
+
+    def test_explicit_commit(self):
+        batches = self.stream()(self.frames)
+        next(batches).commit()
+        batches.close()
+        self.assertEqual(len(Checkpoint(self.checkpoint).consumed), 3)
+
+    def test_torn_checkpoint(self):
+
+        # A line cut short by a crash is ignored, with anything after it
+        list(self.stream(batchSize=5)(self.frames))
+        with open(self.checkpoint) as f:
+            lines = f.readlines()
+        with open(self.checkpoint, "w") as f:
+            f.write(lines[0] + lines[1][:10])
+        self.assertEqual(Checkpoint(self.checkpoint).batches, 1)
+        batches = list(self.stream(batchSize=5)(self.frames))
+        self.assertEqual(self.names_of(batches[0]), self.names[5:])
+
+    def test_new_files(self):
+
+        # Files which arrive later, or are too new, wait for a later batch
+        path = os.path.join(self.frames, "late.png")
+        PILImage.fromarray(np.zeros((4, 6, 3), np.uint8)).save(path)
+        batches = list(self.stream(batchSize=20, minAge=30)(self.frames))
+        self.assertEqual([len(batch.files) for batch in batches], [10])
+        batches = list(self.stream(batchSize=20)(self.frames))
+        self.assertEqual(self.names_of(batches[0]), ["late.png"])
+
+    def test_read_ahead(self):
+
+        # While the first batch is processed, one batch waits in the queue
+        # and the reader holds one more, so only three are read
+        stream = self.stream(batchSize=1, maxPending=1,
+                             reader=CountingImageIn)
+        batches = stream(self.frames)
+        next(batches)
+        time.sleep(0.3)
+        self.assertEqual(len(CountingImageIn.read), 3)
+        rest = list(batches)
+        self.assertEqual(len(rest), 9)
+        self.assertEqual(CountingImageIn.read, self.names)
+
+        # Without reading ahead only the requested batch is read
+        CountingImageIn.read = []
+        os.remove(self.checkpoint)
+        batches = self.stream(batchSize=1, maxPending=0,
+                              reader=CountingImageIn)(self.frames)
+        next(batches)
+        time.sleep(0.1)
+        self.assertEqual(CountingImageIn.read, self.names[:1])
+        batches.close()
+
+    def test_batch_bytes(self):
+        size = os.path.getsize(os.path.join(self.frames, self.names[0]))
+        batches = list(self.stream(batchSize=10, batchBytes=size * 2.5)(
+            self.frames))
+        self.assertEqual(len(batches[0].files), 2)
+
+        # A file larger than batchBytes still makes a batch on its own
+        batches = list(self.stream(batchBytes=1, checkpoint=None)(
+            self.frames))
+        self.assertEqual([len(batch.files) for batch in batches], [1] * 10)
+
+    def test_context(self):
+        context = LocalContext(numWorkers=2, threads=True)
+        stream = self.stream(context=context, numSplits=2)
+        batches = list(stream(self.frames))
+        self.assertEqual(len(batches), 4)
+        for batch in batches:
+            images = batch.images.collect()
+            self.assertEqual(len(images), len(batch.files))
+            self.assertEqual(sorted(image.metadata["filename"] for image
+                                    in images), sorted(batch.files))
+        self.assertEqual(len(stream.stats), 4)
+        self.assertIn("MB/s", stream.report())
+
+
+if __name__ == "__main__":
+    unittest.main()